@@ -0,0 +1,346 @@
+# coding=utf-8
+
+'''
+    Multi-account connection sharing
+
+    Every sub-account of an exchange shares a single middleware: one vendor
+    client, connection pool, Bitmex Swagger spec and public market data
+    cache. Only the signing credentials are kept per account; they are
+    selected for the duration of each call through a context variable read
+    by the shared vendor clients (see sharedCredentials on the middlewares).
+'''
+
+import asyncio
+import contextvars
+import functools
+import importlib
+import inspect
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .dispatch import runOn
+from .errors import EvoxError
+
+
+_credentials = contextvars.ContextVar('evoxCredentials', default=None)
+
+MIDDLEWARES = {
+    'binance': ('.binanceMiddleware', 'BinanceMiddleware'),
+    'bitmex': ('.bitmexMiddleware', 'BitmexMiddleware'),
+    'bitfinex': ('.bitfinexMiddleware', 'BitfinexMiddleware'),
+}
+
+PUBLIC_METHODS = frozenset(['fetchTicker', 'fetchOrderBook', 'fetchOHLCV', 'fetchTrades'])
+
+
+class AccountException(EvoxError):
+    pass
+
+
+def currentCredentials():
+    '''
+        :returns: tuple (key, secret) of the account of the current call or None
+    '''
+    return _credentials.get()
+
+
+class ContextCredentials(object):
+    '''
+        Vendor client mixin resolving API_KEY and API_SECRET to the
+        credentials of the account of the current call.
+    '''
+
+    @property
+    def API_KEY(self):
+        credentials = _credentials.get()
+        return credentials[0] if credentials is not None else self.__dict__.get('_apiKey')
+
+    @API_KEY.setter
+    def API_KEY(self, value):
+        self.__dict__['_apiKey'] = value
+
+    @property
+    def API_SECRET(self):
+        credentials = _credentials.get()
+        return credentials[1] if credentials is not None else self.__dict__.get('_apiSecret')
+
+    @API_SECRET.setter
+    def API_SECRET(self, value):
+        self.__dict__['_apiSecret'] = value
+
+
+MISSING = object()
+
+
+class PublicCache(object):
+    '''
+        Time-to-live cache of the public market data calls shared by the accounts
+
+        Entries are kept oldest first, so expired entries and, past maxSize,
+        the oldest ones are dropped from the front when a value is set.
+
+        Attributes
+        ------------
+        ttl : float
+            Seconds an entry is served
+
+        maxSize : int
+            Max entries kept
+    '''
+
+    def __init__(self, ttl=1.0, maxSize=1024):
+        self.ttl = ttl
+        self.maxSize = maxSize
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key)
+        if entry is not None and time.monotonic() - entry[0] < self.ttl:
+            return entry[1]
+        return default
+
+    def set(self, key, value):
+        now = time.monotonic()
+        with self._lock:
+            entries = self._entries
+            entries.pop(key, None)
+            entries[key] = (now, value)
+            while entries:
+                oldest = next(iter(entries))
+                if len(entries) <= self.maxSize and now - entries[oldest][0] < self.ttl:
+                    break
+                del entries[oldest]
+
+
+class Account(object):
+    '''
+        Sub-account handle with the middleware API of its exchange.
+        Calls run on the shared middleware with the account credentials.
+    '''
+    __slots__ = ('name', '_credentials', '_manager')
+
+    def __init__(self, name, key, secret, manager):
+        self.name = name
+        self._credentials = (key, secret)
+        self._manager = manager
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        method = getattr(self._manager.middleware, name)
+        if not callable(method):
+            return method
+        if name in PUBLIC_METHODS and self._manager.cache is not None:
+            return self._manager._cached(name, method)
+        if inspect.iscoroutinefunction(method):
+            return self._wrapAsync(method)
+        return self._wrap(method)
+
+    def _wrap(self, method):
+        credentials = self._credentials
+
+        def call(*args, **kwargs):
+            token = _credentials.set(credentials)
+            try:
+                result = method(*args, **kwargs)
+            finally:
+                _credentials.reset(token)
+            if inspect.isgenerator(result):
+                return _pages(result, credentials)
+            if inspect.isasyncgen(result):
+                return _asyncPages(result, credentials)
+            return result
+        return call
+
+    def _wrapAsync(self, method):
+        credentials = self._credentials
+
+        async def call(*args, **kwargs):
+            token = _credentials.set(credentials)
+            try:
+                return await method(*args, **kwargs)
+            finally:
+                _credentials.reset(token)
+        return call
+
+
+def _pages(pages, credentials):
+    # Paginated methods fetch lazily, the credentials are set around every page
+    while True:
+        token = _credentials.set(credentials)
+        try:
+            page = next(pages)
+        except StopIteration:
+            return
+        finally:
+            _credentials.reset(token)
+        yield page
+
+
+async def _asyncPages(pages, credentials):
+    while True:
+        token = _credentials.set(credentials)
+        try:
+            page = await pages.__anext__()
+        except StopAsyncIteration:
+            return
+        finally:
+            _credentials.reset(token)
+        yield page
+
+
+def _cacheKey(name, args, kwargs):
+    # None (not cached) for unhashable arguments, e.g. a list of symbols
+    key = (name, args, tuple(sorted(kwargs.items())))
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+class AccountManager(object):
+    '''
+        Sub-accounts of an exchange sharing one middleware
+
+        Attributes
+        ------------
+        exchange : str
+            binance, bitmex or bitfinex
+
+        cacheTtl : float
+            Seconds a public market data response is shared. None disables the cache.
+
+        maxWorkers : int
+            Concurrent calls of the batch operations
+
+        params : dict
+            Passed to the middleware sharedCredentials (e.g. test=True for Bitmex)
+    '''
+
+    def __init__(self, exchange, cacheTtl=1.0, maxWorkers=16, **params):
+        if exchange not in MIDDLEWARES:
+            raise AccountException(f'Exchange not implemented ({exchange}).')
+        module, name = MIDDLEWARES[exchange]
+        middleware = getattr(importlib.import_module(module, __package__), name)
+
+        self.exchange = exchange
+        self.middleware = middleware.sharedCredentials(**params)
+        self.cache = PublicCache(cacheTtl) if cacheTtl else None
+        self._accounts = {}
+        self._executor = ThreadPoolExecutor(max_workers=maxWorkers)
+
+    def addAccount(self, name, key, secret):
+        '''
+            :returns: Account
+        '''
+        account = self._accounts[name] = Account(name, key, secret, self)
+        return account
+
+    def removeAccount(self, name):
+        self._accounts.pop(name, None)
+
+    def account(self, name):
+        try:
+            return self._accounts[name]
+        except KeyError:
+            raise AccountException(f'Unknown account ({name}).')
+
+    @property
+    def accounts(self):
+        return list(self._accounts)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    def _cached(self, name, method):
+        cache = self.cache
+
+        if inspect.iscoroutinefunction(method):
+            async def call(*args, **kwargs):
+                key = _cacheKey(name, args, kwargs)
+                if key is None:
+                    return await method(*args, **kwargs)
+                result = cache.get(key, MISSING)
+                if result is MISSING:
+                    result = await method(*args, **kwargs)
+                    cache.set(key, result)
+                return result
+            return call
+
+        def call(*args, **kwargs):
+            key = _cacheKey(name, args, kwargs)
+            if key is None:
+                return method(*args, **kwargs)
+            result = cache.get(key, MISSING)
+            if result is MISSING:
+                result = method(*args, **kwargs)
+                cache.set(key, result)
+            return result
+        return call
+
+    def _targets(self, method, accounts):
+        names = list(self._accounts) if accounts is None else list(accounts)
+        return names, [getattr(self.account(name), method) for name in names]
+
+    def map(self, method, *args, accounts=None, **kwargs):
+        '''
+            Run a middleware method for many accounts concurrently,
+            e.g. manager.map('fetchBalance') for the balances of every sub-account.
+            Coroutine methods cannot be mapped from a running event loop: await mapAsync.
+
+            :param method: required
+            :type method: str
+            :param accounts: - Default every account.
+            :type accounts: list
+
+            :returns: dictionary {account name: result or the exception raised}
+        '''
+        if inspect.iscoroutinefunction(getattr(self.middleware, method)):
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                coroutine = self.mapAsync(method, *args, accounts=accounts, **kwargs)
+                loop = getattr(self.middleware, 'loop', None)
+                if isinstance(loop, asyncio.AbstractEventLoop):
+                    return runOn(loop, coroutine)
+                return asyncio.run(coroutine)
+            raise AccountException(f'Coroutine method ({method}) in a running event loop, '
+                                   f'await mapAsync instead.')
+
+        names, targets = self._targets(method, accounts)
+
+        def run(target):
+            try:
+                return target(*args, **kwargs)
+            except Exception as error:
+                return error
+
+        return dict(zip(names, self._executor.map(run, targets)))
+
+    async def mapAsync(self, method, *args, accounts=None, **kwargs):
+        '''
+            Awaitable version of map, for callers running in an event loop.
+            Synchronous methods run in the executor of the manager.
+
+            :param method: required
+            :type method: str
+            :param accounts: - Default every account.
+            :type accounts: list
+
+            :returns: dictionary {account name: result or the exception raised}
+        '''
+        names, targets = self._targets(method, accounts)
+        if inspect.iscoroutinefunction(getattr(self.middleware, method)):
+            calls = [target(*args, **kwargs) for target in targets]
+        else:
+            loop = asyncio.get_running_loop()
+            calls = [loop.run_in_executor(self._executor, functools.partial(target, *args, **kwargs))
+                     for target in targets]
+        return dict(zip(names, await asyncio.gather(*calls, return_exceptions=True)))
+
@@ -9,10 +9,164 @@
     # Python-Binance: https://python-binance.readthedocs.io/en/latest/
 '''
 
+import inspect
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 from binance.client import Client
 from binance.enums import *
 from binance.exceptions import *
 
+from .accountManager import ContextCredentials, currentCredentials
+from .errors import (TRANSIENT_ERRORS, EvoxError, InvalidOrder, Transient, exchangeErrors,
+                     wrap)
+from .jsonCodec import BinanceKline, decodeList, loads
+from .pagination import apaginate, idCursor, paginate, windowPage
+from .tickerEngine import binanceBars
+from .tracing import span, traceSession
+
+
+class BinanceException(EvoxError):
+    pass
+
+
+BINANCE_ERRORS = exchangeErrors(BinanceException)
+
+# Failures of python-binance raised as BinanceException
+VENDOR_ERRORS = (BinanceAPIException, BinanceRequestException,
+                 BinanceOrderException) + TRANSIENT_ERRORS
+
+# Window of a startTime only request of orders and trades
+WINDOW_MS = 24 * 60 * 60 * 1000
+
+
+def _number(value):
+    return float(value) if value is not None else None
+
+
+def restTicker(ticker):
+    '''
+        24 hours REST ticker with the keys and float values of TickerEngine.ticker.
+    '''
+    bidPrice = _number(ticker.get('bidPrice'))
+    bidQty = _number(ticker.get('bidQty'))
+    askPrice = _number(ticker.get('askPrice'))
+    askQty = _number(ticker.get('askQty'))
+    both = bidPrice is not None and askPrice is not None
+    midPrice = (bidPrice + askPrice) / 2.0 if both else None
+    microPrice = midPrice
+    if both and bidQty is not None and askQty is not None and bidQty + askQty > 0:
+        microPrice = (bidPrice * askQty + askPrice * bidQty) / (bidQty + askQty)
+    closeTime = ticker.get('closeTime')
+    updateTime = closeTime / 1000.0 if closeTime is not None else None
+    return {'symbol': ticker.get('symbol'),
+            'bidPrice': bidPrice,
+            'bidQty': bidQty,
+            'askPrice': askPrice,
+            'askQty': askQty,
+            'midPrice': midPrice,
+            'spread': askPrice - bidPrice if both else None,
+            'microPrice': microPrice,
+            'lastPrice': _number(ticker.get('lastPrice')),
+            'lastQty': _number(ticker.get('lastQty')),
+            'vwap': _number(ticker.get('weightedAvgPrice')),
+            'weightedAvgPrice': _number(ticker.get('weightedAvgPrice')),
+            'openPrice': _number(ticker.get('openPrice')),
+            'highPrice': _number(ticker.get('highPrice')),
+            'lowPrice': _number(ticker.get('lowPrice')),
+            'volume': _number(ticker.get('volume')),
+            'quoteVolume': _number(ticker.get('quoteVolume')),
+            'count': ticker.get('count'),
+            'priceChange': _number(ticker.get('priceChange')),
+            'priceChangePercent': _number(ticker.get('priceChangePercent')),
+            'updateTime': updateTime,
+            'age': time.time() - updateTime if updateTime is not None else None,
+            'stale': False}
+
+
+def _binanceError(error):
+    # Invalid (non JSON) responses come from overloaded gateways
+    kind = Transient if isinstance(error, BinanceRequestException) else None
+    return wrap(error, 'binance', BINANCE_ERRORS, kind)
+
+
+class FastDecodingClient(Client):
+    '''
+        python-binance client decoding successful responses with the
+        fastest JSON decoder installed (see jsonCodec).
+        Error responses keep the original handling.
+        Calls traced by a TracingMiddleware are split into prepare, sign,
+        send, wait and decode spans.
+    '''
+
+    # Older python-binance versions read the response from self.response
+    _LEGACY_HANDLER = 'response' not in inspect.signature(Client._handle_response).parameters
+
+    def _init_session(self):
+        return traceSession(super()._init_session())
+
+    def _get_request_kwargs(self, method, signed, force_params=False, **kwargs):
+        with span('prepare'):
+            return super()._get_request_kwargs(method, signed, force_params, **kwargs)
+
+    def _generate_signature(self, data):
+        with span('sign'):
+            return super()._generate_signature(data)
+
+    def _handle_response(self, response=None):
+        if response is None:
+            response = self.response
+        else:
+            self.response = response
+
+        if not 200 <= response.status_code < 300:
+            if self._LEGACY_HANDLER:
+                return super()._handle_response()
+            return super()._handle_response(response)
+        try:
+            with span('decode'):
+                return loads(response.content)
+        except ValueError:
+            raise BinanceRequestException(f'Invalid Response: {response.text}')
+
+    def decodeResponse(self, response, schema):
+        '''
+            Decode a raw response straight into a list of typed rows.
+        '''
+        if not 200 <= response.status_code < 300:
+            return self._handle_response(response)
+        try:
+            with span('decode'):
+                return decodeList(response.content, schema)
+        except ValueError:
+            raise BinanceRequestException(f'Invalid Response: {response.text}')
+
+
+class SharedCredentialsClient(ContextCredentials, FastDecodingClient):
+    '''
+        Client shared by the sub-accounts of an AccountManager.
+        The key header and the signature use the credentials of the
+        account of the current call.
+    '''
+
+    # The last response is kept per thread, since accounts call concurrently
+    @property
+    def response(self):
+        return getattr(self.__dict__.setdefault('_responses', threading.local()), 'value', None)
+
+    @response.setter
+    def response(self, value):
+        self.__dict__.setdefault('_responses', threading.local()).value = value
+
+    def _request(self, method, uri, signed, force_params=False, **kwargs):
+        credentials = currentCredentials()
+        if credentials is not None:
+            headers = dict(kwargs.get('headers') or {})
+            headers['X-MBX-APIKEY'] = credentials[0]
+            kwargs['headers'] = headers
+        return super()._request(method, uri, signed, force_params, **kwargs)
+
 
 class BinanceMiddleware(object):
     '''
@@ -25,16 +179,63 @@ class BinanceMiddleware(object):
 
         secret : str
             The secret key from Binance API account
+
+        riskEngine : RiskEngine
+            Pre-trade checks of every order, if sent
+
+        client : Client
+            python-binance client to use instead of a new one
+
+        tickerEngine : TickerEngine
+            fetchTicker is served from memory while the stream data is fresh, if sent
     '''
 
-    def __init__(self, key, secret):
-        self._client = Client(api_key=key,
-                              api_secret=secret)
+    def __init__(self, key, secret, riskEngine=None, client=None, tickerEngine=None):
+        if client is None:
+            client = FastDecodingClient(api_key=key,
+                                        api_secret=secret)
+        self._client = client
+        self._riskEngine = riskEngine
+        self._tickerEngine = tickerEngine
+        if riskEngine is not None and tickerEngine is not None:
+            riskEngine.follow(tickerEngine)
+
+    @classmethod
+    def sharedCredentials(cls, **params):
+        '''
+            Middleware shared by the sub-accounts of an AccountManager.
+        '''
+        client = SharedCredentialsClient(api_key=None, api_secret=None)
+        return cls(None, None, client=client, **params)
 
     @property
     def client(self):
         return self._client
 
+    def _checkRisk(self, symbol, side, quantity, price):
+        if self._riskEngine is None:
+            return
+        if not price and self._riskEngine.needsPrice(str(symbol)):
+            # Market orders are valued at the last price
+            try:
+                ticker = self.client.get_symbol_ticker(symbol=str(symbol))
+            except VENDOR_ERRORS as error:
+                print('Error fetching the reference price.')
+                raise _binanceError(error)
+            self._riskEngine.updatePrice(str(symbol), ticker['price'])
+        return self._riskEngine.check(str(symbol), side, quantity, price)
+
+    def _acceptedRisk(self, symbol, price, orderId, reservation):
+        # Only limit orders stay open
+        if self._riskEngine is not None and price:
+            self._riskEngine.onOrderAccepted(str(symbol), orderId, reservation)
+        else:
+            self._releaseRisk(symbol, reservation)
+
+    def _releaseRisk(self, symbol, reservation):
+        if self._riskEngine is not None:
+            self._riskEngine.release(str(symbol), reservation)
+
     def createLimitOrder(self, symbol, side, quantity, price=None):
         '''
             Post a new order for spot account.
@@ -52,13 +253,17 @@ class BinanceMiddleware(object):
 
             :returns: orderId, type integer
         '''
+        reservation = self._checkRisk(symbol, side, quantity, price)
+
         orderType = ORDER_TYPE_LIMIT
         timeInForce = TIME_IN_FORCE_GTC
 
         try:
             side = SIDE_BUY if side.lower() == 'buy' else SIDE_SELL
         except AttributeError:
-            raise AttributeError('Error setting order side (buy or sell).')
+            self._releaseRisk(symbol, reservation)
+            raise BINANCE_ERRORS[InvalidOrder]('Error setting order side (buy or sell).',
+                                               exchange='binance')
         
         if price and price != 0 :
             try:
@@ -68,32 +273,13 @@ class BinanceMiddleware(object):
                                                 quantity=float(quantity),
                                                 price=str(price),
                                                 timeInForce=timeInForce)
+                self._acceptedRisk(symbol, price, order['orderId'], reservation)
                 return order['orderId']
 
-            except BinanceRequestException as error:
-                print(f'Error creating limit order ({side}).')
-                raise BaseException(error.message)
-            except BinanceAPIException as error:
-                print(f'Error creating limit order ({side}).')
-                raise BaseException(error.message)
-            except BinanceOrderMinAmountException as error:
+            except VENDOR_ERRORS as error:
+                self._releaseRisk(symbol, reservation)
                 print(f'Error creating limit order ({side}).')
-                raise BaseException(error.message)
-            except BinanceOrderMinPriceException as error:
-                print(f'Error creating limit order ({side}).')
-                raise BaseException(error.message)
-            except BinanceOrderMinTotalException as error:
-                print(f'Error creating limit order ({side}).')
-                raise BaseException(error.message)
-            except BinanceOrderUnknownSymbolException as error:
-                print(f'Error creating limit order ({side}).')
-                raise BaseException(error.message)
-            except BinanceOrderInactiveSymbolException as error:
-                print(f'Error creating limit order ({side}).')
-                raise BaseException(error.message)
-            except BinanceOrderException as error:
-                print(f'Error creating limit order ({side}).')
-                raise BaseException(error.message)
+                raise _binanceError(error)
         else:
             try:
                 order = self.client.create_order(symbol=str(symbol),
@@ -101,32 +287,118 @@ class BinanceMiddleware(object):
                                                 type=orderType,
                                                 quantity=float(quantity),
                                                 timeInForce=timeInForce)
+                self._acceptedRisk(symbol, price, order['orderId'], reservation)
                 return order['orderId']
 
-            except BinanceRequestException as error:
-                print(f'Error creating limit order ({side}).')
-                raise BaseException(error.message)
-            except BinanceAPIException as error:
-                print(f'Error creating limit order ({side}).')
-                raise BaseException(error.message)
-            except BinanceOrderMinAmountException as error:
-                print(f'Error creating limit order ({side}).')
-                raise BaseException(error.message)
-            except BinanceOrderMinPriceException as error:
-                print(f'Error creating limit order ({side}).')
-                raise BaseException(error.message)
-            except BinanceOrderMinTotalException as error:
+            except VENDOR_ERRORS as error:
+                self._releaseRisk(symbol, reservation)
                 print(f'Error creating limit order ({side}).')
-                raise BaseException(error.message)
-            except BinanceOrderUnknownSymbolException as error:
-                print(f'Error creating limit order ({side}).')
-                raise BaseException(error.message)
-            except BinanceOrderInactiveSymbolException as error:
-                print(f'Error creating limit order ({side}).')
-                raise BaseException(error.message)
-            except BinanceOrderException as error:
-                print(f'Error creating limit order ({side}).')
-                raise BaseException(error.message)
+                raise _binanceError(error)
+
+    def amendOrder(self, orderId, price=None, quantity=None, symbol=None, side=None,
+                   clientOrderId=None):
+        '''
+            Replace a spot limit order with a new price and/or quantity in a single
+            request (cancel-replace). The exchange order id changes; when the
+            clientOrderId is sent the new order keeps it, so the linkage survives.
+            The risk engine closes the old id and counts the new one.
+            Side, price or quantity not sent are read from the order first
+            (one more request).
+
+            :param orderId: required
+            :type orderId: int
+            :param price: -
+            :type price: str
+            :param quantity: -
+            :type quantity: decimal
+            :param symbol: required
+            :type symbol: str
+            :param side: -
+            :type side: str
+            :param clientOrderId: -
+            :type clientOrderId: str
+
+            :returns: dictionary with the new order (newOrderResponse)
+
+            API Response Example
+            --------
+            {
+                "symbol": "BTCUSDT",
+                "orderId": 28,
+                "orderListId": -1,
+                "clientOrderId": "mm-bid-1",
+                "transactTime": 1507725176595,
+                "price": "9475.50000000",
+                "origQty": "0.10000000",
+                "executedQty": "0.00000000",
+                "status": "NEW",
+                "timeInForce": "GTC",
+                "type": "LIMIT",
+                "side": "BUY"
+            }
+        '''
+        if symbol is None:
+            raise BINANCE_ERRORS[InvalidOrder]('Symbol is required to amend an order.',
+                                               exchange='binance')
+        symbol = str(symbol)
+
+        try:
+            if side is None or price is None or quantity is None:
+                order = self.client.get_order(symbol=symbol, orderId=orderId)
+                side = side or order['side']
+                price = price if price is not None else order['price']
+                if quantity is None:
+                    quantity = float(order['origQty']) - float(order['executedQty'])
+
+            side = SIDE_BUY if side.lower() == 'buy' else SIDE_SELL
+            if self._riskEngine is not None:
+                self._riskEngine.check(symbol, side, quantity, price, newOrder=False)
+
+            params = {'symbol': symbol,
+                      'side': side,
+                      'type': ORDER_TYPE_LIMIT,
+                      'timeInForce': TIME_IN_FORCE_GTC,
+                      'quantity': float(quantity),
+                      'price': str(price),
+                      'cancelReplaceMode': 'STOP_ON_FAILURE',
+                      'cancelOrderId': orderId}
+            if clientOrderId is not None:
+                params['cancelOrigClientOrderId'] = str(clientOrderId)
+                params['newClientOrderId'] = str(clientOrderId)
+                del params['cancelOrderId']
+
+            order = self.client._post('order/cancelReplace', True, data=params)['newOrderResponse']
+            if self._riskEngine is not None:
+                self._riskEngine.onOrderClosed(symbol, orderId)
+                self._riskEngine.applyOrder(order)
+            return order
+
+        except AttributeError:
+            raise BINANCE_ERRORS[InvalidOrder]('Error setting order side (buy or sell).',
+                                               exchange='binance')
+        except VENDOR_ERRORS as error:
+            print(f'Error amending order ({orderId}).')
+            raise _binanceError(error)
+
+    def amendOrders(self, amendments):
+        '''
+            Amend many orders concurrently, e.g. every quote of a ladder.
+
+            :param amendments: required - amendOrder arguments, e.g. [{"orderId": 28, "symbol": "BTCUSDT", "price": "9476.0"}]
+            :type amendments: list
+
+            :returns: list with the new order or the exception raised, in the same order
+        '''
+        def amend(amendment):
+            try:
+                return self.amendOrder(**amendment)
+            except Exception as error:
+                return error
+
+        if not amendments:
+            return []
+        with ThreadPoolExecutor(max_workers=min(len(amendments), 16)) as executor:
+            return list(executor.map(amend, amendments))
 
     def createMarginOrder(self, symbol, side, quantity, price=None):
         '''
@@ -145,13 +417,17 @@ class BinanceMiddleware(object):
 
             :returns: orderId, type integer
         '''
+        reservation = self._checkRisk(symbol, side, quantity, price)
+
         orderType = ORDER_TYPE_LIMIT
         timeInForce = TIME_IN_FORCE_GTC
 
         try:
             side = SIDE_BUY if side.lower() == 'buy' else SIDE_SELL
         except AttributeError:
-            raise BaseException('Error setting order side (buy or sell).')
+            self._releaseRisk(symbol, reservation)
+            raise BINANCE_ERRORS[InvalidOrder]('Error setting order side (buy or sell).',
+                                               exchange='binance')
         if price and price != 0:
             try:
                 order = self.client.create_margin_order(symbol=str(symbol),
@@ -160,10 +436,12 @@ class BinanceMiddleware(object):
                                                         quantity=float(quantity),
                                                         price=str(price),
                                                         timeInForce=timeInForce)
+                self._acceptedRisk(symbol, price, order['orderId'], reservation)
                 return order['orderId']
-            except BinanceAPIException as error:
-                print(error.message)
-                raise BaseException(f'Error creating margin order ({side}).')
+            except VENDOR_ERRORS as error:
+                self._releaseRisk(symbol, reservation)
+                print(f'Error creating margin order ({side}).')
+                raise _binanceError(error)
         else:
             try:
                 order = self.client.create_margin_order(symbol=str(symbol),
@@ -171,17 +449,23 @@ class BinanceMiddleware(object):
                                                         type=orderType,
                                                         quantity=float(quantity),
                                                         timeInForce=timeInForce)
+                self._acceptedRisk(symbol, price, order['orderId'], reservation)
                 return order['orderId']
-            except BinanceAPIException as error:
-                print(error.message)
-                raise BaseException(f'Error creating margin order ({side}).')
+            except VENDOR_ERRORS as error:
+                self._releaseRisk(symbol, reservation)
+                print(f'Error creating margin order ({side}).')
+                raise _binanceError(error)
 
-    def fetchOHLCV(self, market, interval='1d', limit=500):
+    def fetchOHLCV(self, market, interval='1d', limit=500, typed=False):
         '''
             Kline/candlestick bars for a symbol.
             Klines are uniquely identified by their open time.
             OHLC means open, high, close and volume.
             1 day interval is default.
+            Available options: [1m,5m,15m,30m,1h,4h,1d,1w,1M]. Other intervals (e.g. 2h, 3d)
+            are aggregated from the longest of them dividing the interval, in a single
+            request (at most 1000 base candles), and returned
+            as lists [open time, open, high, low, close, volume], oldest first.
 
             :param symbol: required
             :type symbol: str
@@ -189,8 +473,10 @@ class BinanceMiddleware(object):
             :type interval: str
             :param limit: - Default 500; max 1000.
             :type limit: int
+            :param typed: - Default False. Decode the raw response straight into BinanceKline rows.
+            :type typed: boolean
 
-            :returns: list of lists or None if not found
+            :returns: list of lists (list of BinanceKline if typed) or None if not found
 
             API Response Example
             --------
@@ -232,66 +518,113 @@ class BinanceMiddleware(object):
             elif interval == '1M':
                 interval = KLINE_INTERVAL_1MONTH
             else:
-                print('Interval not implemented.')
+                # Imported here: NumPy is only required for derived intervals
+                from .resampler import deriveOHLCV
+                candles = deriveOHLCV(self, 'binance', market, interval, limit,
+                                      [KLINE_INTERVAL_1MINUTE, KLINE_INTERVAL_5MINUTE,
+                                       KLINE_INTERVAL_15MINUTE, KLINE_INTERVAL_30MINUTE,
+                                       KLINE_INTERVAL_1HOUR, KLINE_INTERVAL_4HOUR,
+                                       KLINE_INTERVAL_1DAY, KLINE_INTERVAL_1WEEK])
+                return [BinanceKline(*candle) for candle in candles] if typed else candles
+
+            # Raw responses are only decoded by FastDecodingClient
+            if typed and isinstance(self.client, FastDecodingClient):
+                # Same timeout and proxies as the client requests
+                response = self.client.session.get(f'{self.client.API_URL}/v3/klines',
+                                                   params={'symbol': str(market),
+                                                           'interval': str(interval),
+                                                           'limit': int(limit)},
+                                                   **(self.client._requests_params or {}))
+                return self.client.decodeResponse(response, BinanceKline)
 
             candles = self.client.get_klines(symbol=str(market),
                                              interval=str(interval),
                                              limit=int(limit))
 
-            return candles
+            return [BinanceKline(*candle) for candle in candles] if typed else candles
 
-        except BinanceAPIException as error:
-            print('Error fetching candlesticks.')
-            raise BaseException(error.message)
-        except BinanceRequestException as error:
+        except VENDOR_ERRORS as error:
             print('Error fetching candlesticks.')
-            raise BaseException(error.message)
+            raise _binanceError(error)
 
     def fetchTicker(self, symbol):
         '''
             Fetch latest ticker data by trading symbol.
             24 hours price change statistics.
+            Served by the ticker engine, when it has fresh stream data of the symbol
+            (its 24 hours window is seeded once from 1 minute klines).
+            Otherwise, it is read from the REST 24 hours ticker, with the same keys
+            (see restTicker; the rolling vwap is then the 24 hours one).
+
+            :param symbol: required
+            :type symbol: str
+
+            :returns: dictionary (see TickerEngine.ticker)
+        '''
+        try:
+            symbol = str(symbol)
+            if self._tickerEngine is not None and self._tickerEngine.isFresh(symbol):
+                if not self._tickerEngine.coversDay(symbol):
+                    self._seedDay(symbol)
+                return self._tickerEngine.ticker(symbol)
+            return restTicker(self.client.get_ticker(symbol=symbol))
+
+        except VENDOR_ERRORS as error:
+            print('Error fetching ticker.')
+            raise _binanceError(error)
+
+    def _seedDay(self, symbol):
+        # 1 minute klines of the 24 hours before the stream (two requests)
+        end = int(time.time() * 1000)
+        start = end - WINDOW_MS
+        klines = []
+        cursor = start
+        while cursor < end:
+            page = self.client.get_klines(symbol=symbol, interval=KLINE_INTERVAL_1MINUTE,
+                                          startTime=cursor, limit=1000)
+            if not page:
+                break
+            klines.extend(page)
+            cursor = page[-1][0] + 60000
+        self._tickerEngine.seedDay(symbol, binanceBars(klines), since=start / 1000.0)
+
+    def fetchOrderBook(self, symbol, limit=100):
+        '''
+            Fetch the order book (market depth) by trading symbol.
 
             :param symbol: required
             :type symbol: str
+            :param limit: - Default 100; valid limits: [5, 10, 20, 50, 100, 500, 1000, 5000].
+            :type limit: int
 
             :returns: dictionary with API response
 
             API Response Example
             --------
             {
-                "symbol": "BNBBTC",
-                "priceChange": "-94.99999800",
-                "priceChangePercent": "-95.960",
-                "weightedAvgPrice": "0.29628482",
-                "prevClosePrice": "0.10002000",
-                "lastPrice": "4.00000200",
-                "lastQty": "200.00000000",
-                "bidPrice": "4.00000000",
-                "askPrice": "4.00000200",
-                "openPrice": "99.00000000",
-                "highPrice": "100.00000000",
-                "lowPrice": "0.10000000",
-                "volume": "8913.30000000",
-                "quoteVolume": "15.30000000",
-                "openTime": 1499783499040,
-                "closeTime": 1499869899040,
-                "firstId": 28385,   // First tradeId
-                "lastId": 28460,    // Last tradeId
-                "count": 76         // Trade count
+                "lastUpdateId": 1027024,
+                "bids": [
+                    [
+                        "4.00000000",     // PRICE
+                        "431.00000000"    // QTY
+                    ]
+                ],
+                "asks": [
+                    [
+                        "4.00000200",
+                        "12.00000000"
+                    ]
+                ]
             }
         '''
         try:
             symbol = str(symbol)
-            return self.client.get_ticker(symbol=symbol)
+            return self.client.get_order_book(symbol=symbol,
+                                              limit=int(limit))
 
-        except BinanceAPIException as error:
-            print('Error fetching ticker.')
-            raise BaseException(error.message)
-
-        except BinanceRequestException as error:
-            print('Error fetching ticker.')
-            raise BaseException(error.message)
+        except VENDOR_ERRORS as error:
+            print('Error fetching order book.')
+            raise _binanceError(error)
 
     def fetchBalance(self, *args):
         '''
@@ -323,13 +656,9 @@ class BinanceMiddleware(object):
                 balances = self.client.get_account()['balances']
                 return balances
 
-        except BinanceAPIException as error:
+        except VENDOR_ERRORS as error:
             print('Error fetching asset balance.')
-            raise BaseException(error.message)
-
-        except BinanceRequestException as error:
-            print('Error fetching asset balance.')
-            raise BaseException(error.message)
+            raise _binanceError(error)
 
     def fetchOpenOrders(self, *args):
         '''
@@ -374,13 +703,27 @@ class BinanceMiddleware(object):
             else:
                 return self.client.get_open_orders()
 
-        except BinanceAPIException as error:
+        except VENDOR_ERRORS as error:
             print('Error fetching all open orders.')
-            raise BaseException(error.message)
+            raise _binanceError(error)
 
-        except BinanceRequestException as error:
-            print('Error fetching all open orders.')
-            raise BaseException(error.message)
+    def fetchOrder(self, symbol, orderId):
+        '''
+            Fetch an order (open, filled, canceled or expired) by id.
+
+            :param symbol: required
+            :type symbol: str
+            :param orderId: required
+            :type orderId: int
+
+            :returns: dictionary with API response (same structure as fetchOpenOrders)
+        '''
+        try:
+            return self.client.get_order(symbol=str(symbol), orderId=int(orderId))
+
+        except VENDOR_ERRORS as error:
+            print(f'Error fetching order ({orderId}).')
+            raise _binanceError(error)
 
     def fetchOpenBuyOrders(self, *args):
         '''
@@ -430,7 +773,7 @@ class BinanceMiddleware(object):
 
         except Exception as error:
             print('Error fetching open buy orders.')
-            raise Exception(error)
+            raise _binanceError(error)
 
     def fetchOpenSellOrders(self, *args):
         '''
@@ -480,7 +823,129 @@ class BinanceMiddleware(object):
 
         except Exception as error:
             print('Error fetching open sell orders.')
-            raise Exception(error)
+            raise _binanceError(error)
+
+    def _fetchOrdersPage(self, symbol, cursor, limit):
+        try:
+            return self.client.get_all_orders(symbol=symbol, limit=limit, **cursor)
+
+        except VENDOR_ERRORS as error:
+            print('Error fetching all orders.')
+            raise _binanceError(error)
+
+    def _fetchTradesPage(self, symbol, cursor, limit):
+        try:
+            return self.client.get_my_trades(symbol=symbol, limit=limit, **cursor)
+
+        except VENDOR_ERRORS as error:
+            print('Error fetching trade history.')
+            raise _binanceError(error)
+
+    def _ordersCursor(self, symbol, startTime, limit):
+        symbol = str(symbol)
+        limit = int(limit)
+        cursor = {'startTime': int(startTime)} if startTime else {'orderId': 0}
+        # startTime pages cover 24 hours windows
+        return (lambda cursor: windowPage(
+                    lambda cursor: self._fetchOrdersPage(symbol, cursor, limit), cursor, WINDOW_MS),
+                cursor,
+                idCursor('orderId', 'orderId', limit))
+
+    def _tradesCursor(self, symbol, startTime, fromId, limit):
+        symbol = str(symbol)
+        limit = int(limit)
+        if fromId is not None:
+            cursor = {'fromId': int(fromId)}
+        elif startTime:
+            cursor = {'startTime': int(startTime)}
+        else:
+            cursor = {'fromId': 0}
+        return (lambda cursor: windowPage(
+                    lambda cursor: self._fetchTradesPage(symbol, cursor, limit), cursor, WINDOW_MS),
+                cursor,
+                idCursor('id', 'fromId', limit))
+
+    def fetchAllOrders(self, symbol, startTime=None, limit=1000, prefetch=False):
+        '''
+            Fetch all orders (active, canceled or filled) on a symbol,
+            oldest first, one page at a time.
+            Pages are requested lazily with an orderId cursor.
+
+            :param symbol: required
+            :type symbol: str
+            :param startTime: - Default None (first order). Timestamp in ms of the first page,
+                empty 24 hours windows after it are skipped.
+            :type startTime: int
+            :param limit: - Default 1000; max 1000.
+            :type limit: int
+            :param prefetch: - Default False. Fetch the next page while the current one is consumed.
+            :type prefetch: boolean
+
+            :returns: generator of lists of dictionaries with API response (same structure as fetchOpenOrders)
+        '''
+        return paginate(*self._ordersCursor(symbol, startTime, limit),
+                        prefetch=prefetch)
+
+    def fetchAllOrdersAsync(self, symbol, startTime=None, limit=1000, prefetch=False):
+        '''
+            Async version of fetchAllOrders.
+
+            :returns: async generator of lists of dictionaries with API response
+        '''
+        return apaginate(*self._ordersCursor(symbol, startTime, limit),
+                         prefetch=prefetch)
+
+    def fetchMyTrades(self, symbol, startTime=None, fromId=None, limit=1000, prefetch=False):
+        '''
+            Fetch the trades of the account on a symbol,
+            oldest first, one page at a time.
+            Pages are requested lazily with a fromId cursor.
+
+            :param symbol: required
+            :type symbol: str
+            :param startTime: - Default None. Timestamp in ms of the first page,
+                empty 24 hours windows after it are skipped.
+            :type startTime: int
+            :param fromId: - Default None (first trade). Trade id of the first page.
+            :type fromId: int
+            :param limit: - Default 1000; max 1000.
+            :type limit: int
+            :param prefetch: - Default False. Fetch the next page while the current one is consumed.
+            :type prefetch: boolean
+
+            :returns: generator of lists of dictionaries with API response
+
+            API Response Example
+            --------
+            [
+                {
+                    "symbol": "BNBBTC",
+                    "id": 28457,
+                    "orderId": 100234,
+                    "orderListId": -1,
+                    "price": "4.00000100",
+                    "qty": "12.00000000",
+                    "quoteQty": "48.000012",
+                    "commission": "10.10000000",
+                    "commissionAsset": "BNB",
+                    "time": 1499865549590,
+                    "isBuyer": true,
+                    "isMaker": false,
+                    "isBestMatch": true
+                }
+            ]
+        '''
+        return paginate(*self._tradesCursor(symbol, startTime, fromId, limit),
+                        prefetch=prefetch)
+
+    def fetchMyTradesAsync(self, symbol, startTime=None, fromId=None, limit=1000, prefetch=False):
+        '''
+            Async version of fetchMyTrades.
+
+            :returns: async generator of lists of dictionaries with API response
+        '''
+        return apaginate(*self._tradesCursor(symbol, startTime, fromId, limit),
+                         prefetch=prefetch)
 
 
 if __name__ == '__main__':
@@ -9,17 +9,174 @@
     # Websockets: https://github.com/bitfinexcom/bitfinex-api-py/blob/master/docs/ws_v2.md
 '''
 
-import os
-import sys
+import re
 import asyncio
+import json
 import time
 
+import aiohttp
 # import bfxapi
 from bfxapi import Client
 from bfxapi.rest.bfx_rest import BfxRest
+from bfxapi.utils.auth import generate_auth_headers
 
+from .accountManager import ContextCredentials
+from .dispatch import EventLoopThread
+from .errors import EvoxError, InsufficientFunds, InvalidOrder, exchangeErrors, wrap
+from .jsonCodec import BitfinexCandle, decodeList
+from .pagination import EndCursor, apaginate
+from .tracing import isTracing, record, span
 
-class BitfinexException(Exception):
+
+# Milliseconds of the candle timeframes (a month counts as 31 days)
+TIMEFRAMES = {'1m': 60000, '5m': 300000, '15m': 900000, '30m': 1800000,
+              '1h': 3600000, '3h': 10800000, '6h': 21600000, '12h': 43200000,
+              '1D': 86400000, '7D': 604800000, '14D': 1209600000, '1M': 2678400000}
+
+
+# bfxapi errors read "POST <url> failed with status 500 - ["error",10020,"symbol: invalid"]"
+ERROR_PATTERN = re.compile(r'status (\d{3})(?: - \["error",\s*(\d+))?')
+
+
+class BitfinexException(EvoxError):
+    pass
+
+
+BITFINEX_ERRORS = exchangeErrors(BitfinexException)
+
+
+def _bitfinexError(error):
+    code = status = None
+    if not isinstance(error, EvoxError):
+        match = ERROR_PATTERN.search(str(error))
+        if match is not None:
+            status = int(match.group(1))
+            code = int(match.group(2)) if match.group(2) else None
+    return wrap(error, 'bitfinex', BITFINEX_ERRORS, code=code, status=status)
+
+
+def _rejectedOrder(notification):
+    # e.g. "Invalid order: not enough exchange balance for -1.0 tBTCUSD at 9000.0"
+    text = str(notification.text)
+    kind = InsufficientFunds if 'not enough' in text else InvalidOrder
+    return BITFINEX_ERRORS[kind](text, exchange='bitfinex')
+
+
+class AsyncRateLimiter(object):
+    '''
+        Async context manager limiting the requests in flight and
+        spacing them to a number of requests per minute.
+    '''
+
+    def __init__(self, requestsPerMinute=60, concurrency=8):
+        self.interval = 60.0 / requestsPerMinute
+        self._concurrency = concurrency
+        self._loop = None
+        self._semaphore = None
+        self._lock = None
+        self._next = 0.0
+
+    async def __aenter__(self):
+        # Bound to the running event loop (asyncio.run creates a new one every call)
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self._concurrency)
+            self._lock = asyncio.Lock()
+        await self._semaphore.acquire()
+        async with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return self
+
+    async def __aexit__(self, *exc):
+        self._semaphore.release()
+        return False
+
+
+class TracedRest(BfxRest):
+    '''
+        bfxapi rest client splitting the calls traced by a TracingMiddleware
+        into prepare, sign, wait (request sent until the response headers
+        arrive), send (body download) and decode spans. Requests, responses
+        and errors are the same as BfxRest.
+    '''
+
+    async def fetch(self, endpoint, params=""):
+        if not isTracing():
+            return await super().fetch(endpoint, params)
+        with span('prepare'):
+            url = '{}/{}{}'.format(self.host, endpoint, params)
+        async with aiohttp.ClientSession() as session:
+            status, text = await self._send(session.get(url))
+        if status != 200:
+            raise Exception('GET {} failed with status {} - {}'.format(url, status, text))
+        return self._decode(text)
+
+    async def post(self, endpoint, data={}, params=""):
+        if not isTracing():
+            return await super().post(endpoint, data, params)
+        with span('prepare'):
+            url = '{}/{}'.format(self.host, endpoint)
+            sData = json.dumps(data)
+        with span('sign'):
+            headers = generate_auth_headers(self.API_KEY, self.API_SECRET, endpoint, sData)
+        headers["content-type"] = "application/json"
+        async with aiohttp.ClientSession() as session:
+            status, text = await self._send(session.post(url + params, headers=headers, data=sData))
+        if status < 200 or status > 299:
+            raise Exception('POST {} failed with status {} - {}'.format(url, status, text))
+        return self._decode(text)
+
+    @staticmethod
+    async def _send(request, raw=False):
+        start = time.perf_counter_ns()
+        async with request as response:
+            headers = time.perf_counter_ns()
+            text = await (response.read() if raw else response.text())
+            end = time.perf_counter_ns()
+        record('wait', start, headers, status=response.status)
+        record('send', headers, end)
+        return response.status, text
+
+    def _decode(self, text):
+        with span('decode'):
+            return json.loads(text, parse_float=getattr(self, 'parse_float', float))
+
+    async def fetchRows(self, endpoint, schema, params=""):
+        '''
+            GET decoded straight from the raw body into a list of typed rows
+            (see jsonCodec.decodeList).
+        '''
+        with span('prepare'):
+            url = '{}/{}{}'.format(self.host, endpoint, params)
+        async with aiohttp.ClientSession() as session:
+            status, body = await self._send(session.get(url), raw=True)
+        if status != 200:
+            raise Exception('GET {} failed with status {} - {}'.format(
+                url, status, body.decode(errors='replace')))
+        with span('decode'):
+            return decodeList(body, schema)
+
+
+def traceRest(rest):
+    '''
+        Turn a bfxapi rest client into a TracedRest.
+        TracedRest adds no state, so the client keeps its settings.
+    '''
+    if type(rest) is BfxRest:
+        rest.__class__ = TracedRest
+    return rest
+
+
+class SharedCredentialsRest(ContextCredentials, TracedRest):
+    '''
+        Rest client shared by the sub-accounts of an AccountManager.
+        Requests are signed with the credentials of the account of the current call.
+    '''
     pass
 
 
@@ -34,19 +191,53 @@ class BitfinexMiddleware(object):
 
         secret : str
             The secret key from Bitfinex API account
+
+        client : BfxRest
+            Rest client to use instead of a new one
+
+        requestsPerMinute : int
+            Rate limit of the concurrent range fetches. Default 60.
+
+        concurrency : int
+            Requests in flight of the concurrent range fetches. Default 8.
     '''
+    ORDER_TYPE_LIMIT = 'EXCHANGE LIMIT'
+    ORDER_TYPE_MARKET = 'EXCHANGE MARKET'
 
     def __init__(self, *args, **params):
         # self._client = BfxRest(API_KEY=params.get('api_key', None),
         #                        API_SECRET=params.get('api_secret', None))
-        self._client = Client(API_KEY=params.get('api_key', None),
-                              API_SECRET=params.get('api_secret', None)).rest
+        self._client = params.get('client', None)
+        if self._client is None:
+            self._client = Client(API_KEY=params.get('api_key', None),
+                                  API_SECRET=params.get('api_secret', None)).rest
+        # Calls traced by a TracingMiddleware are split into phase spans
+        traceRest(self._client)
+        self._rateLimiter = AsyncRateLimiter(params.get('requestsPerMinute', 60),
+                                             params.get('concurrency', 8))
+        self._loopThread = EventLoopThread('bitfinex-loop')
+
+    @classmethod
+    def sharedCredentials(cls, **params):
+        '''
+            Middleware shared by the sub-accounts of an AccountManager.
+        '''
+        return cls(client=SharedCredentialsRest(API_KEY=None, API_SECRET=None), **params)
 
     @property
     def client(self):
         return self._client
 
-    async def fetchOHLCV(self, market, interval='1D', limit=100, section='hist'):
+    @property
+    def loop(self):
+        '''
+            Event loop of the middleware, running in its own thread.
+            Synchronous callers (dispatch.call) run the coroutines on it.
+        '''
+        return self._loopThread.loop
+
+    async def fetchOHLCV(self, market, interval='1D', limit=100, section='hist',
+                         start=None, end=None, sort=-1, typed=False):
         '''
             Available values: '1m', '5m', '15m', '30m', '1h', '3h', '6h', '12h', '1D', '7D', '14D', '1M
             Kline/candlestick bars for a symbol.
@@ -58,43 +249,476 @@ class BitfinexMiddleware(object):
             :type symbol: str
             :param interval: -
             :type interval: str
-            :param limit: - Default 500; max 1000.
+            :param limit: - Default 100; max 10000.
             :type limit: int
+            :param start: - Default None. Timestamp in ms of the oldest candle.
+            :type start: int
+            :param end: - Default None (now). Timestamp in ms of the newest candle.
+            :type end: int
+            :param sort: - Default -1 (newest first); 1 oldest first.
+            :type sort: int
+            :param typed: - Default False. Decode the raw response straight into BitfinexCandle rows.
+            :type typed: boolean
 
-            :returns: list of lists or empty list if not found
+            :returns: list of lists with API response (list of BitfinexCandle if typed)
 
             API Response Example
             --------
             [
                 [
-                    1499040000000,      # Open time
-                    "0.01634790",       # Open
-                    "0.80000000",       # High
-                    "0.01575800",       # Low
-                    "0.01577100",       # Close
-                    "148976.11427815",  # Volume
-                    1499644799999,      # Close time
-                    "2434.19055334",    # Quote asset volume
-                    308,                # Number of trades
-                    "1756.87402397",    # Taker buy base asset volume
-                    "28.46694368",      # Taker buy quote asset volume
-                    "17928899.62484339" # Can be ignored
+                    1499040000000,  # Open time
+                    8744.9,         # Open
+                    8756.1,         # Close
+                    8761.0,         # High
+                    8730.5,         # Low
+                    123.45603413    # Volume
                 ]
             ]
         '''
         try:
             market = str(market).upper()
             market = f't{market}'
+            start = int(start) if start is not None else ''
+            end = int(end) if end is not None else ''
+            if typed and isinstance(self.client, TracedRest):
+                # Endpoint and parameters of BfxRest.get_public_candles
+                return await self.client.fetchRows(f'candles/trade:{interval}:{market}/{section}',
+                                                   BitfinexCandle,
+                                                   params=f'?start={start}&end={end}'
+                                                          f'&limit={limit}&sort={int(sort)}')
+
             candles = await self.client.get_public_candles(symbol=market,
                                                            section=section,
-                                                           start='',
-                                                           end='',
+                                                           start=start,
+                                                           end=end,
                                                            tf=interval,
-                                                           limit=str(limit))
+                                                           limit=str(limit),
+                                                           sort=int(sort))
+
+            return [BitfinexCandle(*candle) for candle in candles] if typed else candles
+        except Exception as error:
+            print('Error fetching candlesticks (OHLCV).')
+            raise _bitfinexError(error)
+
+    async def fetchOHLCVRange(self, market, interval, start, end=None, chunk=10000):
+        '''
+            Candles of a time range, oldest first.
+            The range is split in chunks of up to chunk candles fetched
+            concurrently under the middleware rate limiter.
+
+            :param market: required
+            :type market: str
+            :param interval: required
+            :type interval: str
+            :param start: required - Timestamp in ms of the oldest candle.
+            :type start: int
+            :param end: - Default None (now). Timestamp in ms of the newest candle.
+            :type end: int
+            :param chunk: - Default 10000 (max candles of a request).
+            :type chunk: int
+
+            :returns: list of lists with API response
+        '''
+        if interval not in TIMEFRAMES:
+            raise BitfinexException(f'Interval not implemented ({interval}).')
+        start = int(start)
+        end = int(end) if end else int(time.time() * 1000)
+        window = TIMEFRAMES[interval] * int(chunk)
+
+        async def fetchChunk(chunkStart):
+            async with self._rateLimiter:
+                return await self.fetchOHLCV(market, interval, limit=chunk,
+                                             start=chunkStart,
+                                             end=min(chunkStart + window - 1, end),
+                                             sort=1)
+
+        chunks = await asyncio.gather(*(fetchChunk(chunkStart)
+                                        for chunkStart in range(start, end + 1, window)))
+        candles = {}
+        for rows in chunks:
+            for row in rows:
+                candles[row[0]] = row
+        return [candles[mts] for mts in sorted(candles)]
+
+    async def fetchOrderBook(self, market, precision='P0', length=25):
+        '''
+            Fetch the order book by trading symbol.
+            Positive amounts are bids and negative amounts are asks.
+
+            :param market: required
+            :type market: str
+            :param precision: - Default P0; available: [P0, P1, P2, P3, R0].
+            :type precision: str
+            :param length: - Default 25; available: [1, 25, 100].
+            :type length: int
+
+            :returns: list of lists with API response
+
+            API Response Example
+            --------
+            [
+                [
+                    8744.9,     # Price
+                    2,          # Count
+                    0.45603413  # Amount
+                ]
+            ]
+        '''
+        try:
+            market = str(market).upper()
+            market = f't{market}'
+            return await self.client.get_public_books(symbol=market,
+                                                      precision=precision,
+                                                      length=int(length))
+        except Exception as error:
+            print('Error fetching order book.')
+            raise _bitfinexError(error)
+
+    async def fetchTicker(self, market):
+        '''
+            Fetch latest ticker data by trading symbol.
+
+            :param market: required
+            :type market: str
+
+            :returns: list with API response
+
+            API Response Example
+            --------
+            [
+                8744.9,         # Bid
+                45.603413,      # Bid size
+                8745.0,         # Ask
+                31.73521,       # Ask size
+                -99.1,          # Daily change
+                -0.0112,        # Daily change relative
+                8745.0,         # Last price
+                9134.41,        # Volume
+                8893.0,         # High
+                8680.7          # Low
+            ]
+        '''
+        try:
+            market = str(market).upper()
+            market = f't{market}'
+            return await self.client.get_public_ticker(market)
+        except Exception as error:
+            print('Error fetching ticker.')
+            raise _bitfinexError(error)
 
-            return candles
-        except:
-            pass
+    async def fetchTrades(self, market, limit=120, start=None, end=None):
+        '''
+            Fetch the latest public trades by trading symbol, newest first.
+
+            :param market: required
+            :type market: str
+            :param limit: - Default 120; max 10000.
+            :type limit: int
+            :param start: - Default None. Timestamp in ms of the oldest trade.
+            :type start: int
+            :param end: - Default None (now). Timestamp in ms of the newest trade.
+            :type end: int
+
+            :returns: list of lists with API response
+
+            API Response Example
+            --------
+            [
+                [
+                    388063448,      # ID
+                    1567526214876,  # Timestamp in ms
+                    1.918524,       # Amount (negative for sells)
+                    10682           # Price
+                ]
+            ]
+        '''
+        try:
+            market = str(market).upper()
+            market = f't{market}'
+            return await self.client.get_public_trades(market,
+                                                       int(start) if start is not None else '',
+                                                       int(end) if end is not None else '',
+                                                       limit=int(limit))
+        except Exception as error:
+            print('Error fetching trades.')
+            raise _bitfinexError(error)
+
+    async def fetchBalance(self, currency=None):
+        '''
+            Get the wallets of the account (exchange, margin and funding).
+            If the currency is sent, only its wallets are returned.
+
+            :param currency: -
+            :type currency: str
+
+            :returns: list of bfxapi Wallet
+        '''
+        try:
+            wallets = await self.client.get_wallets()
+            if currency is None:
+                return wallets
+            return [wallet for wallet in wallets
+                    if wallet.currency.upper() == str(currency).upper()]
+        except Exception as error:
+            print('Error fetching balance.')
+            raise _bitfinexError(error)
+
+    async def fetchOpenOrders(self, market=None):
+        '''
+            Fetch the active orders on a symbol.
+            If the symbol is not sent, orders for all symbols are returned.
+
+            :param market: -
+            :type market: str
+
+            :returns: list of bfxapi Order
+        '''
+        try:
+            market = f't{str(market).upper()}' if market else ''
+            return await self.client.get_active_orders(market)
+        except Exception as error:
+            print('Error fetching open orders.')
+            raise _bitfinexError(error)
+
+    async def fetchOrder(self, market, orderId):
+        '''
+            Fetch an order by id, from the active orders or the latest order history.
+
+            :param market: required
+            :type market: str
+            :param orderId: required
+            :type orderId: int
+
+            :returns: bfxapi Order
+        '''
+        try:
+            market = f't{str(market).upper()}'
+            orderId = int(orderId)
+            for order in await self.client.get_active_orders(market):
+                if order.id == orderId:
+                    return order
+            history = await self.client.get_order_history(market, '', int(time.time() * 1000), 500)
+            for order in history:
+                if order.id == orderId:
+                    return order
+            raise BITFINEX_ERRORS[InvalidOrder](f'Unknown order ({orderId}).', exchange='bitfinex')
+        except BitfinexException:
+            raise
+        except Exception as error:
+            print(f'Error fetching order ({orderId}).')
+            raise _bitfinexError(error)
+
+    async def _submitOrder(self, market, side, quantity, price, orderType):
+        side = str(side).lower()
+        if side not in ('buy', 'sell'):
+            raise BITFINEX_ERRORS[InvalidOrder]('Error setting order side (buy or sell).',
+                                                exchange='bitfinex')
+        amount = abs(float(quantity))
+        if side == 'sell':
+            amount = -amount
+
+        market = str(market).upper()
+        market = f't{market}'
+        notification = await self.client.submit_order(market, price, amount,
+                                                      market_type=orderType)
+        if notification.status != 'SUCCESS':
+            raise _rejectedOrder(notification)
+        order = notification.notify_info
+        return order.id if not isinstance(order, list) else order[0].id
+
+    async def createLimitOrder(self, market, side, quantity, price):
+        '''
+            Post a new order of type exchange limit for your account.
+
+            :param market: required
+            :type market: str
+            :param side: required
+            :type side: str
+            :param quantity: required
+            :type quantity: float
+            :param price: required
+            :type price: float
+
+            :returns: orderId, type int
+        '''
+        try:
+            return await self._submitOrder(market, side, quantity, float(price),
+                                           self.ORDER_TYPE_LIMIT)
+        except BitfinexException:
+            raise
+        except Exception as error:
+            print(f'Error creating limit order ({side}).')
+            raise _bitfinexError(error)
+
+    async def createMarketOrder(self, market, side, quantity):
+        '''
+            Post a new order of type exchange market for your account.
+
+            :param market: required
+            :type market: str
+            :param side: required
+            :type side: str
+            :param quantity: required
+            :type quantity: float
+
+            :returns: orderId, type int
+        '''
+        try:
+            return await self._submitOrder(market, side, quantity, 0,
+                                           self.ORDER_TYPE_MARKET)
+        except BitfinexException:
+            raise
+        except Exception as error:
+            print(f'Error creating market order ({side}).')
+            raise _bitfinexError(error)
+
+    async def amendOrder(self, orderId, price=None, quantity=None, symbol=None, side=None):
+        '''
+            Update the price and/or amount of an active order in place (single request).
+            The order keeps its id and client id.
+
+            :param orderId: required
+            :type orderId: int
+            :param price: -
+            :type price: float
+            :param quantity: - new total quantity
+            :type quantity: float
+            :param symbol: -
+            :type symbol: str
+            :param side: - required to change the quantity
+            :type side: str
+
+            :returns: bfxapi Order
+        '''
+        try:
+            amount = None
+            if quantity is not None:
+                if str(side).lower() not in ('buy', 'sell'):
+                    raise BITFINEX_ERRORS[InvalidOrder]('Error setting order side (buy or sell).',
+                                                        exchange='bitfinex')
+                amount = abs(float(quantity))
+                if str(side).lower() == 'sell':
+                    amount = -amount
+
+            notification = await self.client.submit_update_order(
+                int(orderId),
+                price=float(price) if price is not None else None,
+                amount=amount)
+            if notification.status != 'SUCCESS':
+                raise _rejectedOrder(notification)
+            return notification.notify_info
+        except BitfinexException:
+            raise
+        except Exception as error:
+            print(f'Error amending order ({orderId}).')
+            raise _bitfinexError(error)
+
+    async def amendOrders(self, amendments):
+        '''
+            Amend many orders concurrently, e.g. every quote of a ladder.
+
+            :param amendments: required - amendOrder arguments, e.g. [{"orderId": 1185657349, "price": 8745.0}]
+            :type amendments: list
+
+            :returns: list with the amended order or the exception raised, in the same order
+        '''
+        return await asyncio.gather(*(self.amendOrder(**amendment) for amendment in amendments),
+                                    return_exceptions=True)
+
+    async def cancelOrder(self, orderId):
+        '''
+            Cancel an active order.
+
+            :param orderId: required
+            :type orderId: int
+
+            :returns: bfxapi Order
+        '''
+        try:
+            notification = await self.client.submit_cancel_order(int(orderId))
+            if notification.status != 'SUCCESS':
+                raise _rejectedOrder(notification)
+            return notification.notify_info
+        except BitfinexException:
+            raise
+        except Exception as error:
+            print('Error canceling order.')
+            raise _bitfinexError(error)
+
+    async def cancelAllOrders(self, market=None):
+        '''
+            Cancel all active orders on a symbol (all symbols if not sent), concurrently.
+
+            :returns: list of bfxapi Order
+        '''
+        orders = await self.fetchOpenOrders(market)
+        return await asyncio.gather(*(self.cancelOrder(order.id) for order in orders))
+
+    def _pages(self, operation, message, timeKey, market, start, end, limit, prefetch):
+        market = str(market).upper()
+        market = f't{market}'
+        start = int(start) if start else ''
+        limit = int(limit)
+        # The end is inclusive: the rows sharing the oldest millisecond of a
+        # page are fetched again and the ones already returned dropped
+        cursor = EndCursor(limit, lambda item: getattr(item, timeKey), lambda item: item.id)
+
+        async def fetchPage(end):
+            try:
+                # By keyword: bfxapi versions order the arguments of get_trades differently
+                return cursor.fresh(await operation(symbol=market, start=start, end=end, limit=limit))
+            except Exception as error:
+                print(message)
+                raise _bitfinexError(error)
+
+        end = int(end) if end else int(time.time() * 1000)
+        return apaginate(fetchPage, end, cursor, prefetch=prefetch)
+
+    def fetchAllOrders(self, market, start=None, end=None, limit=500, prefetch=False):
+        '''
+            Fetch the order history (filled and cancelled orders) on a symbol,
+            newest first, one page at a time.
+            Pages are requested lazily with an end timestamp cursor.
+
+            :param market: required
+            :type market: str
+            :param start: - Default None. Timestamp in ms of the oldest order.
+            :type start: int
+            :param end: - Default None (now). Timestamp in ms of the newest order.
+            :type end: int
+            :param limit: - Default 500; max 500.
+            :type limit: int
+            :param prefetch: - Default False. Fetch the next page while the current one is consumed.
+            :type prefetch: boolean
+
+            :returns: async generator of lists of bfxapi Order
+        '''
+        return self._pages(self.client.get_order_history,
+                           'Error fetching all orders.', 'mts_update',
+                           market, start, end, limit, prefetch)
+
+    def fetchMyTrades(self, market, start=None, end=None, limit=1000, prefetch=False):
+        '''
+            Fetch the trades of the account on a symbol,
+            newest first, one page at a time.
+            Pages are requested lazily with an end timestamp cursor.
+
+            :param market: required
+            :type market: str
+            :param start: - Default None. Timestamp in ms of the oldest trade.
+            :type start: int
+            :param end: - Default None (now). Timestamp in ms of the newest trade.
+            :type end: int
+            :param limit: - Default 1000; max 2500.
+            :type limit: int
+            :param prefetch: - Default False. Fetch the next page while the current one is consumed.
+            :type prefetch: boolean
+
+            :returns: async generator of lists of bfxapi Trade
+        '''
+        return self._pages(self.client.get_trades,
+                           'Error fetching trade history.', 'mts_create',
+                           market, start, end, limit, prefetch)
 
 
 if __name__ == '__main__':
@@ -7,14 +7,107 @@
 '''
 
 import bitmex
+from bravado.requests_client import Authenticator
 
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from urllib.parse import urlparse
 
+from .accountManager import currentCredentials
+from .bitmexTransport import BitmexTransport, bitmexSignature
+from .errors import EvoxError, InvalidOrder, exchangeErrors, wrap
+from .pagination import apaginate, offsetCursor, paginate
+from .tickerEngine import bitmexBars
+from .tracing import span, traceSession
 
-class BitmexException(Exception):
+
+class BitmexException(EvoxError):
     pass
 
 
+BITMEX_ERRORS = exchangeErrors(BitmexException)
+
+
+def _bitmexError(error):
+    # Bravado HTTPError and BitmexTransportException carry the HTTP status
+    return wrap(error, 'bitmex', BITMEX_ERRORS)
+
+
+def _seconds(timestamp):
+    # ISO strings of the lean transport, datetimes of bravado
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+    return timestamp.timestamp() if timestamp is not None else None
+
+
+def instrumentTicker(instrument):
+    '''
+        Ticker of a Bitmex instrument, with the keys of TickerEngine.ticker.
+    '''
+    bidPrice = instrument.get('bidPrice')
+    askPrice = instrument.get('askPrice')
+    lastPrice = instrument.get('lastPrice')
+    openPrice = instrument.get('prevPrice24h')
+    change = None
+    changePercent = None
+    if openPrice and lastPrice is not None:
+        change = lastPrice - openPrice
+        changePercent = change / openPrice * 100.0
+    both = bidPrice is not None and askPrice is not None
+    updateTime = _seconds(instrument.get('timestamp'))
+    age = time.time() - updateTime if updateTime is not None else None
+    return {'symbol': instrument.get('symbol'),
+            'bidPrice': bidPrice,
+            'bidQty': None,
+            'askPrice': askPrice,
+            'askQty': None,
+            'midPrice': instrument.get('midPrice'),
+            'spread': askPrice - bidPrice if both else None,
+            'microPrice': None,
+            'lastPrice': lastPrice,
+            'lastQty': None,
+            'vwap': instrument.get('vwap'),
+            'weightedAvgPrice': instrument.get('vwap'),
+            'openPrice': openPrice,
+            'highPrice': instrument.get('highPrice'),
+            'lowPrice': instrument.get('lowPrice'),
+            'volume': instrument.get('volume24h'),
+            'quoteVolume': instrument.get('foreignNotional24h'),
+            'count': None,
+            'priceChange': change,
+            'priceChangePercent': changePercent,
+            'updateTime': updateTime,
+            'age': age,
+            'stale': False}
+
+
+class SharedCredentialsAuthenticator(Authenticator):
+    '''
+        Bravado authenticator shared by the sub-accounts of an AccountManager.
+        Requests are signed with the credentials of the account of the current call.
+    '''
+
+    def apply(self, request):
+        credentials = currentCredentials()
+        if credentials is None:
+            return request
+        key, secret = credentials
+        with span('sign'):
+            return self._sign(request, key, secret)
+
+    def _sign(self, request, key, secret):
+        expires = int(round(time.time()) + 3600)
+        request.headers['api-expires'] = str(expires)
+        request.headers['api-key'] = key
+        prepared = request.prepare()
+        request.headers['api-signature'] = bitmexSignature(secret, request.method,
+                                                           prepared.path_url, expires,
+                                                           prepared.body or '')
+        return request
+
+
 class BitmexMiddleware(object):
     '''
         Bitmex exchange management class
@@ -26,6 +119,21 @@ class BitmexMiddleware(object):
 
         secret : str
             The secret key from Bitmex API account
+
+        riskEngine : RiskEngine
+            Pre-trade checks of every order, if sent
+
+        client : SwaggerClient
+            Bravado client to use instead of a new one (loading the Swagger spec)
+
+        tickerEngine : TickerEngine
+            fetchTicker is served from memory while the stream data is fresh, if sent
+
+        lean : bool
+            Orders (new, cancel), candles, wallet and open orders go through the
+            lean BitmexTransport instead of bravado, returning the plain API
+            structures (timestamps as ISO strings). The bravado client is then
+            only built, loading the Swagger spec, when another method needs it.
     '''
     ORDER_TYPE_LIMIT = 'Limit'
     ORDER_TYPE_MARKET = 'Market'
@@ -39,15 +147,92 @@ class BitmexMiddleware(object):
     KLINE_INTERVAL_1DAY = '1d'
 
     def __init__(self, *args, **params):
-        self._client = bitmex.bitmex(test=params.get('test', False),
-                                     api_key=params.get('api_key', None),
-                                     api_secret=params.get('api_secret', None),
-                                     config=None)
+        self._params = params
+        self._client = params.get('client', None)
+        if self._client is not None:
+            traceSession(self._client.swagger_spec.http_client.session)
+        elif not params.get('lean', False):
+            self._client = self._bravadoClient()
+        self._transport = None
+        if params.get('lean', False):
+            self._transport = BitmexTransport(key=params.get('api_key', None),
+                                              secret=params.get('api_secret', None),
+                                              test=params.get('test', False))
+        self._riskEngine = params.get('riskEngine', None)
+        self._tickerEngine = params.get('tickerEngine', None)
+        if self._riskEngine is not None and self._tickerEngine is not None:
+            self._riskEngine.follow(self._tickerEngine)
+
+    @classmethod
+    def sharedCredentials(cls, **params):
+        '''
+            Middleware shared by the sub-accounts of an AccountManager.
+            The Swagger spec is loaded once for every account.
+        '''
+        client = bitmex.bitmex(test=params.get('test', False), config=None)
+        host = urlparse(client.swagger_spec.api_url).netloc
+        client.swagger_spec.http_client.authenticator = SharedCredentialsAuthenticator(host)
+        return cls(client=client, **params)
+
+    def _bravadoClient(self):
+        client = bitmex.bitmex(test=self._params.get('test', False),
+                               api_key=self._params.get('api_key', None),
+                               api_secret=self._params.get('api_secret', None),
+                               config=None)
+        # Traced calls split the bravado time into send and wait spans;
+        # the rest of the call is bravado request building and model unmarshalling
+        traceSession(client.swagger_spec.http_client.session)
+        return client
 
     @property
     def client(self):
+        if self._client is None:
+            self._client = self._bravadoClient()
         return self._client
 
+    @property
+    def transport(self):
+        return self._transport
+
+    def _checkRisk(self, symbol, side, quantity, price=None):
+        if self._riskEngine is None:
+            return
+        if not price and self._riskEngine.needsPrice(str(symbol)):
+            # Market orders are valued at the last price
+            try:
+                instrument = self._instrument(symbol)
+            except Exception as error:
+                print('Error fetching the reference price.')
+                raise _bitmexError(error)
+            if instrument.get('lastPrice') is not None:
+                self._riskEngine.updatePrice(str(symbol), instrument['lastPrice'])
+        return self._riskEngine.check(str(symbol), side, quantity, price)
+
+    def _releaseRisk(self, symbol, reservation):
+        if self._riskEngine is not None:
+            self._riskEngine.release(str(symbol), reservation)
+
+    def _instrument(self, symbol):
+        if self._transport is not None:
+            instruments = self._transport.instrument(str(symbol))
+        else:
+            instruments = self.client.Instrument.Instrument_get(symbol=str(symbol)).result()[0]
+        if not instruments:
+            raise BITMEX_ERRORS[InvalidOrder](f'Unknown symbol ({symbol}).', exchange='bitmex')
+        return instruments[0]
+
+    def _bucketed(self, market, interval, count, reverse=True, startTime=None):
+        if self._transport is not None:
+            return self._transport.bucketedTrades(str(market), str(interval), int(count),
+                                                  bool(reverse), startTime=startTime)
+        params = {} if startTime is None else {'startTime': startTime}
+        candles = self.client.Trade.Trade_getBucketed(binSize=str(interval),
+                                                      symbol=str(market),
+                                                      count=int(count),
+                                                      reverse=bool(reverse),
+                                                      **params)
+        return candles.result()[0]
+
     def createLimitOrder(self, symbol, side, quantity, price):
         '''
             Post a new order for your account.
@@ -64,20 +249,32 @@ class BitmexMiddleware(object):
 
             :returns: orderId, type str
         '''
+        reservation = self._checkRisk(symbol, side, quantity, price)
+
         try:
             side = self.SIDE_BUY if side.lower() == 'buy' else self.SIDE_SELL
 
-            order = self.client.Order.Order_new(symbol=str(symbol),
-                                                side=str(side),
-                                                orderQty=abs(int(quantity)),
-                                                price=float(price),
-                                                ordType=self.ORDER_TYPE_LIMIT)
-            return list(order.result())[0]['orderID']
+            fields = {'symbol': str(symbol),
+                      'side': str(side),
+                      'orderQty': abs(int(quantity)),
+                      'price': float(price),
+                      'ordType': self.ORDER_TYPE_LIMIT}
+            if self._transport is not None:
+                orderId = self._transport.newOrder(**fields)['orderID']
+            else:
+                order = self.client.Order.Order_new(**fields)
+                orderId = list(order.result())[0]['orderID']
+            if self._riskEngine is not None:
+                self._riskEngine.onOrderAccepted(str(symbol), orderId, reservation)
+            return orderId
         except AttributeError:
-            raise BitmexException('Error setting order side (buy or sell).')
+            self._releaseRisk(symbol, reservation)
+            raise BITMEX_ERRORS[InvalidOrder]('Error setting order side (buy or sell).',
+                                              exchange='bitmex')
         except Exception as error:
+            self._releaseRisk(symbol, reservation)
             print(f'Error creating limit order ({side}).')
-            raise BitmexException(error)
+            raise _bitmexError(error)
 
     def createMarketOrder(self, symbol, side, quantity):
         '''
@@ -92,19 +289,133 @@ class BitmexMiddleware(object):
 
             :returns: orderId, type str
         '''
+        reservation = self._checkRisk(symbol, side, quantity)
+
         try:
             side = self.SIDE_BUY if side.lower() == 'buy' else self.SIDE_SELL
 
-            order = self.client.Order.Order_new(symbol=str(symbol),
-                                                side=str(side),
-                                                orderQty=abs(int(quantity)),
-                                                ordType=self.ORDER_TYPE_MARKET)
+            fields = {'symbol': str(symbol),
+                      'side': str(side),
+                      'orderQty': abs(int(quantity)),
+                      'ordType': self.ORDER_TYPE_MARKET}
+            if self._transport is not None:
+                return self._transport.newOrder(**fields)['orderID']
+            order = self.client.Order.Order_new(**fields)
             return list(order.result())[0]['orderID']
         except AttributeError:
-            raise BitmexException('Error setting order side (buy or sell).')
+            raise BITMEX_ERRORS[InvalidOrder]('Error setting order side (buy or sell).',
+                                              exchange='bitmex')
         except Exception as error:
             print(f'Error creating market order ({side}).')
-            raise BitmexException(error)
+            raise _bitmexError(error)
+        finally:
+            # Market orders do not stay open
+            self._releaseRisk(symbol, reservation)
+
+    def amendOrder(self, orderId, price=None, quantity=None, symbol=None, side=None):
+        '''
+            Amend the price and/or quantity of an open order in place (single request).
+            The order keeps its orderID and clOrdID; a price change loses the queue position,
+            a quantity reduction keeps it.
+            The risk engine checks the amendment; symbol, side, price or quantity not
+            sent are then read from the order first (one more request).
+
+            :param orderId: required
+            :type orderId: str
+            :param price: -
+            :type price: float
+            :param quantity: - new total quantity
+            :type quantity: integer
+            :param symbol: -
+            :type symbol: str
+            :param side: -
+            :type side: str
+
+            :returns: dictionary with API response (the amended order)
+        '''
+        if self._riskEngine is not None:
+            checked = {'symbol': symbol, 'side': side, 'price': price, 'quantity': quantity}
+            if None in checked.values():
+                try:
+                    order = self._order(orderId)
+                except Exception as error:
+                    print(f'Error fetching order ({orderId}).')
+                    raise _bitmexError(error)
+                for key, field in (('symbol', 'symbol'), ('side', 'side'),
+                                   ('price', 'price'), ('quantity', 'orderQty')):
+                    if checked[key] is None:
+                        checked[key] = order.get(field)
+            self._riskEngine.check(str(checked['symbol']), checked['side'],
+                                   checked['quantity'], checked['price'], newOrder=False)
+
+        try:
+            fields = {'orderID': str(orderId)}
+            if price is not None:
+                fields['price'] = float(price)
+            if quantity is not None:
+                fields['orderQty'] = abs(int(quantity))
+            if self._transport is not None:
+                return self._transport.amendOrder(**fields)
+            return self.client.Order.Order_amend(**fields).result()[0]
+        except Exception as error:
+            print(f'Error amending order ({orderId}).')
+            raise _bitmexError(error)
+
+    def _order(self, orderId):
+        orderFilter = {'orderID': str(orderId)}
+        if self._transport is not None:
+            orders = self._transport.orders(filter=orderFilter)
+        else:
+            orders = self.client.Order.Order_getOrders(filter=json.dumps(orderFilter)).result()[0]
+        if not orders:
+            raise BITMEX_ERRORS[InvalidOrder](f'Unknown order ({orderId}).', exchange='bitmex')
+        return orders[0]
+
+    def amendOrders(self, amendments):
+        '''
+            Amend many orders concurrently, e.g. every quote of a ladder.
+
+            :param amendments: required - amendOrder arguments, e.g. [{"orderId": "...", "price": 9476}]
+            :type amendments: list
+
+            :returns: list with the amended order or the exception raised, in the same order
+        '''
+        def amend(amendment):
+            try:
+                return self.amendOrder(**amendment)
+            except Exception as error:
+                return error
+
+        if not amendments:
+            return []
+        with ThreadPoolExecutor(max_workers=min(len(amendments), 16)) as executor:
+            return list(executor.map(amend, amendments))
+
+    def cancelOrder(self, orderId):
+        '''
+            Cancel an active order.
+
+            :param orderId: required
+            :type orderId: str
+
+            :returns: dictionary with API response
+        '''
+        try:
+            if self._transport is not None:
+                orders = self._transport.cancelOrders(orderID=str(orderId))
+            else:
+                orders = self.client.Order.Order_cancel(orderID=str(orderId)).result()[0]
+            order = orders[0]
+            if order.get('error'):
+                raise BITMEX_ERRORS[InvalidOrder](order['error'], exchange='bitmex')
+            if self._riskEngine is not None:
+                self._riskEngine.onOrderClosed(order['symbol'], order['orderID'])
+            return order
+        except BitmexException:
+            raise
+        except Exception as error:
+            print('Error canceling order.')
+            raise _bitmexError(error)
 
     def fetchOHLCV(self, market, interval='1d', limit=100, reverse=True):
         '''
@@ -112,7 +423,9 @@ class BitmexMiddleware(object):
             Klines are uniquely identified by their open time.
             OHLC means open, high, close and volume.
             1 day interval is default.
-            Available options: [1m,5m,1h,1d].
+            Available options: [1m,5m,1h,1d]. Other intervals (e.g. 15m, 4h, 1w) are
+            aggregated from the longest of them dividing the interval, in a single
+            request (at most 1000 base candles), and returned with the same keys.
 
             :param symbol: required
             :type symbol: str
@@ -156,33 +469,97 @@ class BitmexMiddleware(object):
             elif interval == '1d':
                 interval = self.KLINE_INTERVAL_1DAY
             else:
-                print('Interval not implemented.')
-                return []
-
-            candles = self.client.Trade.Trade_getBucketed(binSize=str(interval),
-                                                          symbol=str(market),
-                                                          count=int(limit),
-                                                          reverse=bool(reverse))
+                # Imported here: NumPy is only required for derived intervals
+                from .resampler import deriveOHLCV
+                return deriveOHLCV(self, 'bitmex', market, interval, limit,
+                                   [self.KLINE_INTERVAL_1MINUTE, self.KLINE_INTERVAL_5MINUTE,
+                                    self.KLINE_INTERVAL_1HOUR, self.KLINE_INTERVAL_1DAY],
+                                   reverse=reverse)
 
-            return candles.result()[0]
+            return self._bucketed(market, interval, limit, reverse)
 
         except Exception as error:
             print('Error fetching candlesticks (OHLCV).')
-            raise BitmexException(error)
+            raise _bitmexError(error)
 
     def fetchTicker(self, symbol):
         '''
-            It just returns the last candle in timeframe
-            of 1 day like fetchOHCLV method.
-            Must be reviewed!
-            --------
+            Ticker (book top, VWAP and 24 hours statistics) from the ticker engine,
+            when it has fresh stream data of the symbol.
+            Otherwise, it is read from the instrument, with the same keys
+            (the sizes and the trade count are then None).
+
+            :param symbol: required
+            :type symbol: str
+
+            :returns: dictionary (see TickerEngine.ticker)
         '''
         try:
-            # return self.client.Quote.Quote_get(symbol='XBT')
-            return self.fetchOHLCV(market=symbol, limit=1)
+            symbol = str(symbol)
+            if self._tickerEngine is not None and self._tickerEngine.isFresh(symbol):
+                if not self._tickerEngine.coversDay(symbol):
+                    self._seedDay(symbol)
+                return self._tickerEngine.ticker(symbol)
+            return instrumentTicker(self._instrument(symbol))
+        except BitmexException:
+            raise
         except Exception as error:
             print('Error fetching ticker.')
-            raise BitmexException(error)
+            raise _bitmexError(error)
+
+    def _seedDay(self, symbol):
+        # 1 minute buckets of the 24 hours before the stream, stamped at their end
+        end = time.time()
+        start = end - 86400.0
+        rows = []
+        cursor = start
+        while cursor < end:
+            startTime = datetime.fromtimestamp(cursor + 60.0, timezone.utc).isoformat()
+            page = self._bucketed(symbol, self.KLINE_INTERVAL_1MINUTE, 1000, False, startTime)
+            if not page:
+                break
+            rows.extend(page)
+            cursor = _seconds(page[-1]['timestamp'])
+        self._tickerEngine.seedDay(symbol, bitmexBars(rows), since=start)
+
+    def fetchOrderBook(self, symbol, depth=25):
+        '''
+            Fetch the level 2 order book by trading symbol.
+            Both sides are returned in a single list, asks first.
+
+            :param symbol: required
+            :type symbol: str
+            :param depth: - Default 25; 0 means full depth.
+            :type depth: int
+
+            :returns: list of dictionaries with API response
+
+            API Response Example
+            --------
+            [
+                {
+                    "symbol": "XBTUSD",
+                    "id": 8799052500,
+                    "side": "Sell",
+                    "size": 1000,
+                    "price": 9475
+                },
+                {
+                    "symbol": "XBTUSD",
+                    "id": 8799052550,
+                    "side": "Buy",
+                    "size": 25000,
+                    "price": 9474.5
+                }
+            ]
+        '''
+        try:
+            book = self.client.OrderBook.OrderBook_getL2(symbol=str(symbol),
+                                                         depth=int(depth))
+            return book.result()[0]
+        except Exception as error:
+            print('Error fetching order book.')
+            raise _bitmexError(error)
 
     def fetchBalance(self, currency='XBt'):
         '''
@@ -227,11 +604,13 @@ class BitmexMiddleware(object):
             }
         '''
         try:
+            if self._transport is not None:
+                return self._transport.wallet(currency)
             balance = self.client.User.User_getWallet(currency=currency)
             return balance.result()[0]
         except Exception as error:
             print(f'Error fetching asset balance.')
-            raise BitmexException(error)
+            raise _bitmexError(error)
 
     def fetchOrders(self, *args):
         '''
@@ -246,6 +625,8 @@ class BitmexMiddleware(object):
             :returns: list of dictionaries with API response
         '''
         try:
+            if self._transport is not None:
+                return self._transport.orders(*args)
             if args:
                 symbol = args[0]
                 orders = self.client.Order.Order_getOrders(symbol=symbol)
@@ -256,7 +637,7 @@ class BitmexMiddleware(object):
 
         except Exception as error:
             print(f'Error fetching all orders.')
-            raise BitmexException(error)
+            raise _bitmexError(error)
 
     def fetchOpenOrders(self, *args):
         '''
@@ -270,6 +651,8 @@ class BitmexMiddleware(object):
             :returns: list of dictionaries with API response
         '''
         try:
+            if self._transport is not None:
+                return self._transport.orders(*args, filter={'open': True})
             filters = json.dumps({'open': True})
 
             if args:
@@ -283,7 +666,35 @@ class BitmexMiddleware(object):
 
         except Exception as error:
             print(f'Error fetching all orders.')
-            raise BitmexException(error)
+            raise _bitmexError(error)
+
+    def fetchOrder(self, symbol, orderId):
+        '''
+            Fetch an order (open, filled or cancelled) by id.
+
+            :param symbol: required
+            :type symbol: str
+            :param orderId: required
+            :type orderId: str
+
+            :returns: dictionary with API response
+        '''
+        try:
+            filters = {'orderID': str(orderId)}
+            if self._transport is not None:
+                orders = self._transport.orders(str(symbol), filter=filters)
+            else:
+                orders = self.client.Order.Order_getOrders(symbol=str(symbol),
+                                                           filter=json.dumps(filters)).result()[0]
+            if not orders:
+                raise BITMEX_ERRORS[InvalidOrder](f'Unknown order ({orderId}).', exchange='bitmex')
+            return orders[0]
+
+        except BitmexException:
+            raise
+        except Exception as error:
+            print(f'Error fetching order ({orderId}).')
+            raise _bitmexError(error)
 
     def fetchOpenBuyOrders(self, *args):
         '''
@@ -309,7 +720,7 @@ class BitmexMiddleware(object):
 
         except Exception as error:
             print('Error fetching open buy orders.')
-            raise BitmexException(error)
+            raise _bitmexError(error)
 
     def fetchOpenSellOrders(self, *args):
         '''
@@ -335,7 +746,107 @@ class BitmexMiddleware(object):
 
         except Exception as error:
             print('Error fetching open sell orders.')
-            raise Exception(error)
+            raise _bitmexError(error)
+
+    def _pages(self, operation, message, symbol, startTime, count):
+        filters = {'count': int(count), 'reverse': False}
+        if symbol:
+            filters['symbol'] = str(symbol)
+        if startTime:
+            filters['startTime'] = startTime
+
+        def fetchPage(start):
+            try:
+                return operation(start=start, **filters).result()[0]
+            except Exception as error:
+                print(message)
+                raise _bitmexError(error)
+
+        return fetchPage, 0, offsetCursor(filters['count'])
+
+    def fetchAllOrders(self, symbol=None, startTime=None, count=500, prefetch=False):
+        '''
+            Fetch all orders (new, filled, cancelled), oldest first,
+            one page at a time. Pages are requested lazily with a start offset.
+            If the symbol is not sent, orders for all symbols are returned.
+
+            :param symbol: -
+            :type symbol: str
+            :param startTime: - Default None (first order).
+            :type startTime: datetime
+            :param count: - Default 500; max 500.
+            :type count: int
+            :param prefetch: - Default False. Fetch the next page while the current one is consumed.
+            :type prefetch: boolean
+
+            :returns: generator of lists of dictionaries with API response
+        '''
+        return paginate(*self._pages(self.client.Order.Order_getOrders,
+                                     'Error fetching all orders.',
+                                     symbol, startTime, count),
+                        prefetch=prefetch)
+
+    def fetchAllOrdersAsync(self, symbol=None, startTime=None, count=500, prefetch=False):
+        '''
+            Async version of fetchAllOrders.
+
+            :returns: async generator of lists of dictionaries with API response
+        '''
+        return apaginate(*self._pages(self.client.Order.Order_getOrders,
+                                      'Error fetching all orders.',
+                                      symbol, startTime, count),
+                         prefetch=prefetch)
+
+    def fetchMyTrades(self, symbol=None, startTime=None, count=500, prefetch=False):
+        '''
+            Fetch the trade executions of the account, oldest first,
+            one page at a time. Pages are requested lazily with a start offset.
+            If the symbol is not sent, executions for all symbols are returned.
+
+            :param symbol: -
+            :type symbol: str
+            :param startTime: - Default None (first execution).
+            :type startTime: datetime
+            :param count: - Default 500; max 500.
+            :type count: int
+            :param prefetch: - Default False. Fetch the next page while the current one is consumed.
+            :type prefetch: boolean
+
+            :returns: generator of lists of dictionaries with API response
+
+            API Response Example
+            --------
+            [
+                {
+                    "execID": "string",
+                    "orderID": "string",
+                    "symbol": "XBTUSD",
+                    "side": "Buy",
+                    "lastQty": 100,
+                    "lastPx": 9475.5,
+                    "execType": "Trade",
+                    "ordType": "Limit",
+                    "commission": 0.00075,
+                    "execComm": 791,
+                    "timestamp": "2019-10-24T12:17:45.777Z"
+                }
+            ]
+        '''
+        return paginate(*self._pages(self.client.Execution.Execution_getTradeHistory,
+                                     'Error fetching trade history.',
+                                     symbol, startTime, count),
+                        prefetch=prefetch)
+
+    def fetchMyTradesAsync(self, symbol=None, startTime=None, count=500, prefetch=False):
+        '''
+            Async version of fetchMyTrades.
+
+            :returns: async generator of lists of dictionaries with API response
+        '''
+        return apaginate(*self._pages(self.client.Execution.Execution_getTradeHistory,
+                                      'Error fetching trade history.',
+                                      symbol, startTime, count),
+                         prefetch=prefetch)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,296 @@
+# coding=utf-8
+
+'''
+    Lean Bitmex REST transport
+
+    Signs and sends the hot endpoints (order new, amend and cancel, bucketed
+    trades, wallet and orders) directly with requests, decoding the raw
+    responses with jsonCodec. Bravado builds and validates a model object for
+    every request and response row, which costs far more CPU than the HTTP
+    round trip itself on large responses; this transport skips it.
+
+    Responses are the plain API structures: dictionaries with ISO timestamp
+    strings, or typed rows (BitmexBucket) for bucketed trades.
+
+    Official Documentation
+    https://www.bitmex.com/api/explorer/
+'''
+
+import hashlib
+import hmac
+import json
+import time
+from typing import NamedTuple, Optional
+from urllib.parse import urlencode
+
+from .accountManager import currentCredentials
+from .errors import AuthError, EvoxError, classify, exchangeErrors
+from .jsonCodec import decodeList, dumps, loads
+from .tracing import TracedSession, span
+
+
+BASE_URLS = {False: 'https://www.bitmex.com',
+             True: 'https://testnet.bitmex.com'}
+API_PATH = '/api/v1'
+
+
+class BitmexTransportException(EvoxError):
+
+    def __init__(self, message, status=None, name=None, **kwargs):
+        kwargs.setdefault('exchange', 'bitmex')
+        super().__init__(message, status=status, **kwargs)
+        self.name = name
+
+
+TRANSPORT_ERRORS = exchangeErrors(BitmexTransportException)
+
+
+class BitmexBucket(NamedTuple):
+    timestamp: str
+    symbol: str
+    open: Optional[float]
+    high: Optional[float]
+    low: Optional[float]
+    close: Optional[float]
+    trades: int
+    volume: int
+    vwap: Optional[float]
+    lastSize: Optional[int]
+    turnover: int
+    homeNotional: float
+    foreignNotional: float
+
+
+def bitmexSignature(secret, verb, path, expires, body=''):
+    '''
+        Request signature: hex(HMAC_SHA256(secret, verb + path + expires + body))
+    '''
+    if isinstance(body, bytes):
+        body = body.decode()
+    message = f'{verb}{path}{expires}{body}'
+    return hmac.new(secret.encode(), message.encode(), hashlib.sha256).hexdigest()
+
+
+class BitmexTransport(object):
+    '''
+        Signed Bitmex REST client for the hot endpoints
+
+        Attributes
+        ------------
+        key : str
+            The public key from Bitmex API account. Default the credentials of
+            the current AccountManager account.
+
+        secret : str
+            The secret key from Bitmex API account
+
+        test : bool
+            Use the testnet
+
+        timeout : float
+            Seconds to wait for a response
+    '''
+
+    def __init__(self, key=None, secret=None, test=False, timeout=10.0, session=None):
+        self._credentials = (key, secret) if key else None
+        self.baseUrl = BASE_URLS[bool(test)]
+        self.timeout = timeout
+        self.session = session if session is not None else TracedSession()
+        self.session.headers.update({'Content-Type': 'application/json',
+                                     'Accept': 'application/json'})
+        self.rateLimitRemaining = None
+
+    def request(self, verb, endpoint, query=None, body=None, signed=True, raw=False):
+        '''
+            :returns: the decoded response (raw bytes are decoded by jsonCodec),
+                the raw bytes if raw
+        '''
+        with span('prepare'):
+            path = API_PATH + endpoint
+            if query:
+                path += '?' + urlencode({key: value for key, value in query.items()
+                                         if value is not None})
+            data = dumps({key: value for key, value in body.items()
+                          if value is not None}) if body else ''
+            headers = {}
+
+        if signed:
+            # The transport key first, the AccountManager account when it has none
+            credentials = self._credentials or currentCredentials()
+            if credentials is None:
+                raise TRANSPORT_ERRORS[AuthError]('API key and secret are required.')
+            with span('sign'):
+                expires = int(round(time.time()) + 60)
+                headers['api-expires'] = str(expires)
+                headers['api-key'] = credentials[0]
+                headers['api-signature'] = bitmexSignature(credentials[1], verb, path, expires, data)
+
+        response = self.session.request(verb, self.baseUrl + path, data=data or None,
+                                        headers=headers, timeout=self.timeout)
+        remaining = response.headers.get('x-ratelimit-remaining')
+        if remaining is not None:
+            self.rateLimitRemaining = int(remaining)
+
+        if response.status_code >= 400:
+            try:
+                error = loads(response.content).get('error', {})
+            except (ValueError, AttributeError):
+                error = {}
+            retryAfter = response.headers.get('Retry-After')
+            message = error.get('message', response.text)
+            kind = classify('bitmex', status=response.status_code, message=message)
+            raise TRANSPORT_ERRORS[kind](f"{response.status_code} {error.get('name', '')}: {message}",
+                                         status=response.status_code,
+                                         name=error.get('name'),
+                                         retryAfter=float(retryAfter) if retryAfter else None)
+        if raw:
+            return response.content
+        with span('decode'):
+            return loads(response.content)
+
+    # --- Orders
+
+    def newOrder(self, **fields):
+        '''
+            POST /order, e.g. newOrder(symbol='XBTUSD', side='Buy', orderQty=100, price=9475, ordType='Limit')
+
+            :returns: dictionary with the order
+        '''
+        return self.request('POST', '/order', body=fields)
+
+    def amendOrder(self, **fields):
+        '''
+            PUT /order, e.g. amendOrder(orderID='...', price=9480)
+
+            :returns: dictionary with the order
+        '''
+        return self.request('PUT', '/order', body=fields)
+
+    def cancelOrders(self, orderID=None, clOrdID=None, text=None):
+        '''
+            DELETE /order, one or many orders (lists of ids).
+
+            :returns: list of dictionaries with the orders
+        '''
+        return self.request('DELETE', '/order', body={'orderID': orderID,
+                                                      'clOrdID': clOrdID,
+                                                      'text': text})
+
+    def orders(self, symbol=None, filter=None, count=None, start=None,
+               reverse=None, startTime=None):
+        '''
+            GET /order
+
+            :returns: list of dictionaries with the orders
+        '''
+        return self.request('GET', '/order', query={'symbol': symbol,
+                                                    'filter': json.dumps(filter) if filter else None,
+                                                    'count': count,
+                                                    'start': start,
+                                                    'reverse': _flag(reverse),
+                                                    'startTime': startTime})
+
+    # --- Market data and account
+
+    def bucketedTrades(self, symbol, binSize='1d', count=100, reverse=True,
+                       startTime=None, partial=None, typed=False):
+        '''
+            GET /trade/bucketed
+
+            :returns: list of dictionaries (BitmexBucket rows if typed)
+        '''
+        rows = self.request('GET', '/trade/bucketed',
+                            query={'binSize': binSize,
+                                   'symbol': symbol,
+                                   'count': count,
+                                   'reverse': _flag(reverse),
+                                   'startTime': startTime,
+                                   'partial': _flag(partial)},
+                            signed=self._credentials is not None or currentCredentials() is not None,
+                            raw=typed)
+        if not typed:
+            return rows
+        with span('decode'):
+            return decodeList(rows, BitmexBucket, objects=True)
+
+    def instrument(self, symbol):
+        '''
+            GET /instrument
+
+            :returns: list of dictionaries (one per symbol)
+        '''
+        return self.request('GET', '/instrument', query={'symbol': symbol},
+                            signed=False)
+
+    def wallet(self, currency='XBt'):
+        '''
+            GET /user/wallet
+
+            :returns: dictionary with the wallet
+        '''
+        return self.request('GET', '/user/wallet', query={'currency': currency})
+
+
+def _flag(value):
+    if value is None:
+        return None
+    return 'true' if value else 'false'
+
+
+if __name__ == '__main__':
+
+    import requests
+    from requests.adapters import BaseAdapter
+
+    candle = {'timestamp': '2020-06-01T00:00:00.000Z', 'symbol': 'XBTUSD', 'open': 9475.5,
+              'high': 9520.0, 'low': 9380.0, 'close': 9490.0, 'trades': 81234,
+              'volume': 1250345678, 'vwap': 9450.12, 'lastSize': 100,
+              'turnover': 13230000000000, 'homeNotional': 132300.1, 'foreignNotional': 1250345678}
+    order = {'orderID': '8c5c6c4a-0000-0000-0000-000000000000', 'symbol': 'XBTUSD', 'side': 'Buy',
+             'orderQty': 100, 'price': 9475.5, 'ordType': 'Limit', 'ordStatus': 'New',
+             'timestamp': '2020-06-01T00:00:00.000Z'}
+    payloads = {'/api/v1/trade/bucketed': json.dumps([candle] * 1000).encode(),
+                '/api/v1/order': json.dumps(order).encode()}
+
+    class CannedAdapter(BaseAdapter):
+        # Serves canned responses: only the client-side CPU is measured
+
+        def send(self, request, **kwargs):
+            response = requests.Response()
+            response.status_code = 200
+            response._content = payloads[request.path_url.split('?')[0]]
+            response.request = request
+            response.url = request.url
+            return response
+
+        def close(self):
+            pass
+
+    transport = BitmexTransport(key='key', secret='secret')
+    transport.session.mount('https://', CannedAdapter())
+    benchmarks = {
+        'lean bucketedTrades (1000)': lambda: transport.bucketedTrades('XBTUSD', count=1000),
+        'lean bucketedTrades typed': lambda: transport.bucketedTrades('XBTUSD', count=1000, typed=True),
+        'lean newOrder': lambda: transport.newOrder(symbol='XBTUSD', side='Buy', orderQty=100,
+                                                    price=9475.5, ordType='Limit'),
+    }
+
+    try:
+        import bitmex
+        # Loads the Swagger spec from the exchange, then serves canned responses
+        client = bitmex.bitmex(test=True, api_key='key', api_secret='secret', config=None)
+        client.swagger_spec.http_client.session.mount('https://', CannedAdapter())
+        benchmarks['bravado Trade_getBucketed (1000)'] = lambda: client.Trade.Trade_getBucketed(
+            binSize='1d', symbol='XBTUSD', count=1000, reverse=True).result()
+        benchmarks['bravado Order_new'] = lambda: client.Order.Order_new(
+            symbol='XBTUSD', side='Buy', orderQty=100, price=9475.5, ordType='Limit').result()
+    except Exception as error:
+        print(f'Bravado client not available ({error}).')
+
+    for name, function in benchmarks.items():
+        number = 50
+        start = time.process_time()
+        for _ in range(number):
+            function()
+        elapsed = (time.process_time() - start) / number
+        print(f'{name:<34} {elapsed * 1e3:8.3f} ms CPU/call')
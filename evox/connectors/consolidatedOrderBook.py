@@ -0,0 +1,432 @@
+# coding=utf-8
+
+'''
+    Consolidated order book
+
+    Merges the order books of several venues (Binance, Bitmex, Bitfinex, ...)
+    into a single view. Every price level keeps the venues quoting it, so the
+    best bid/ask answers both "what is the price" and "where is it".
+
+    Prices can be fee-adjusted per venue: bids are stored as price * (1 - fee)
+    and asks as price * (1 + fee), which makes levels from venues with
+    different taker fees directly comparable.
+
+    Sizes of venues quoting contracts (Bitmex) are converted to base asset
+    quantities, so every quantity of the book is in the same unit. Contract
+    specifications are per symbol, so the book knows the symbol of every
+    contract venue.
+'''
+
+from bisect import bisect_left
+
+from .errors import EvoxError
+
+
+BID = 'bid'
+ASK = 'ask'
+
+# Contract specification by venue and symbol: (size of a contract, inverse).
+# Inverse contracts are worth a fixed quote amount (Bitmex XBTUSD: 1 USD),
+# so a contract is size / price of the base asset. Linear contracts are a
+# fixed base quantity (size). Quanto contracts (Bitmex ETHUSD) are worth a
+# quantity of the settlement asset and have no fixed base quantity; they are
+# set as linear with the base quantity of a contract at the current prices.
+# Symbols of a contract venue without a specification are rejected.
+CONTRACTS = {
+    'bitmex': {
+        'XBTUSD': (1.0, True),
+        'XBTEUR': (1.0, True),
+    },
+}
+
+
+class OrderBookException(EvoxError):
+    pass
+
+
+def contractSpec(contracts, venue, symbol):
+    '''
+        Contract specification of a venue symbol, None if the venue quotes base quantities.
+    '''
+    specs = contracts.get(venue)
+    if specs is None:
+        return None
+    spec = specs.get(str(symbol).upper()) if symbol is not None else None
+    if spec is None:
+        raise OrderBookException(f'No contract specification for {venue} symbol ({symbol}).')
+    return spec
+
+
+def inverseSymbols(contracts=CONTRACTS):
+    '''
+        Symbols of the inverse contracts of every venue.
+    '''
+    return frozenset(symbol for specs in contracts.values()
+                     for symbol, (_, inverse) in specs.items() if inverse)
+
+
+def contractToBase(contract, price, size):
+    '''
+        Base asset quantity of a size in contracts (contract None: already base).
+    '''
+    if contract is None:
+        return size
+    contractSize, inverse = contract
+    return size * contractSize / price if inverse else size * contractSize
+
+
+def baseToContract(contract, price, quantity):
+    '''
+        Size in contracts of a base asset quantity (contract None: kept in base).
+    '''
+    if contract is None:
+        return quantity
+    contractSize, inverse = contract
+    return quantity * price / contractSize if inverse else quantity / contractSize
+
+
+class BookSide(object):
+    '''
+        One side of the consolidated book.
+
+        Levels are kept in a sorted list of keys plus a dictionary of levels,
+        so the top of book is O(1) and a level lookup is O(1). Inserting or
+        removing a level is a O(log n) search plus a O(n) shift of the list;
+        the shift is a memmove of pointers, cheaper than a tree for the few
+        thousand levels of a book, and quantity updates of an existing level
+        (most of a feed) do not touch the list. Bids are keyed by the negative
+        price so the best level is always the first key on both sides.
+
+        Attributes
+        ------------
+        descending : bool
+            True for bids (best is the highest price), False for asks
+    '''
+
+    def __init__(self, descending):
+        self._sign = -1 if descending else 1
+        self._keys = []
+        self._levels = {}
+
+    def __len__(self):
+        return len(self._keys)
+
+    def update(self, venue, price, adjusted, quantity):
+        '''
+            Set the quantity quoted by a venue at a level.
+            A quantity of zero removes the venue from the level.
+        '''
+        key = self._sign * adjusted
+        level = self._levels.get(key)
+
+        if quantity <= 0:
+            if level is None or venue not in level:
+                return
+            del level[venue]
+            if not level:
+                del self._levels[key]
+                del self._keys[bisect_left(self._keys, key)]
+            return
+
+        if level is None:
+            level = self._levels[key] = {}
+            index = bisect_left(self._keys, key)
+            self._keys.insert(index, key)
+        level[venue] = (price, quantity)
+
+    def best(self):
+        '''
+            :returns: tuple (adjusted price, {venue: (price, quantity)}) or None if empty
+        '''
+        if not self._keys:
+            return None
+        key = self._keys[0]
+        return self._sign * key, self._levels[key]
+
+    def level(self, adjusted):
+        '''
+            :returns: dictionary {venue: (price, quantity)} or None if the level does not exist
+        '''
+        return self._levels.get(self._sign * adjusted)
+
+    def levels(self, count=None):
+        '''
+            Iterate over the levels from the best price outwards.
+
+            :returns: generator of tuples (adjusted price, {venue: (price, quantity)})
+        '''
+        keys = self._keys if count is None else self._keys[:count]
+        for key in keys:
+            yield self._sign * key, self._levels[key]
+
+
+class ConsolidatedOrderBook(object):
+    '''
+        Cross-venue order book with venue attribution
+
+        Attributes
+        ------------
+        fees : dict
+            Taker fee rate by venue, e.g. {'binance': 0.001}. Venues
+            without a fee are merged at their raw prices.
+
+        contracts : dict
+            Contract specification (size, inverse) by venue and symbol, e.g.
+            {'bitmex': {'XBTUSD': (1.0, True)}}. Default CONTRACTS; venues
+            without one quote base asset quantities.
+
+        symbols : dict
+            Symbol by venue, e.g. {'bitmex': 'XBTUSD'}; required for the
+            contract venues.
+    '''
+
+    def __init__(self, fees=None, contracts=None, symbols=None):
+        self._fees = dict(fees or {})
+        self._contracts = dict(CONTRACTS if contracts is None else contracts)
+        self._symbols = dict(symbols or {})
+        self._specs = {}
+        self._sides = {BID: BookSide(descending=True),
+                       ASK: BookSide(descending=False)}
+        self._venues = {}
+
+    @property
+    def venues(self):
+        return list(self._venues)
+
+    @property
+    def contracts(self):
+        '''
+            Contract specification by contract venue of the book symbols.
+        '''
+        return {venue: self.contract(venue) for venue in self._symbols
+                if venue in self._contracts}
+
+    def contract(self, venue):
+        '''
+            Contract specification of the venue symbol, None for base quantities.
+        '''
+        if venue not in self._specs:
+            self._specs[venue] = contractSpec(self._contracts, venue, self._symbols.get(venue))
+        return self._specs[venue]
+
+    def fee(self, venue):
+        return self._fees.get(venue, 0.0)
+
+    def adjust(self, venue, side, price):
+        '''
+            Fee-adjusted price of a level quoted by a venue.
+        '''
+        fee = self._fees.get(venue, 0.0)
+        if side == BID:
+            return price * (1.0 - fee)
+        return price * (1.0 + fee)
+
+    def toBase(self, venue, price, quantity):
+        '''
+            Base asset quantity of a size quoted by a venue.
+        '''
+        return contractToBase(self.contract(venue), price, quantity)
+
+    def toVenue(self, venue, price, quantity):
+        '''
+            Size in the venue unit (contracts) of a base asset quantity.
+        '''
+        return baseToContract(self.contract(venue), price, quantity)
+
+    def _venueBook(self, venue):
+        book = self._venues.get(venue)
+        if book is None:
+            book = self._venues[venue] = {BID: {}, ASK: {}}
+        return book
+
+    def update(self, venue, side, price, quantity):
+        '''
+            Apply a level update from a venue.
+
+            :param venue: required
+            :type venue: str
+            :param side: required - 'bid' or 'ask'
+            :type side: str
+            :param price: required
+            :type price: float
+            :param quantity: required - size in the venue unit; 0 removes the level
+            :type quantity: float
+        '''
+        if side not in self._sides:
+            raise OrderBookException(f'Invalid order book side ({side}).')
+
+        price = float(price)
+        self._set(venue, side, price, self.toBase(venue, price, float(quantity)))
+
+    def _set(self, venue, side, price, quantity):
+        levels = self._venueBook(venue)[side]
+        if quantity > 0:
+            levels[price] = quantity
+        else:
+            levels.pop(price, None)
+        self._sides[side].update(venue, price,
+                                 self.adjust(venue, side, price),
+                                 quantity)
+
+    def loadSnapshot(self, venue, bids, asks):
+        '''
+            Replace every level of a venue with a full snapshot.
+
+            :param venue: required
+            :type venue: str
+            :param bids: required - iterable of (price, quantity)
+            :type bids: list
+            :param asks: required - iterable of (price, quantity)
+            :type asks: list
+        '''
+        self.clear(venue)
+        for price, quantity in bids:
+            self.update(venue, BID, price, quantity)
+        for price, quantity in asks:
+            self.update(venue, ASK, price, quantity)
+
+    def clear(self, venue):
+        '''
+            Remove every level quoted by a venue.
+        '''
+        book = self._venues.pop(venue, None)
+        if book is None:
+            return
+        for side, levels in book.items():
+            for price in levels:
+                self._sides[side].update(venue, price,
+                                         self.adjust(venue, side, price), 0)
+
+    def setFee(self, venue, fee):
+        '''
+            Change the fee of a venue and re-index its levels.
+        '''
+        book = self._venues.get(venue)
+        if book is None:
+            self._fees[venue] = float(fee)
+            return
+        self.clear(venue)
+        self._fees[venue] = float(fee)
+        # Stored quantities are already in the base asset
+        for side in (BID, ASK):
+            for price, quantity in book[side].items():
+                self._set(venue, side, price, quantity)
+
+    def bestBid(self):
+        '''
+            :returns: tuple (adjusted price, {venue: (price, quantity)}) or None if empty
+        '''
+        return self._sides[BID].best()
+
+    def bestAsk(self):
+        '''
+            :returns: tuple (adjusted price, {venue: (price, quantity)}) or None if empty
+        '''
+        return self._sides[ASK].best()
+
+    def spread(self):
+        bid = self.bestBid()
+        ask = self.bestAsk()
+        if bid is None or ask is None:
+            return None
+        return ask[0] - bid[0]
+
+    def depthAt(self, side, price, venue=None):
+        '''
+            Base asset quantity available at an exact level of the consolidated book.
+
+            :param side: required - 'bid' or 'ask'
+            :type side: str
+            :param price: required - raw price when venue is sent, adjusted price otherwise
+            :type price: float
+            :param venue: -
+            :type venue: str
+
+            :returns: float
+        '''
+        if venue is not None:
+            book = self._venues.get(venue)
+            return book[side].get(float(price), 0.0) if book is not None else 0.0
+        level = self._sides[side].level(float(price))
+        if not level:
+            return 0.0
+        return sum(quantity for _, quantity in level.values())
+
+    def levels(self, side, count=None):
+        '''
+            Iterate over the levels of a side from the best price outwards.
+
+            :returns: generator of tuples (adjusted price, {venue: (price, quantity)})
+        '''
+        return self._sides[side].levels(count)
+
+
+def parseBinanceBook(response):
+    '''
+        Convert a BinanceMiddleware.fetchOrderBook response into (bids, asks).
+    '''
+    bids = [(float(price), float(quantity)) for price, quantity in response['bids']]
+    asks = [(float(price), float(quantity)) for price, quantity in response['asks']]
+    return bids, asks
+
+
+def parseBitmexBook(response):
+    '''
+        Convert a BitmexMiddleware.fetchOrderBook response into (bids, asks).
+    '''
+    bids = []
+    asks = []
+    for level in response:
+        entry = (float(level['price']), float(level['size']))
+        if level['side'] == 'Buy':
+            bids.append(entry)
+        else:
+            asks.append(entry)
+    return bids, asks
+
+
+def parseBitfinexBook(response, precision='P0'):
+    '''
+        Convert a BitfinexMiddleware.fetchOrderBook response into (bids, asks).
+        Price aggregated books (P0 - P3) are [price, count, amount] rows; raw
+        books (R0) are [orderId, price, amount] rows, one per order, summed by price.
+    '''
+    if str(precision).upper() == 'R0':
+        levels = {}
+        for _, price, amount in response:
+            levels[float(price)] = levels.get(float(price), 0.0) + float(amount)
+        rows = levels.items()
+    else:
+        rows = ((price, amount) for price, _, amount in response)
+
+    bids = []
+    asks = []
+    for price, amount in rows:
+        if amount > 0:
+            bids.append((float(price), float(amount)))
+        elif amount < 0:
+            asks.append((float(price), float(-amount)))
+    return bids, asks
+
+
+BOOK_PARSERS = {
+    'binance': parseBinanceBook,
+    'bitmex': parseBitmexBook,
+    'bitfinex': parseBitfinexBook,
+}
+
+
+if __name__ == '__main__':
+    book = ConsolidatedOrderBook(fees={'binance': 0.001, 'bitmex': 0.00075},
+                                 symbols={'bitmex': 'XBTUSD'})
+    book.loadSnapshot('binance', *parseBinanceBook({
+        'bids': [['9474.10', '1.5'], ['9474.00', '3.0']],
+        'asks': [['9474.20', '0.8'], ['9475.00', '2.0']]}))
+    book.loadSnapshot('bitmex', *parseBitmexBook([
+        {'side': 'Sell', 'size': 1000, 'price': 9475.0},
+        {'side': 'Buy', 'size': 25000, 'price': 9474.5}]))
+    print(book.bestBid())
+    print(book.bestAsk())
+    print(book.spread())
+    # Bitmex contracts are counted in BTC with the Binance quantities
+    print(book.depthAt(BID, 9474.5, venue='bitmex'))
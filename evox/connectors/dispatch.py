@@ -0,0 +1,75 @@
+# coding=utf-8
+
+'''
+    Middleware calls
+
+    The Bitfinex middleware is async while the others are not; the components
+    working with every venue (SmartOrderRouter, Resampler, PollingScheduler)
+    call their methods through call, which returns the result in both cases.
+
+    Coroutines of a middleware with its own event loop (loop attribute, an
+    EventLoopThread) run on that loop, so every call shares its sessions and
+    rate limiter whatever the calling thread; the others run with asyncio.run.
+'''
+
+import asyncio
+import threading
+
+
+class EventLoopThread(object):
+    '''
+        Event loop running in a daemon thread, started on first use
+    '''
+
+    def __init__(self, name='evox-loop'):
+        self._name = name
+        self._loop = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self):
+        with self._lock:
+            if self._loop is None or self._loop.is_closed():
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name=self._name, daemon=True).start()
+                self._loop = loop
+            return self._loop
+
+    def run(self, coroutine):
+        '''
+            Run a coroutine on the loop and wait for its result.
+        '''
+        return runOn(self.loop, coroutine)
+
+    def close(self):
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(loop.stop)
+
+
+def runOn(loop, coroutine):
+    '''
+        Run a coroutine on an event loop running in another thread and wait for its result.
+    '''
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        coroutine.close()
+        raise RuntimeError('Blocking call on the event loop of the middleware, await the method instead.')
+    return asyncio.run_coroutine_threadsafe(coroutine, loop).result()
+
+
+def call(method, *args, **kwargs):
+    '''
+        Call a middleware method, running it to completion if it is a coroutine.
+    '''
+    result = method(*args, **kwargs)
+    if asyncio.iscoroutine(result):
+        loop = getattr(getattr(method, '__self__', None), 'loop', None)
+        if isinstance(loop, asyncio.AbstractEventLoop):
+            return runOn(loop, result)
+        result = asyncio.run(result)
+    return result
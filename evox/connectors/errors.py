@@ -0,0 +1,282 @@
+# coding=utf-8
+
+'''
+    Exceptions of the connectors
+
+    Every exception raised by the package is an EvoxError. Exchange failures
+    are raised as one of its kinds (RateLimited, InsufficientFunds,
+    InvalidOrder, Transient, ClockDrift, AuthError) carrying the exchange error code and
+    HTTP status, so retry, backoff and circuit breaker logic can branch on
+    the type or on error.retryable instead of parsing messages.
+
+    The kind of an error is looked up in precomputed tables of exchange error
+    codes and HTTP statuses (a dictionary lookup, once, when the error is
+    raised). Codes shared by several failures are refined by the error
+    message, e.g. Binance -2010 is an InsufficientFunds only when the message
+    says "insufficient balance"; Bitmex sends no codes, so its HTTP statuses
+    (400 for every rejected request) are refined the same way.
+
+    Exchange exceptions (BinanceException, BitmexException, ...) have a
+    subclass per kind, e.g. BitmexRateLimited(RateLimited, BitmexException),
+    so handlers of either type catch it.
+'''
+
+import asyncio
+
+
+class EvoxError(Exception):
+    '''
+        Attributes
+        ------------
+        message : str
+
+        code : int
+            Exchange error code, if any
+
+        exchange : str
+
+        status : int
+            HTTP status, if any
+
+        retryAfter : float
+            Seconds to wait before retrying, if sent by the exchange
+
+        retryable : bool
+            The same request may succeed if sent again later
+    '''
+    retryable = False
+
+    def __init__(self, message, code=None, exchange=None, status=None, retryAfter=None):
+        super().__init__(message)
+        self.message = str(message)
+        self.code = code
+        self.exchange = exchange
+        self.status = status
+        self.retryAfter = retryAfter
+
+
+class RateLimited(EvoxError):
+    retryable = True
+
+
+class InvalidOrder(EvoxError):
+    pass
+
+
+class InsufficientFunds(InvalidOrder):
+    pass
+
+
+class Transient(EvoxError):
+    retryable = True
+
+
+class ClockDrift(EvoxError):
+    '''
+        Request timestamp outside the exchange window. Not retryable as such:
+        the same request fails again until the local clock or the client time
+        offset is resynchronised with the exchange server time.
+    '''
+    pass
+
+
+class AuthError(EvoxError):
+    pass
+
+
+# Most specific first (InsufficientFunds is an InvalidOrder)
+KINDS = (RateLimited, InsufficientFunds, InvalidOrder, Transient, ClockDrift, AuthError)
+
+# https://binance-docs.github.io/apidocs/spot/en/#error-codes
+BINANCE_CODES = {code: InvalidOrder for code in range(-1130, -1099)}
+BINANCE_CODES.update({
+    -1000: Transient,           # UNKNOWN
+    -1001: Transient,           # DISCONNECTED
+    -1003: RateLimited,         # TOO_MANY_REQUESTS
+    -1006: Transient,           # UNEXPECTED_RESP
+    -1007: Transient,           # TIMEOUT
+    -1008: Transient,           # SERVER_BUSY
+    -1015: RateLimited,         # TOO_MANY_ORDERS
+    -1016: Transient,           # SERVICE_SHUTTING_DOWN
+    -1021: ClockDrift,          # INVALID_TIMESTAMP
+    -1002: AuthError,           # UNAUTHORIZED
+    -1022: AuthError,           # INVALID_SIGNATURE
+    -2014: AuthError,           # BAD_API_KEY_FMT
+    -2015: AuthError,           # REJECTED_MBX_KEY
+    -1013: InvalidOrder,        # Filter failure
+    -2011: InvalidOrder,        # CANCEL_REJECTED
+    -2013: InvalidOrder,        # NO_SUCH_ORDER
+    -2010: InvalidOrder,        # NEW_ORDER_REJECTED, see BINANCE_MESSAGES
+    -2019: InsufficientFunds,   # Margin is insufficient
+})
+
+# Refinement of codes shared by several failures: (message part, kind)
+BINANCE_MESSAGES = {
+    # Also LIMIT_MAKER orders that would take, market closed, self-trade prevention...
+    -2010: (('insufficient balance', InsufficientFunds),),
+}
+
+# https://docs.bitfinex.com/docs/abbreviations-glossary#error-codes
+BITFINEX_CODES = {
+    10020: InvalidOrder,        # ERR_PARAMS
+    10100: AuthError,           # ERR_AUTH_FAIL
+    10111: AuthError,           # ERR_AUTH_PAYLOAD
+    10112: AuthError,           # ERR_AUTH_SIG
+    10113: AuthError,           # ERR_AUTH_HMAC
+    10114: Transient,           # ERR_AUTH_NONCE, concurrent requests
+    11000: Transient,           # ERR_READY
+    11010: RateLimited,         # ERR_RATE_LIMIT
+    20051: Transient,           # Stop/restart
+    20060: Transient,           # Maintenance
+}
+
+# Refinement of the HTTP statuses of exchanges without error codes: (message part, kind)
+# https://www.bitmex.com/app/restAPI#Errors
+BITMEX_MESSAGES = {
+    400: (('insufficient available balance', InsufficientFunds),
+          ('invalid price', InvalidOrder),
+          ('invalid orderqty', InvalidOrder),
+          ('invalid leavesqty', InvalidOrder),
+          ('invalid ordstatus', InvalidOrder),
+          ('invalid orderid', InvalidOrder),
+          ('invalid clordid', InvalidOrder),
+          ('duplicate clordid', InvalidOrder),
+          ('immediate liquidation', InvalidOrder),
+          ('liquidation price', InvalidOrder)),
+}
+
+HTTP_STATUSES = {status: Transient for status in range(500, 600)}
+HTTP_STATUSES.update({
+    401: AuthError,
+    403: AuthError,
+    408: Transient,
+    418: RateLimited,           # Binance IP ban after repeated 429
+    429: RateLimited,
+})
+
+EXCHANGE_CODES = {
+    'binance': BINANCE_CODES,
+    'bitfinex': BITFINEX_CODES,
+}
+
+EXCHANGE_MESSAGES = {
+    'binance': BINANCE_MESSAGES,
+}
+
+EXCHANGE_STATUS_MESSAGES = {
+    'bitmex': BITMEX_MESSAGES,
+}
+
+EXCHANGE_STATUSES = {
+    # Binance answers 403 when the WAF limit is violated
+    'binance': {**HTTP_STATUSES, 403: RateLimited},
+}
+
+# Network failures of the vendor clients
+TRANSIENT_ERRORS = (ConnectionError, TimeoutError, asyncio.TimeoutError)
+try:
+    import requests
+    TRANSIENT_ERRORS += (requests.exceptions.ConnectionError,
+                         requests.exceptions.Timeout,
+                         requests.exceptions.ChunkedEncodingError)
+except ImportError:
+    pass
+
+
+def classify(exchange, code=None, status=None, message=None):
+    '''
+        Kind of an exchange failure, by error code first and HTTP status second.
+        The message refines the codes shared by several failures and the
+        statuses of the exchanges without codes (Bitmex).
+
+        :returns: RateLimited, InsufficientFunds, InvalidOrder, Transient, ClockDrift, AuthError or EvoxError
+    '''
+    if code is not None:
+        kind = EXCHANGE_CODES.get(exchange, {}).get(code)
+        if kind is not None:
+            return _refine(EXCHANGE_MESSAGES.get(exchange, {}).get(code, ()), message) or kind
+    if status is not None:
+        refined = _refine(EXCHANGE_STATUS_MESSAGES.get(exchange, {}).get(status, ()), message)
+        return refined or EXCHANGE_STATUSES.get(exchange, HTTP_STATUSES).get(status, EvoxError)
+    return EvoxError
+
+
+def _refine(messages, message):
+    if messages and message:
+        lowered = str(message).lower()
+        for part, refined in messages:
+            if part in lowered:
+                return refined
+    return None
+
+
+def kindOf(error):
+    '''
+        :returns: the kind of an exception (EvoxError if it has none)
+    '''
+    for kind in KINDS:
+        if isinstance(error, kind):
+            return kind
+    if isinstance(error, TRANSIENT_ERRORS):
+        return Transient
+    return EvoxError
+
+
+def isRetryable(error):
+    return getattr(error, 'retryable', False) or isinstance(error, TRANSIENT_ERRORS)
+
+
+def exchangeErrors(base):
+    '''
+        Subclasses of an exchange exception per kind.
+
+        :returns: dictionary {kind: class}, EvoxError mapped to the exchange exception itself
+    '''
+    prefix = base.__name__[:-len('Exception')] if base.__name__.endswith('Exception') else base.__name__
+    classes = {EvoxError: base}
+    for kind in KINDS:
+        classes[kind] = type(f'{prefix}{kind.__name__}', (kind, base),
+                             {'__module__': base.__module__})
+    return classes
+
+
+def _retryAfter(error):
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+def wrap(error, exchange, classes, kind=None, code=None, status=None):
+    '''
+        Exchange exception of the kind of an error raised by a vendor client.
+        Code, status and Retry-After are read from the error when available.
+
+        :param classes: required - exchangeErrors of the exchange exception
+        :type classes: dict
+
+        :returns: the error itself if it is already an exchange exception
+    '''
+    if isinstance(error, classes[EvoxError]):
+        return error
+    code = code if code is not None else getattr(error, 'code', None)
+    if status is None:
+        status = getattr(error, 'status_code', None) or getattr(error, 'status', None)
+    if not isinstance(code, int):
+        code = None
+    if not isinstance(status, int):
+        status = None
+    message = getattr(error, 'message', None) or str(error)
+    if kind is None:
+        kind = kindOf(error)
+        if kind is EvoxError:
+            kind = classify(exchange, code, status, message)
+
+    typed = classes[kind](message, code=code, exchange=exchange, status=status,
+                          retryAfter=getattr(error, 'retryAfter', None) or _retryAfter(error))
+    typed.__cause__ = error
+    return typed
@@ -0,0 +1,541 @@
+# coding=utf-8
+
+'''
+    Technical indicators over the connectors' candles
+
+    Full history is computed vectorized over a NumPy OHLCV array; new candles
+    update the indicator state in O(1). The state is kept per symbol and
+    interval by IndicatorPipeline, fed directly with fetchOHLCV results.
+
+    EMA style recursions are evaluated block by block in closed form
+    (y[t] = w^t * (y0 + a * cumsum(x[i] / w^i))), the block length bounded
+    so that w^-i stays below 1e15: x[i] / w^i only overflows for values
+    above about 1e290, far from any price (e.g. BTCIDR around 1e9).
+'''
+
+import math
+from datetime import datetime
+
+import numpy as np
+
+from .errors import EvoxError
+
+
+TIME, OPEN, HIGH, LOW, CLOSE, VOLUME = range(6)
+
+
+class IndicatorException(EvoxError):
+    pass
+
+
+# --- Candles
+
+def _milliseconds(timestamp):
+    if isinstance(timestamp, datetime):
+        return timestamp.timestamp() * 1000.0
+    if isinstance(timestamp, str):
+        return datetime.fromisoformat(timestamp.replace('Z', '+00:00')).timestamp() * 1000.0
+    return float(timestamp)
+
+
+def _binanceRow(kline):
+    # [openTime, open, high, low, close, volume, closeTime, ...]
+    return (float(kline[0]), float(kline[1]), float(kline[2]),
+            float(kline[3]), float(kline[4]), float(kline[5]))
+
+
+def _bitmexRow(candle):
+    return (_milliseconds(candle['timestamp']), float(candle['open']), float(candle['high']),
+            float(candle['low']), float(candle['close']), float(candle['volume']))
+
+
+def _bitfinexRow(candle):
+    # [mts, open, close, high, low, volume]
+    return (float(candle[0]), float(candle[1]), float(candle[3]),
+            float(candle[4]), float(candle[2]), float(candle[5]))
+
+
+CANDLE_PARSERS = {
+    'binance': _binanceRow,
+    'bitmex': _bitmexRow,
+    'bitfinex': _bitfinexRow,
+}
+
+
+def candleRows(candles, exchange):
+    '''
+        :returns: list of (time, open, high, low, close, volume) tuples sorted by time
+    '''
+    try:
+        parser = CANDLE_PARSERS[exchange]
+    except KeyError:
+        raise IndicatorException(f'Exchange not implemented ({exchange}).')
+    rows = [parser(candle) for candle in candles]
+    rows.sort(key=lambda row: row[TIME])
+    return rows
+
+
+def ohlcvArray(candles, exchange):
+    '''
+        Convert fetchOHLCV results into a float array of shape (n, 6),
+        columns TIME (ms), OPEN, HIGH, LOW, CLOSE and VOLUME, oldest first.
+    '''
+    rows = candleRows(candles, exchange)
+    if not rows:
+        return np.empty((0, 6))
+    array = np.array(rows, dtype=np.float64)
+    # Keep the last row of a repeated time (e.g. overlapping pages)
+    keep = np.append(array[1:, TIME] != array[:-1, TIME], True)
+    return array[keep]
+
+
+# --- Vectorized
+
+def _recursive(values, alpha, initial):
+    '''
+        y[t] = (1 - alpha) * y[t - 1] + alpha * values[t], with y[-1] = initial
+    '''
+    values = np.asarray(values, dtype=np.float64)
+    result = np.empty(len(values))
+    decay = 1.0 - alpha
+    if decay <= 0.0:
+        result[:] = values
+        return result
+    block = max(1, int(15.0 / -math.log10(decay)))
+    powers = decay ** np.arange(1, block + 1)
+    inverse = 1.0 / powers
+    previous = initial
+    for start in range(0, len(values), block):
+        chunk = values[start:start + block]
+        size = len(chunk)
+        sums = np.cumsum(chunk * inverse[:size] * alpha)
+        result[start:start + size] = powers[:size] * (previous + sums)
+        previous = result[start + size - 1]
+    return result
+
+
+def _smoothed(values, alpha, period):
+    # Seeded with the simple average of the first period values, NaN before it
+    values = np.asarray(values, dtype=np.float64)
+    result = np.full(len(values), np.nan)
+    if len(values) < period:
+        return result
+    seed = values[:period].mean()
+    result[period - 1] = seed
+    result[period:] = _recursive(values[period:], alpha, seed)
+    return result
+
+
+def sma(values, period):
+    values = np.asarray(values, dtype=np.float64)
+    result = np.full(len(values), np.nan)
+    if len(values) >= period:
+        result[period - 1:] = np.lib.stride_tricks.sliding_window_view(values, period).mean(axis=1)
+    return result
+
+
+def ema(values, period):
+    return _smoothed(values, 2.0 / (period + 1), period)
+
+
+def _gainsLosses(close):
+    delta = np.diff(np.asarray(close, dtype=np.float64))
+    return np.clip(delta, 0.0, None), np.clip(-delta, 0.0, None)
+
+
+def _rsi(gains, losses):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(losses == 0.0, 100.0, 100.0 - 100.0 / (1.0 + gains / losses))
+
+
+def rsi(close, period=14):
+    '''
+        Wilder's relative strength index, aligned with close.
+    '''
+    gains, losses = _gainsLosses(close)
+    averageGains = _smoothed(gains, 1.0 / period, period)
+    averageLosses = _smoothed(losses, 1.0 / period, period)
+    result = _rsi(averageGains, averageLosses)
+    result[np.isnan(averageGains)] = np.nan
+    return np.concatenate(([np.nan], result))
+
+
+def trueRange(high, low, close):
+    high = np.asarray(high, dtype=np.float64)
+    low = np.asarray(low, dtype=np.float64)
+    close = np.asarray(close, dtype=np.float64)
+    result = high - low
+    if len(close) > 1:
+        previous = close[:-1]
+        result[1:] = np.maximum(result[1:], np.maximum(np.abs(high[1:] - previous),
+                                                       np.abs(low[1:] - previous)))
+    return result
+
+
+def atr(high, low, close, period=14):
+    '''
+        Wilder's average true range.
+    '''
+    return _smoothed(trueRange(high, low, close), 1.0 / period, period)
+
+
+def bollinger(close, period=20, width=2.0):
+    '''
+        :returns: tuple of arrays (middle, upper, lower)
+    '''
+    close = np.asarray(close, dtype=np.float64)
+    middle = np.full(len(close), np.nan)
+    deviation = np.full(len(close), np.nan)
+    if len(close) >= period:
+        windows = np.lib.stride_tricks.sliding_window_view(close, period)
+        middle[period - 1:] = windows.mean(axis=1)
+        deviation[period - 1:] = windows.std(axis=1)
+    return middle, middle + width * deviation, middle - width * deviation
+
+
+# --- Streaming
+#
+# load(array) computes the full history and keeps the state of its last
+# candle; update(candle) applies one more candle in O(1). snapshot/restore
+# let a still forming candle be replaced by its next version.
+
+class EMA(object):
+    __slots__ = ('period', 'alpha', 'value', '_count', '_sum')
+
+    def __init__(self, period):
+        self.period = period
+        self.alpha = 2.0 / (period + 1)
+        self.value = None
+        self._count = 0
+        self._sum = 0.0
+
+    def load(self, array):
+        close = array[:, CLOSE]
+        values = ema(close, self.period)
+        self._count = len(close)
+        self._sum = close[-self.period:].sum() if len(close) < self.period else 0.0
+        self.value = float(values[-1]) if len(close) >= self.period else None
+        return values
+
+    def update(self, candle):
+        value = float(candle[CLOSE])
+        self._count += 1
+        if self._count < self.period:
+            self._sum += value
+        elif self._count == self.period:
+            self.value = (self._sum + value) / self.period
+        else:
+            self.value += self.alpha * (value - self.value)
+        return self.value
+
+    def snapshot(self):
+        return (self.value, self._count, self._sum)
+
+    def restore(self, state):
+        self.value, self._count, self._sum = state
+
+
+class RSI(object):
+    __slots__ = ('period', 'value', '_previous', '_count', '_gains', '_losses')
+
+    def __init__(self, period=14):
+        self.period = period
+        self.value = None
+        self._previous = None
+        self._count = 0
+        self._gains = 0.0
+        self._losses = 0.0
+
+    def load(self, array):
+        close = array[:, CLOSE]
+        if not len(close):
+            return np.empty(0)
+        gains, losses = _gainsLosses(close)
+        self._previous = float(close[-1])
+        self._count = len(gains)
+        if len(gains) >= self.period:
+            self._gains = float(_smoothed(gains, 1.0 / self.period, self.period)[-1])
+            self._losses = float(_smoothed(losses, 1.0 / self.period, self.period)[-1])
+        else:
+            self._gains = float(gains.sum())
+            self._losses = float(losses.sum())
+        values = rsi(close, self.period)
+        self.value = float(values[-1]) if self._count >= self.period else None
+        return values
+
+    def update(self, candle):
+        value = float(candle[CLOSE])
+        previous, self._previous = self._previous, value
+        if previous is None:
+            return None
+        delta = value - previous
+        gain = delta if delta > 0 else 0.0
+        loss = -delta if delta < 0 else 0.0
+        self._count += 1
+        if self._count < self.period:
+            self._gains += gain
+            self._losses += loss
+            return None
+        if self._count == self.period:
+            self._gains = (self._gains + gain) / self.period
+            self._losses = (self._losses + loss) / self.period
+        else:
+            self._gains += (gain - self._gains) / self.period
+            self._losses += (loss - self._losses) / self.period
+        self.value = 100.0 if self._losses == 0 else 100.0 - 100.0 / (1.0 + self._gains / self._losses)
+        return self.value
+
+    def snapshot(self):
+        return (self.value, self._previous, self._count, self._gains, self._losses)
+
+    def restore(self, state):
+        self.value, self._previous, self._count, self._gains, self._losses = state
+
+
+class ATR(object):
+    __slots__ = ('period', 'value', '_previous', '_count', '_sum')
+
+    def __init__(self, period=14):
+        self.period = period
+        self.value = None
+        self._previous = None
+        self._count = 0
+        self._sum = 0.0
+
+    def load(self, array):
+        ranges = trueRange(array[:, HIGH], array[:, LOW], array[:, CLOSE])
+        values = _smoothed(ranges, 1.0 / self.period, self.period)
+        self._count = len(ranges)
+        self._previous = float(array[-1, CLOSE]) if len(ranges) else None
+        self._sum = float(ranges.sum()) if len(ranges) < self.period else 0.0
+        self.value = float(values[-1]) if len(ranges) >= self.period else None
+        return values
+
+    def update(self, candle):
+        high, low, close = float(candle[HIGH]), float(candle[LOW]), float(candle[CLOSE])
+        previous, self._previous = self._previous, close
+        value = high - low
+        if previous is not None:
+            value = max(value, abs(high - previous), abs(low - previous))
+        self._count += 1
+        if self._count < self.period:
+            self._sum += value
+        elif self._count == self.period:
+            self.value = (self._sum + value) / self.period
+        else:
+            self.value += (value - self.value) / self.period
+        return self.value
+
+    def snapshot(self):
+        return (self.value, self._previous, self._count, self._sum)
+
+    def restore(self, state):
+        self.value, self._previous, self._count, self._sum = state
+
+
+class Bollinger(object):
+    '''
+        value is a tuple (middle, upper, lower)
+    '''
+    __slots__ = ('period', 'width', 'value', '_window', '_index', '_count',
+                 '_sum', '_squares', '_center')
+
+    def __init__(self, period=20, width=2.0):
+        self.period = period
+        self.width = width
+        self.value = None
+        self._window = [0.0] * period
+        self._index = 0
+        self._count = 0
+        self._sum = 0.0
+        self._squares = 0.0
+        # Sums are of the distance to a reference price, to keep the variance precise
+        self._center = None
+
+    def load(self, array):
+        close = array[:, CLOSE]
+        middle, upper, lower = bollinger(close, self.period, self.width)
+        self._window = [0.0] * self.period
+        self._index = 0
+        self._count = 0
+        self._sum = 0.0
+        self._squares = 0.0
+        self._center = None
+        self.value = None
+        for value in close[-self.period:]:
+            self._add(float(value))
+        if len(close) >= self.period:
+            self.value = (float(middle[-1]), float(upper[-1]), float(lower[-1]))
+        return middle, upper, lower
+
+    def _add(self, value):
+        if self._center is None:
+            self._center = value
+        value -= self._center
+        if self._count >= self.period:
+            old = self._window[self._index]
+            self._sum -= old
+            self._squares -= old * old
+        else:
+            self._count += 1
+        self._window[self._index] = value
+        self._index = (self._index + 1) % self.period
+        self._sum += value
+        self._squares += value * value
+
+    def update(self, candle):
+        self._add(float(candle[CLOSE]))
+        if self._count < self.period:
+            return None
+        mean = self._sum / self.period
+        deviation = math.sqrt(max(self._squares / self.period - mean * mean, 0.0))
+        middle = self._center + mean
+        self.value = (middle, middle + self.width * deviation, middle - self.width * deviation)
+        return self.value
+
+    def snapshot(self):
+        return (self.value, self._index, self._count, self._sum, self._squares,
+                self._center, self._window[self._index])
+
+    def restore(self, state):
+        self.value, self._index, self._count, self._sum, self._squares, self._center, old = state
+        self._window[self._index] = old
+
+
+DEFAULT_INDICATORS = {
+    'ema20': lambda: EMA(20),
+    'ema50': lambda: EMA(50),
+    'rsi14': lambda: RSI(14),
+    'atr14': lambda: ATR(14),
+    'bollinger20': lambda: Bollinger(20, 2.0),
+}
+
+
+class IndicatorSet(object):
+    '''
+        Indicators of one symbol and interval
+    '''
+    __slots__ = ('indicators', 'lastTime', '_snapshots')
+
+    def __init__(self, factories):
+        self.indicators = {name: factory() for name, factory in factories.items()}
+        self.lastTime = None
+        self._snapshots = None
+
+    def load(self, array):
+        if not len(array):
+            return {name: indicator.load(array) for name, indicator in self.indicators.items()}
+
+        # The last candle may still be forming: it is applied as an update
+        # so that its next version can replace it
+        result = {name: indicator.load(array[:-1]) for name, indicator in self.indicators.items()}
+        self._snapshots = {name: indicator.snapshot()
+                           for name, indicator in self.indicators.items()}
+        self.lastTime = float(array[-1, TIME])
+        for name, indicator in self.indicators.items():
+            value = indicator.update(array[-1])
+            if isinstance(result[name], tuple):
+                result[name] = tuple(np.append(values, np.nan if value is None else value[index])
+                                     for index, values in enumerate(result[name]))
+            else:
+                result[name] = np.append(result[name], np.nan if value is None else value)
+        return result
+
+    def update(self, candle):
+        '''
+            Apply a new candle, or a new version of the last one (same time).
+        '''
+        time = float(candle[TIME])
+        if self.lastTime is not None and time < self.lastTime:
+            return self.values()
+        if time == self.lastTime and self._snapshots is not None:
+            for name, indicator in self.indicators.items():
+                indicator.restore(self._snapshots[name])
+        else:
+            self._snapshots = {name: indicator.snapshot()
+                               for name, indicator in self.indicators.items()}
+            self.lastTime = time
+        for indicator in self.indicators.values():
+            indicator.update(candle)
+        return self.values()
+
+    def values(self):
+        return {name: indicator.value for name, indicator in self.indicators.items()}
+
+
+class IndicatorPipeline(object):
+    '''
+        Indicator state per symbol and interval, fed with fetchOHLCV results
+
+        Attributes
+        ------------
+        exchange : str
+            binance, bitmex or bitfinex; format of the candles
+
+        indicators : dict
+            Indicator factory by name, e.g. {'ema200': lambda: EMA(200)}.
+            Default DEFAULT_INDICATORS.
+    '''
+
+    def __init__(self, exchange, indicators=None):
+        if exchange not in CANDLE_PARSERS:
+            raise IndicatorException(f'Exchange not implemented ({exchange}).')
+        self.exchange = exchange
+        self._factories = dict(indicators or DEFAULT_INDICATORS)
+        self._sets = {}
+
+    def load(self, symbol, interval, candles):
+        '''
+            Compute the full history (vectorized) and keep the state for streaming updates.
+
+            :returns: dictionary of arrays by indicator name, aligned with the candles
+        '''
+        array = ohlcvArray(candles, self.exchange)
+        indicators = self._sets[(symbol, interval)] = IndicatorSet(self._factories)
+        return indicators.load(array)
+
+    def update(self, symbol, interval, candles):
+        '''
+            Apply the candles of a new poll; only the candles not seen yet
+            (and the last known one, that may have changed) are processed.
+            A symbol and interval not loaded yet is loaded with them.
+
+            :returns: dictionary with the current value by indicator name
+        '''
+        indicators = self._sets.get((symbol, interval))
+        if indicators is None:
+            self.load(symbol, interval, candles)
+            return self._sets[(symbol, interval)].values()
+        lastTime = indicators.lastTime
+        for row in candleRows(candles, self.exchange):
+            if lastTime is None or row[TIME] >= lastTime:
+                indicators.update(row)
+        return indicators.values()
+
+    def values(self, symbol, interval):
+        try:
+            return self._sets[(symbol, interval)].values()
+        except KeyError:
+            raise IndicatorException(f'Indicators not loaded ({symbol} {interval}).')
+
+    def remove(self, symbol, interval):
+        self._sets.pop((symbol, interval), None)
+
+
+if __name__ == '__main__':
+    import timeit
+
+    count = 5000
+    close = 9000.0 + np.cumsum(np.random.randn(count))
+    candles = [[60000 * index, price, price + 5.0, price - 5.0, price, 1.0]
+               for index, price in enumerate(close)]
+
+    pipeline = IndicatorPipeline('binance')
+    number = 500
+    for index in range(number):
+        pipeline.load(f'S{index}', '1m', candles[:-1])
+    elapsed = timeit.timeit(lambda: [pipeline.update(f'S{index}', '1m', candles[-2:])
+                                     for index in range(number)], number=1)
+    print(f'{elapsed * 1e3:.2f} ms to update {number} symbols x {len(DEFAULT_INDICATORS)} indicators')
+    elapsed = timeit.timeit(lambda: pipeline.load('S0', '1m', candles), number=10)
+    print(f'{elapsed / 10 * 1e3:.2f} ms to load {count} candles')
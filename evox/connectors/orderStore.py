@@ -0,0 +1,464 @@
+# coding=utf-8
+
+'''
+    Local order and balance state
+
+    Keeps the open orders and balances of an account in memory so that
+    strategies do not have to call fetchOpenOrders/fetchBalance constantly.
+    The store is updated optimistically when orders are created, confirmed by
+    stream events, reconciled against REST with minimal diffs and persisted
+    to a SQLite snapshot for fast recovery after a restart.
+'''
+
+import sqlite3
+import threading
+import time
+
+from .jsonCodec import dumps, loads
+
+
+PENDING_NEW = 'PENDING_NEW'
+
+# Binance, Bitmex and paper statuses of an order still working
+OPEN_STATUSES = frozenset(['NEW', 'PARTIALLY_FILLED', 'PENDING_NEW',
+                           'New', 'PartiallyFilled', 'PendingNew'])
+
+
+BITFINEX_STATUSES = (('ACTIVE', 'NEW'),
+                     ('PARTIALLY FILLED', 'PARTIALLY_FILLED'),
+                     ('EXECUTED', 'FILLED'))
+
+
+def orderKey(order):
+    '''
+        Order identifier of a Binance (orderId), Bitmex (orderID) or Bitfinex (id) order.
+    '''
+    for key in ('orderId', 'orderID', 'id'):
+        if order.get(key) is not None:
+            return str(order[key])
+    return None
+
+
+def orderStatus(order):
+    return order.get('status') or order.get('ordStatus')
+
+
+def isOpen(order):
+    return orderStatus(order) in OPEN_STATUSES
+
+
+def balanceKey(balance):
+    return balance.get('asset') or balance.get('currency')
+
+
+def binanceExecutionReport(event):
+    '''
+        Convert a Binance user data stream executionReport into the REST order structure.
+    '''
+    return {'symbol': event['s'],
+            'orderId': event['i'],
+            'clientOrderId': event['c'],
+            'side': event['S'],
+            'type': event['o'],
+            'timeInForce': event['f'],
+            'price': event['p'],
+            'origQty': event['q'],
+            'executedQty': event['z'],
+            'status': event['X'],
+            'updateTime': event['E']}
+
+
+def bitfinexOrder(order):
+    '''
+        Convert a bfxapi Order into the Binance REST order structure.
+        Bitfinex statuses read e.g. "ACTIVE", "PARTIALLY FILLED @ 9000.0(0.5)",
+        "EXECUTED @ 9000.0(1.0)" or "CANCELED".
+    '''
+    original = float(order.amount_orig)
+    remaining = float(order.amount)
+    status = str(order.status or '')
+    for prefix, name in BITFINEX_STATUSES:
+        if status.startswith(prefix):
+            break
+    else:
+        name = 'CANCELED'
+    symbol = str(order.symbol)
+    return {'symbol': symbol[1:] if symbol.startswith('t') else symbol,
+            'orderId': order.id,
+            'side': 'BUY' if original > 0 else 'SELL',
+            'price': str(order.price),
+            'origQty': str(abs(original)),
+            'executedQty': str(abs(original - remaining)),
+            'status': name}
+
+
+class OrderStore(object):
+    '''
+        In-memory order and balance book of one account
+
+        Attributes
+        ------------
+        path : str
+            SQLite file used by save and load, if sent
+    '''
+
+    def __init__(self, path=None):
+        self.path = path
+        self._orders = {}
+        self._bySymbol = {}
+        self._balances = {}
+        # time.monotonic of the last local change of each open order
+        self._updated = {}
+        self._lock = threading.RLock()
+
+    # --- Orders
+
+    def _index(self, key, order):
+        symbol = order.get('symbol')
+        if isOpen(order):
+            self._orders[key] = order
+            self._updated[key] = time.monotonic()
+            self._bySymbol.setdefault(symbol, set()).add(key)
+        else:
+            self._orders.pop(key, None)
+            self._updated.pop(key, None)
+            keys = self._bySymbol.get(symbol)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._bySymbol[symbol]
+
+    def trackNew(self, orderId, symbol, side, quantity, price=None):
+        '''
+            Optimistically add an order just accepted by the exchange,
+            before it is confirmed by a stream event or a reconcile.
+        '''
+        order = {'symbol': str(symbol),
+                 'orderId': orderId,
+                 'side': str(side).upper(),
+                 'price': str(price or 0.0),
+                 'origQty': str(quantity),
+                 'executedQty': '0',
+                 'status': PENDING_NEW}
+        with self._lock:
+            self._index(str(orderId), order)
+        return order
+
+    def applyOrder(self, order):
+        '''
+            Apply an order update (REST row or stream event).
+            Partial updates, like Bitmex "update" rows, are merged into the known order.
+            Orders no longer open are removed.
+        '''
+        key = orderKey(order)
+        if key is None:
+            return
+        with self._lock:
+            known = self._orders.get(key)
+            if known is not None:
+                merged = dict(known)
+                merged.update(order)
+                order = merged
+            elif orderStatus(order) is None:
+                return
+            self._index(key, order)
+
+    def removeOrder(self, orderId):
+        with self._lock:
+            order = self._orders.get(str(orderId))
+            if order is not None:
+                closed = dict(order, status='CANCELED')
+                closed.pop('ordStatus', None)
+                self._index(str(orderId), closed)
+
+    def order(self, orderId):
+        '''
+            :returns: dictionary with the open order or None
+        '''
+        with self._lock:
+            return self._orders.get(str(orderId))
+
+    def openOrders(self, symbol=None):
+        '''
+            :returns: list of dictionaries
+        '''
+        with self._lock:
+            if symbol is None:
+                return list(self._orders.values())
+            return [self._orders[key] for key in self._bySymbol.get(str(symbol), ())]
+
+    # --- Balances
+
+    def applyBalance(self, balance):
+        asset = balanceKey(balance)
+        if asset is None:
+            return
+        with self._lock:
+            known = self._balances.get(asset)
+            self._balances[asset] = dict(known, **balance) if known else dict(balance)
+
+    def balances(self, asset=None):
+        '''
+            :returns: list of dictionaries
+        '''
+        with self._lock:
+            if asset is None:
+                return list(self._balances.values())
+            balance = self._balances.get(str(asset))
+            return [balance] if balance is not None else []
+
+    # --- Reconciliation
+
+    def reconcile(self, orders, balances=None, symbol=None, since=None):
+        '''
+            Apply the REST state of the account, changing only what differs.
+            Orders tracked or updated after the REST request was sent are newer
+            than the snapshot and are kept as they are.
+
+            :param orders: required - open orders returned by fetchOpenOrders
+            :type orders: list
+            :param balances: - balances returned by fetchBalance
+            :type balances: list
+            :param symbol: - Default None. Orders were fetched for this symbol only.
+            :type symbol: str
+            :param since: - Default None (every order is reconciled). time.monotonic
+                when the open orders were requested.
+            :type since: float
+
+            :returns: dictionary with the order keys added, changed and removed and the balances changed
+        '''
+        diff = {'added': [], 'changed': [], 'removed': [], 'balances': []}
+        with self._lock:
+            local = (set(self._orders) if symbol is None
+                     else set(self._bySymbol.get(str(symbol), ())))
+            if since is not None:
+                local = set(key for key in local if self._updated.get(key, 0.0) < since)
+            remote = {}
+            for order in orders:
+                key = orderKey(order)
+                if key is not None:
+                    remote[key] = order
+
+            for key, order in remote.items():
+                known = self._orders.get(key)
+                if known is None:
+                    diff['added'].append(key)
+                    self._index(key, order)
+                elif since is not None and key not in local:
+                    continue
+                elif known != order:
+                    diff['changed'].append(key)
+                    self._index(key, order)
+
+            for key in local - set(remote):
+                diff['removed'].append(key)
+                self.removeOrder(key)
+
+            for balance in balances or ():
+                asset = balanceKey(balance)
+                if self._balances.get(asset) != balance:
+                    diff['balances'].append(asset)
+                    self._balances[asset] = dict(balance)
+        return diff
+
+    # --- Persistence
+
+    def save(self, path=None):
+        '''
+            Write a snapshot of the store to a SQLite file.
+        '''
+        path = path or self.path
+        with self._lock:
+            orders = [(key, dumps(order)) for key, order in self._orders.items()]
+            balances = [(asset, dumps(balance)) for asset, balance in self._balances.items()]
+
+        connection = sqlite3.connect(path)
+        try:
+            with connection:
+                connection.execute('CREATE TABLE IF NOT EXISTS orders (id TEXT PRIMARY KEY, data TEXT)')
+                connection.execute('CREATE TABLE IF NOT EXISTS balances (asset TEXT PRIMARY KEY, data TEXT)')
+                connection.execute('DELETE FROM orders')
+                connection.execute('DELETE FROM balances')
+                connection.executemany('INSERT INTO orders VALUES (?, ?)', orders)
+                connection.executemany('INSERT INTO balances VALUES (?, ?)', balances)
+        finally:
+            connection.close()
+
+    @classmethod
+    def load(cls, path):
+        '''
+            Restore a store from a SQLite snapshot written by save.
+            A missing or empty file gives an empty store.
+
+            :returns: OrderStore
+        '''
+        store = cls(path)
+        connection = sqlite3.connect(path)
+        try:
+            tables = set(row[0] for row in connection.execute(
+                "SELECT name FROM sqlite_master WHERE type='table'"))
+            if 'orders' in tables:
+                for key, data in connection.execute('SELECT id, data FROM orders'):
+                    store._index(key, loads(data))
+            if 'balances' in tables:
+                for asset, data in connection.execute('SELECT asset, data FROM balances'):
+                    store._balances[asset] = loads(data)
+        finally:
+            connection.close()
+        return store
+
+
+class StatefulMiddleware(object):
+    '''
+        Middleware proxy keeping an OrderStore up to date
+
+        createLimitOrder, createMarketOrder, createMarginOrder, amendOrder and
+        cancelOrder go to the exchange and update the store; fetchOpenOrders and
+        fetchBalance are answered from the store, seeded with the balances of the
+        middleware when it is created. Market orders do not rest in the book, so
+        they are not tracked as open; their fills come with the stream or the
+        next reconcile. Every other call goes straight to the middleware.
+
+        Attributes
+        ------------
+        middleware : object
+            BinanceMiddleware, BitmexMiddleware or PaperMiddleware
+
+        store : OrderStore
+            Default a new empty store
+
+        riskEngine : RiskEngine
+            Open orders kept in sync with the store. Default the risk engine
+            of the middleware, if any.
+    '''
+
+    def __init__(self, middleware, store=None, riskEngine=None):
+        self._middleware = middleware
+        self.store = store if store is not None else OrderStore()
+        self.riskEngine = (riskEngine if riskEngine is not None
+                           else getattr(middleware, '_riskEngine', None))
+        self._reconciler = None
+        self._stop = threading.Event()
+        if not self.store.balances():
+            try:
+                for balance in self._fetchBalances():
+                    self.store.applyBalance(balance)
+            except Exception as error:
+                print(f'Error fetching the balances: {error}')
+
+    def __getattr__(self, name):
+        return getattr(self._middleware, name)
+
+    def _trackNew(self, result, symbol, side, quantity, price):
+        if isinstance(result, dict):
+            # Order response, with its fill status
+            self.applyOrder(result)
+        elif price:
+            self.store.trackNew(result, symbol, side, quantity, price)
+
+    def createLimitOrder(self, symbol, side, quantity, price=None):
+        orderId = self._middleware.createLimitOrder(symbol, side, quantity, price)
+        self._trackNew(orderId, symbol, side, quantity, price)
+        return orderId
+
+    def createMarketOrder(self, symbol, side, quantity):
+        orderId = self._middleware.createMarketOrder(symbol, side, quantity)
+        self._trackNew(orderId, symbol, side, quantity, None)
+        return orderId
+
+    def createMarginOrder(self, symbol, side, quantity, price=None):
+        orderId = self._middleware.createMarginOrder(symbol, side, quantity, price)
+        self._trackNew(orderId, symbol, side, quantity, price)
+        return orderId
+
+    def amendOrder(self, orderId, *args, **kwargs):
+        # Symbol and side (after orderId, price and quantity) are read from the store
+        known = self.store.order(orderId)
+        if known is not None:
+            for position, key in ((2, 'symbol'), (3, 'side')):
+                if len(args) <= position and kwargs.get(key) is None:
+                    kwargs[key] = known.get(key)
+        result = self._middleware.amendOrder(orderId, *args, **kwargs)
+        if isinstance(result, dict):
+            # Binance cancel-replace gives the order a new id
+            if orderKey(result) != str(orderId):
+                self.store.removeOrder(orderId)
+                if self.riskEngine is not None and result.get('symbol') is not None:
+                    self.riskEngine.onOrderClosed(result['symbol'], orderId)
+            self.applyOrder(result)
+        return result
+
+    def cancelOrder(self, *args, **kwargs):
+        result = self._middleware.cancelOrder(*args, **kwargs)
+        if isinstance(result, dict):
+            key = orderKey(result)
+            if key is not None:
+                self.store.removeOrder(key)
+                if self.riskEngine is not None and result.get('symbol') is not None:
+                    self.riskEngine.onOrderClosed(result['symbol'], key)
+        return result
+
+    def applyOrder(self, order):
+        '''
+            Apply an order update of the execution stream, e.g.
+            binanceExecutionReport(event) or a Bitmex order row.
+        '''
+        self.store.applyOrder(order)
+        if self.riskEngine is not None:
+            self.riskEngine.applyOrder(order)
+
+    def fetchOpenOrders(self, *args):
+        return self.store.openOrders(*args)
+
+    def fetchBalance(self, *args):
+        return self.store.balances(*args)
+
+    def _fetchBalances(self):
+        balances = self._middleware.fetchBalance()
+        if isinstance(balances, dict):
+            balances = [balances]
+        return balances
+
+    def reconcile(self, symbol=None):
+        '''
+            Fetch the open orders and balances from REST and apply the differences.
+
+            :returns: dictionary with the order keys added, changed and removed and the balances changed
+        '''
+        since = time.monotonic()
+        if symbol is None:
+            orders = self._middleware.fetchOpenOrders()
+        else:
+            orders = self._middleware.fetchOpenOrders(symbol)
+        balances = self._fetchBalances()
+        diff = self.store.reconcile(orders, balances, symbol, since)
+        if self.riskEngine is not None:
+            if symbol is None:
+                self.riskEngine.syncOpenOrders(self.store.openOrders())
+            else:
+                self.riskEngine.setOpenOrders(symbol, self.store.openOrders(symbol))
+        return diff
+
+    def startReconciling(self, interval=60.0, saveSnapshot=True):
+        '''
+            Reconcile (and save a snapshot, if the store has a path) every interval seconds
+            in a background thread.
+        '''
+        def run():
+            while not self._stop.wait(interval):
+                try:
+                    self.reconcile()
+                    if saveSnapshot and self.store.path:
+                        self.store.save()
+                except Exception as error:
+                    print(f'Error reconciling orders: {error}')
+
+        self._stop.clear()
+        self._reconciler = threading.Thread(target=run, daemon=True)
+        self._reconciler.start()
+
+    def stopReconciling(self):
+        self._stop.set()
+        if self._reconciler is not None:
+            self._reconciler.join()
+            self._reconciler = None
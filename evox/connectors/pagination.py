@@ -0,0 +1,184 @@
+# coding=utf-8
+
+'''
+    Cursor pagination helpers
+
+    Turn a page fetcher into a generator (or async generator) of pages.
+    Only the current page and, with prefetch, the next one are kept in
+    memory, so long histories can be streamed.
+
+    The cursors of the exchange histories are built here too: id cursors
+    (Binance), time windows skipped while empty (Binance startTime), start
+    offsets (Bitmex) and inclusive end timestamps (Bitfinex).
+'''
+
+import asyncio
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def paginate(fetchPage, cursor, nextCursor, prefetch=False):
+    '''
+        Yield pages lazily.
+
+        :param fetchPage: required - function(cursor) returning a list
+        :type fetchPage: callable
+        :param cursor: required - cursor of the first page
+        :type cursor: object
+        :param nextCursor: required - function(cursor, page) returning the next cursor or None
+        :type nextCursor: callable
+        :param prefetch: - Default False. Fetch the next page while the current one is consumed.
+        :type prefetch: boolean
+
+        :returns: generator of lists
+    '''
+    if not prefetch:
+        while cursor is not None:
+            page = fetchPage(cursor)
+            if not page:
+                return
+            yield page
+            cursor = nextCursor(cursor, page)
+        return
+
+    # The prefetch thread runs in the caller context (e.g. the account credentials)
+    def submit(executor, cursor):
+        return executor.submit(contextvars.copy_context().run, fetchPage, cursor)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = submit(executor, cursor) if cursor is not None else None
+        while future is not None:
+            page = future.result()
+            if not page:
+                return
+            cursor = nextCursor(cursor, page)
+            future = submit(executor, cursor) if cursor is not None else None
+            yield page
+
+
+async def apaginate(fetchPage, cursor, nextCursor, prefetch=False):
+    '''
+        Async version of paginate.
+        fetchPage may be a coroutine function or a blocking function,
+        which then runs in the default executor.
+
+        :returns: async generator of lists
+    '''
+    loop = asyncio.get_event_loop()
+
+    def fetch(cursor):
+        if asyncio.iscoroutinefunction(fetchPage):
+            return asyncio.ensure_future(fetchPage(cursor))
+        return loop.run_in_executor(None, contextvars.copy_context().run, fetchPage, cursor)
+
+    pending = fetch(cursor) if cursor is not None else None
+    try:
+        while pending is not None:
+            page = await pending
+            pending = None
+            if not page:
+                return
+            cursor = nextCursor(cursor, page)
+            if cursor is not None and prefetch:
+                pending = fetch(cursor)
+            yield page
+            if cursor is not None and pending is None:
+                pending = fetch(cursor)
+    finally:
+        if pending is not None:
+            pending.cancel()
+
+
+def windowPage(fetchPage, cursor, window, clock=time.time):
+    '''
+        Fetch the page of a startTime cursor covering a time window only
+        (e.g. Binance 24 hours). An empty window does not mean that the
+        history is over: the next windows are requested up to now.
+
+        :param window: required - milliseconds of a window
+        :type window: int
+
+        :returns: list (empty if every window up to now is empty)
+    '''
+    page = fetchPage(cursor)
+    while not page and 'startTime' in cursor:
+        startTime = cursor['startTime'] + window
+        if startTime > clock() * 1000:
+            break
+        cursor = {'startTime': startTime}
+        page = fetchPage(cursor)
+    return page
+
+
+def idCursor(idKey, cursorKey, limit):
+    '''
+        nextCursor of pages sorted by id, oldest first, e.g. {"fromId": last id + 1}.
+        A startTime page only covers a window, so a short page does not end the history.
+    '''
+    def nextCursor(cursor, page):
+        if len(page) < limit and 'startTime' not in cursor:
+            return None
+        return {cursorKey: int(page[-1][idKey]) + 1}
+    return nextCursor
+
+
+def offsetCursor(count):
+    '''
+        nextCursor of pages requested with a start offset.
+    '''
+    def nextCursor(start, page):
+        if len(page) < count:
+            return None
+        return start + count
+    return nextCursor
+
+
+class EndCursor(object):
+    '''
+        Cursor of histories fetched newest first with an inclusive end
+        timestamp (Bitfinex orders and trades).
+
+        The next page ends at the oldest timestamp of the page, not one
+        millisecond before it, so the rows sharing that millisecond cut off
+        by the page limit are fetched too. The rows of that millisecond
+        already returned are dropped by id. Pass the fetched rows through
+        fresh() and the instance as nextCursor.
+
+        A full page within a single millisecond cannot be paged further
+        (the exchange has no offset): the next page ends before it.
+
+        Attributes
+        ------------
+        limit : int
+            Rows of a full page
+
+        timeOf : callable
+            Timestamp of a row
+
+        idOf : callable
+            Id of a row
+    '''
+
+    def __init__(self, limit, timeOf, idOf):
+        self.limit = limit
+        self.timeOf = timeOf
+        self.idOf = idOf
+        self._seen = set()
+        self._next = None
+
+    def fresh(self, rows):
+        '''
+            :returns: the rows not returned by the previous pages
+        '''
+        fresh = [row for row in rows if self.idOf(row) not in self._seen]
+        self._next = None
+        if len(rows) >= self.limit:
+            times = [self.timeOf(row) for row in rows]
+            oldest = min(times)
+            self._next = oldest if max(times) > oldest else oldest - 1
+            self._seen = {self.idOf(row) for row in rows if self.timeOf(row) == oldest}
+        return fresh
+
+    def __call__(self, end, page):
+        return self._next
@@ -0,0 +1,479 @@
+# coding=utf-8
+
+'''
+    Paper trading
+
+    In-process simulated exchange exposing the middleware order surface
+    (createLimitOrder, createMarketOrder, cancelOrder, fetchOpenOrders,
+    fetchBalance). Orders of every simulated account are matched with
+    price-time priority against each other and against the live or
+    replayed market data fed with onQuote/onTrade.
+
+    Responses follow the Binance structures, so strategies written against
+    BinanceMiddleware run unchanged; cancelOrder takes the order id first like
+    the Bitmex and Bitfinex middlewares.
+'''
+
+import heapq
+import itertools
+import threading
+import time
+
+from .errors import EvoxError, InsufficientFunds, InvalidOrder, exchangeErrors
+
+
+STATUS_NEW = 'NEW'
+STATUS_PARTIALLY_FILLED = 'PARTIALLY_FILLED'
+STATUS_FILLED = 'FILLED'
+STATUS_CANCELED = 'CANCELED'
+STATUS_EXPIRED = 'EXPIRED'
+
+OPEN_STATUSES = (STATUS_NEW, STATUS_PARTIALLY_FILLED)
+
+# Quantities below are float dust
+EPSILON = 1e-12
+
+
+class PaperException(EvoxError):
+    pass
+
+
+# Rejections are raised with the kinds of the exchanges' errors
+PAPER_ERRORS = exchangeErrors(PaperException)
+
+
+class PaperOrder(object):
+    __slots__ = ('orderId', 'account', 'symbol', 'side', 'type', 'price',
+                 'quantity', 'filled', 'locked', 'status', 'time', 'sequence')
+
+    def __init__(self, orderId, account, symbol, side, type, price, quantity, sequence):
+        self.orderId = orderId
+        self.account = account
+        self.symbol = symbol
+        self.side = side
+        self.type = type
+        self.price = price
+        self.quantity = quantity
+        self.filled = 0.0
+        self.locked = 0.0
+        self.status = STATUS_NEW
+        self.time = int(time.time() * 1000)
+        self.sequence = sequence
+
+    @property
+    def remaining(self):
+        return self.quantity - self.filled
+
+    def toDict(self):
+        return {'symbol': self.symbol,
+                'orderId': self.orderId,
+                'price': str(self.price or 0.0),
+                'origQty': str(self.quantity),
+                'executedQty': str(self.filled),
+                'status': self.status,
+                'timeInForce': 'GTC',
+                'type': self.type,
+                'side': self.side,
+                'time': self.time}
+
+
+class PaperBook(object):
+    '''
+        Resting orders of a symbol.
+
+        Each side is a heap ordered by (price, sequence), so the best order
+        in price-time priority is always on top and inserting costs O(log n).
+        Cancelled orders are removed lazily when they reach the top.
+    '''
+
+    def __init__(self):
+        self.bids = []
+        self.asks = []
+
+    def add(self, order):
+        if order.side == 'BUY':
+            heapq.heappush(self.bids, (-order.price, order.sequence, order))
+        else:
+            heapq.heappush(self.asks, (order.price, order.sequence, order))
+
+    @staticmethod
+    def top(heap):
+        while heap:
+            order = heap[0][2]
+            if order.status in OPEN_STATUSES:
+                return order
+            heapq.heappop(heap)
+        return None
+
+
+class PaperAccount(object):
+
+    def __init__(self, accountId, balances):
+        self.accountId = accountId
+        self.free = {asset: float(amount) for asset, amount in balances.items()}
+        self.locked = {asset: 0.0 for asset in balances}
+        self.orders = {}
+        self.trades = []
+
+    def credit(self, asset, amount):
+        self.free[asset] = self.free.get(asset, 0.0) + amount
+        self.locked.setdefault(asset, 0.0)
+
+    def lock(self, asset, amount):
+        if self.free.get(asset, 0.0) + EPSILON < amount:
+            raise PAPER_ERRORS[InsufficientFunds](f'Account has insufficient balance ({asset}).')
+        self.free[asset] -= amount
+        self.locked[asset] = self.locked.get(asset, 0.0) + amount
+
+    def unlock(self, asset, amount):
+        # Sums of different orders leave dust once every lock is released
+        locked = self.locked[asset] - amount
+        self.locked[asset] = 0.0 if abs(locked) < EPSILON * max(1.0, amount) else locked
+
+
+class PaperExchange(object):
+    '''
+        Simulated exchange shared by every paper account
+
+        Attributes
+        ------------
+        fee : float
+            Fee rate charged on the received asset of every fill
+    '''
+
+    def __init__(self, fee=0.0):
+        self.fee = float(fee)
+        self._markets = {}
+        self._books = {}
+        self._quotes = {}
+        self._accounts = {}
+        self._orders = {}
+        self._sequence = itertools.count(1)
+        self._lock = threading.RLock()
+
+    def addMarket(self, symbol, base, quote):
+        '''
+            :param symbol: required - e.g. BTCUSDT
+            :type symbol: str
+            :param base: required - e.g. BTC
+            :type base: str
+            :param quote: required - e.g. USDT
+            :type quote: str
+        '''
+        self._markets[symbol] = (base, quote)
+        self._books[symbol] = PaperBook()
+
+    def createAccount(self, balances):
+        '''
+            :param balances: required - e.g. {'USDT': 10000}
+            :type balances: dict
+
+            :returns: PaperMiddleware of the new account
+        '''
+        with self._lock:
+            accountId = len(self._accounts) + 1
+            self._accounts[accountId] = PaperAccount(accountId, balances)
+        return PaperMiddleware(self, accountId)
+
+    def _market(self, symbol):
+        try:
+            return self._markets[symbol]
+        except KeyError:
+            raise PAPER_ERRORS[InvalidOrder](f'Invalid symbol ({symbol}).')
+
+    # --- Market data
+
+    def onQuote(self, symbol, bid=None, ask=None, bidSize=None, askSize=None):
+        '''
+            Update the market top of book of a symbol.
+            Resting orders crossed by the new quote are filled at their price.
+        '''
+        with self._lock:
+            self._quotes[symbol] = (bid, ask, bidSize, askSize)
+            book = self._books[symbol]
+            if ask is not None:
+                self._fillResting(book.bids, lambda order: order.price >= ask, askSize)
+            if bid is not None:
+                self._fillResting(book.asks, lambda order: order.price <= bid, bidSize)
+
+    def onTrade(self, symbol, price, quantity):
+        '''
+            Apply a market trade of a symbol.
+            Resting orders the trade went through are filled at their price.
+        '''
+        with self._lock:
+            book = self._books[symbol]
+            self._fillResting(book.bids, lambda order: order.price > price, quantity)
+            self._fillResting(book.asks, lambda order: order.price < price, quantity)
+
+    def _fillResting(self, heap, crosses, available):
+        available = float('inf') if available is None else float(available)
+        while available > 0:
+            order = PaperBook.top(heap)
+            if order is None or not crosses(order):
+                return
+            quantity = min(order.remaining, available)
+            self._fill(order, order.price, quantity)
+            available -= quantity
+
+    # --- Orders
+
+    def submit(self, accountId, symbol, side, quantity, price=None):
+        with self._lock:
+            base, quote = self._market(symbol)
+            account = self._accounts[accountId]
+            quantity = float(quantity)
+            if quantity <= 0:
+                raise PAPER_ERRORS[InvalidOrder]('Invalid order quantity.')
+
+            orderType = 'LIMIT' if price else 'MARKET'
+            sequence = next(self._sequence)
+            order = PaperOrder(sequence, account, symbol, side,
+                               orderType, float(price) if price else None,
+                               quantity, sequence)
+
+            if orderType == 'LIMIT':
+                if side == 'BUY':
+                    order.locked = order.price * quantity
+                    account.lock(quote, order.locked)
+                else:
+                    order.locked = quantity
+                    account.lock(base, quantity)
+
+            account.orders[order.orderId] = order
+            self._orders[order.orderId] = order
+            self._match(order)
+
+            if order.status in OPEN_STATUSES:
+                if orderType == 'LIMIT':
+                    self._books[symbol].add(order)
+                else:
+                    order.status = STATUS_EXPIRED
+                    account.orders.pop(order.orderId, None)
+            return order
+
+    def _match(self, order):
+        book = self._books[order.symbol]
+        if order.side == 'BUY':
+            heap = book.asks
+            crosses = lambda price: order.price is None or order.price >= price
+        else:
+            heap = book.bids
+            crosses = lambda price: order.price is None or order.price <= price
+
+        while order.remaining > 0:
+            resting = PaperBook.top(heap)
+            if resting is None or not crosses(resting.price):
+                break
+            quantity = min(order.remaining, resting.remaining)
+            quantity = self._affordable(order, resting.price, quantity)
+            if quantity <= 0:
+                return
+            self._fill(resting, resting.price, quantity)
+            self._fill(order, resting.price, quantity)
+
+        if order.remaining <= 0:
+            return
+        bid, ask, bidSize, askSize = self._quotes.get(order.symbol, (None, None, None, None))
+        price, size = (ask, askSize) if order.side == 'BUY' else (bid, bidSize)
+        if price is None or not crosses(price):
+            return
+        quantity = order.remaining if size is None else min(order.remaining, float(size))
+        quantity = self._affordable(order, price, quantity)
+        if quantity > 0:
+            self._fill(order, price, quantity)
+
+    def _affordable(self, order, price, quantity):
+        # Market buys have nothing locked, the fill is limited by the free quote
+        if order.type == 'MARKET' and order.side == 'BUY':
+            _, quote = self._markets[order.symbol]
+            return min(quantity, order.account.free.get(quote, 0.0) / price)
+        if order.type == 'MARKET':
+            base, _ = self._markets[order.symbol]
+            return min(quantity, order.account.free.get(base, 0.0))
+        return quantity
+
+    def _fill(self, order, price, quantity):
+        base, quote = self._markets[order.symbol]
+        account = order.account
+        notional = price * quantity
+
+        order.filled += quantity
+        order.status = STATUS_FILLED if order.remaining <= EPSILON else STATUS_PARTIALLY_FILLED
+
+        if order.side == 'BUY':
+            if order.type == 'LIMIT':
+                # The last fill releases exactly what is left of the order lock
+                release = order.locked if order.status == STATUS_FILLED else order.price * quantity
+                order.locked -= release
+                account.unlock(quote, release)
+                account.free[quote] += release - notional
+            else:
+                account.free[quote] -= notional
+            account.credit(base, quantity * (1.0 - self.fee))
+        else:
+            if order.type == 'LIMIT':
+                release = order.locked if order.status == STATUS_FILLED else quantity
+                order.locked -= release
+                account.unlock(base, release)
+            else:
+                account.free[base] -= quantity
+            account.credit(quote, notional * (1.0 - self.fee))
+
+        if order.status == STATUS_FILLED:
+            account.orders.pop(order.orderId, None)
+
+        account.trades.append({'symbol': order.symbol,
+                               'orderId': order.orderId,
+                               'price': str(price),
+                               'qty': str(quantity),
+                               'quoteQty': str(notional),
+                               'commission': str((quantity if order.side == 'BUY' else notional) * self.fee),
+                               'commissionAsset': base if order.side == 'BUY' else quote,
+                               'time': int(time.time() * 1000),
+                               'isBuyer': order.side == 'BUY'})
+
+    def cancel(self, accountId, orderId):
+        with self._lock:
+            account = self._accounts[accountId]
+            order = account.orders.pop(orderId, None)
+            if order is None:
+                raise PAPER_ERRORS[InvalidOrder](f'Unknown order ({orderId}).')
+
+            base, quote = self._markets[order.symbol]
+            asset = quote if order.side == 'BUY' else base
+            account.unlock(asset, order.locked)
+            account.free[asset] += order.locked
+            order.locked = 0.0
+            order.status = STATUS_CANCELED
+            return order
+
+
+class PaperMiddleware(object):
+    '''
+        Paper trading account with the middleware order surface
+
+        Attributes
+        ------------
+        exchange : PaperExchange
+            Simulated exchange holding the account
+
+        accountId : int
+            Account identifier in the exchange
+    '''
+
+    def __init__(self, exchange, accountId):
+        self._exchange = exchange
+        self._accountId = accountId
+
+    @property
+    def exchange(self):
+        return self._exchange
+
+    @property
+    def _account(self):
+        return self._exchange._accounts[self._accountId]
+
+    @staticmethod
+    def _side(side):
+        try:
+            return 'BUY' if side.lower() == 'buy' else 'SELL'
+        except AttributeError:
+            raise PAPER_ERRORS[InvalidOrder]('Error setting order side (buy or sell).')
+
+    def createLimitOrder(self, symbol, side, quantity, price=None):
+        '''
+            Post a new limit order. If price was not defined post a market order.
+
+            :returns: orderId, type integer
+        '''
+        order = self._exchange.submit(self._accountId, str(symbol),
+                                      self._side(side), quantity, price)
+        return order.orderId
+
+    def createMarketOrder(self, symbol, side, quantity):
+        '''
+            Post a new market order. The part not filled expires.
+
+            :returns: orderId, type integer
+        '''
+        order = self._exchange.submit(self._accountId, str(symbol),
+                                      self._side(side), quantity)
+        return order.orderId
+
+    def cancelOrder(self, orderId, symbol=None):
+        '''
+            Cancel an open order.
+
+            :param orderId: required
+            :type orderId: int
+            :param symbol: - not required, orders ids are unique
+            :type symbol: str
+
+            :returns: dictionary with the cancelled order
+        '''
+        with self._exchange._lock:
+            return self._exchange.cancel(self._accountId, orderId).toDict()
+
+    def fetchOrder(self, symbol, orderId):
+        with self._exchange._lock:
+            order = self._exchange._orders.get(orderId)
+            if order is None or order.account is not self._account:
+                raise PAPER_ERRORS[InvalidOrder](f'Unknown order ({orderId}).')
+            return order.toDict()
+
+    def fetchOpenOrders(self, *args):
+        '''
+            Fetch all open orders on a symbol, or on every symbol if not sent.
+
+            :returns: list of dictionaries
+        '''
+        # The exchange lock keeps the fills of other threads out of the iteration
+        with self._exchange._lock:
+            orders = self._account.orders.values()
+            if args:
+                symbol = str(args[0])
+                return [order.toDict() for order in orders if order.symbol == symbol]
+            return [order.toDict() for order in orders]
+
+    def fetchBalance(self, *args):
+        '''
+            Get current asset balance if have passed parameter or,
+            if not, return each assets balances.
+
+            :returns: list of dictionaries
+        '''
+        with self._exchange._lock:
+            account = self._account
+            assets = [str(args[0])] if args else list(account.free)
+            return [{'asset': asset,
+                     'free': str(account.free.get(asset, 0.0)),
+                     'locked': str(account.locked.get(asset, 0.0))}
+                    for asset in assets]
+
+    def fetchMyTrades(self, symbol=None):
+        '''
+            Fills of the account, in a single page.
+
+            :returns: generator of lists of dictionaries
+        '''
+        with self._exchange._lock:
+            trades = self._account.trades
+            if symbol is not None:
+                trades = [trade for trade in trades if trade['symbol'] == symbol]
+            trades = list(trades)
+        yield trades
+
+
+if __name__ == '__main__':
+    exchange = PaperExchange(fee=0.001)
+    exchange.addMarket('BTCUSDT', 'BTC', 'USDT')
+    maker = exchange.createAccount({'BTC': 1})
+    taker = exchange.createAccount({'USDT': 100000})
+
+    exchange.onQuote('BTCUSDT', bid=9474.0, ask=9476.0)
+    maker.createLimitOrder('BTCUSDT', 'sell', 0.5, 9475.0)
+    taker.createMarketOrder('BTCUSDT', 'buy', 0.8)
+    print(maker.fetchBalance())
+    print(taker.fetchBalance())
+    print(list(taker.fetchMyTrades()))
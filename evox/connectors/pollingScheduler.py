@@ -0,0 +1,387 @@
+# coding=utf-8
+
+'''
+    Adaptive polling of REST-only data
+
+    Funding rates, balances and less liquid symbols stay on REST. Instead of
+    fixed timers per caller, subscriptions are kept in a heap by due time and
+    packed into a request weight budget per exchange (token bucket): when the
+    budget is short, the most important due subscriptions go first and the
+    rest wait for tokens.
+
+    Intervals adapt to the data: a subscription polls at its target
+    freshness while its result changes and backs off geometrically (up to
+    maxInterval) while it does not, so quiet data stops spending weight that
+    fast moving data can use. Responses carrying fields that change on every
+    poll (Binance closeTime and count) or vendor objects without equality
+    (bfxapi models) are compared through a compare function, e.g. fields().
+'''
+
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .dispatch import call
+from .errors import EvoxError, RateLimited, isRetryable
+
+
+# Request weight per minute of each exchange (public REST limits)
+EXCHANGE_BUDGETS = {
+    'binance': 1200,
+    'bitmex': 120,
+    'bitfinex': 90,
+}
+
+
+class PollingException(EvoxError):
+    pass
+
+
+class WeightBudget(object):
+    '''
+        Token bucket of request weight
+    '''
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, weightPerMinute, now):
+        self.rate = weightPerMinute / 60.0
+        # At most a few seconds of weight at once, to spread the calls
+        self.capacity = max(1.0, self.rate * 5.0)
+        self.tokens = self.capacity
+        self.updated = now
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, weight, now):
+        '''
+            :returns: 0 if the weight was taken, otherwise seconds until it is available
+        '''
+        self.refill(now)
+        # Calls heavier than the bucket go into debt instead of waiting forever
+        if self.tokens >= min(weight, self.capacity):
+            self.tokens -= weight
+            return 0.0
+        return (min(weight, self.capacity) - self.tokens) / self.rate
+
+    def pause(self, seconds, now):
+        # No weight left for some seconds, e.g. after a rate limit error
+        self.refill(now)
+        self.tokens = min(self.tokens, -seconds * self.rate)
+
+
+def fields(*names):
+    '''
+        Compare function of the named fields (dictionary keys or attributes), e.g.
+        subscribe('binance', 'fetchTicker', 'BTCUSDT', compare=fields('lastPrice', 'volume')).
+        Lists are compared item by item.
+    '''
+    def compare(value):
+        if isinstance(value, (list, tuple)):
+            return [compare(item) for item in value]
+        if isinstance(value, dict):
+            return tuple(value.get(name) for name in names)
+        return tuple(getattr(value, name, None) for name in names)
+    return compare
+
+
+class PollingSubscription(object):
+    '''
+        A middleware call polled by the scheduler
+
+        Attributes
+        ------------
+        freshness : float
+            Target age in seconds of the data while it is changing
+
+        maxInterval : float
+            Longest interval while the data does not change
+
+        priority : int
+            Higher goes first when the exchange budget is short
+
+        weight : float
+            Request weight of the call, e.g. 40 for a Binance ticker of every symbol
+
+        compare : callable
+            Value of a result compared between polls. Default the whole result.
+    '''
+    __slots__ = ('exchange', 'method', 'args', 'kwargs', 'callback', 'onError',
+                 'freshness', 'maxInterval', 'priority', 'weight', 'backoff', 'compare',
+                 'interval', 'due', 'result', 'compared', 'updated', 'polls', 'changes',
+                 'errors', 'active')
+
+    def __init__(self, exchange, method, args, kwargs, callback, onError,
+                 freshness, maxInterval, priority, weight, backoff, compare=None):
+        self.exchange = exchange
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.callback = callback
+        self.onError = onError
+        self.freshness = float(freshness)
+        self.maxInterval = float(maxInterval)
+        self.priority = priority
+        self.weight = float(weight)
+        self.backoff = backoff
+        self.compare = compare
+        self.interval = self.freshness
+        self.due = 0.0
+        self.result = None
+        self.compared = None
+        self.updated = None
+        self.polls = 0
+        self.changes = 0
+        self.errors = 0
+        self.active = True
+
+    def adapt(self, changed):
+        if changed:
+            self.interval = self.freshness
+        else:
+            self.interval = min(self.maxInterval, self.interval * self.backoff)
+
+
+class PollingScheduler(object):
+    '''
+        Scheduler of REST polls packed into the exchanges' rate limits
+
+        Attributes
+        ------------
+        middlewares : dict
+            Middleware by exchange, e.g. {'binance': BinanceMiddleware(...)}
+
+        budgets : dict
+            Request weight per minute by exchange. Default EXCHANGE_BUDGETS * share.
+
+        share : float
+            Fraction of the exchange limits used by polling, leaving the rest
+            to orders. Default 0.5.
+
+        maxWorkers : int
+            Polls in flight
+    '''
+
+    def __init__(self, middlewares, budgets=None, share=0.5, maxWorkers=8, clock=time.monotonic):
+        self._middlewares = dict(middlewares)
+        self._clock = clock
+        now = clock()
+        budgets = dict(budgets or {exchange: EXCHANGE_BUDGETS.get(exchange, 60) * share
+                                   for exchange in self._middlewares})
+        self._budgets = {exchange: WeightBudget(budgets[exchange], now)
+                         for exchange in self._middlewares}
+        self._subscriptions = {}
+        self._heap = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=maxWorkers)
+        self._thread = None
+        self._running = False
+
+    def subscribe(self, exchange, method, *args, freshness=5.0, maxInterval=None, priority=0,
+                  weight=1, callback=None, onError=None, backoff=1.5, compare=None, **kwargs):
+        '''
+            Poll a middleware method, e.g.
+            scheduler.subscribe('binance', 'fetchBalance', freshness=10, callback=onBalance)
+
+            :param exchange: required
+            :type exchange: str
+            :param method: required - middleware method name
+            :type method: str
+            :param freshness: - Default 5 seconds.
+            :type freshness: float
+            :param maxInterval: - Default 10 times freshness.
+            :type maxInterval: float
+            :param callback: - called with (subscription, result) when the result changes
+            :type callback: callable
+            :param onError: - called with (subscription, error)
+            :type onError: callable
+            :param compare: - value of the result compared between polls, e.g.
+                fields('lastPrice', 'volume'). Default the whole result.
+            :type compare: callable
+
+            :returns: PollingSubscription
+        '''
+        if exchange not in self._middlewares:
+            raise PollingException(f'No middleware for exchange ({exchange}).')
+        if not callable(getattr(self._middlewares[exchange], method, None)):
+            raise PollingException(f'Method not implemented ({exchange} {method}).')
+        subscription = PollingSubscription(exchange, method, args, kwargs, callback, onError,
+                                           freshness, maxInterval or freshness * 10.0,
+                                           priority, weight, backoff, compare)
+        self._subscriptions[subscription] = None
+        self._schedule(subscription, self._clock())
+        return subscription
+
+    def unsubscribe(self, subscription):
+        # Removed lazily from the heap
+        subscription.active = False
+        self._subscriptions.pop(subscription, None)
+
+    def _schedule(self, subscription, due):
+        with self._condition:
+            subscription.due = due
+            heapq.heappush(self._heap, (due, -subscription.priority,
+                                        next(self._sequence), subscription))
+            self._condition.notify()
+
+    def _dueSubscriptions(self, now):
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            _, _, _, subscription = heapq.heappop(self._heap)
+            if subscription.active:
+                due.append(subscription)
+        return due
+
+    def runPending(self):
+        '''
+            Dispatch the due subscriptions the budgets allow, highest priority first.
+
+            :returns: seconds until the next subscription is due (None if there is none)
+        '''
+        now = self._clock()
+        with self._condition:
+            due = self._dueSubscriptions(now)
+        due.sort(key=lambda subscription: (-subscription.priority, subscription.due))
+
+        for subscription in due:
+            with self._condition:
+                wait = self._budgets[subscription.exchange].take(subscription.weight, now)
+            if wait:
+                # Keeps its priority over the subscriptions due later
+                self._schedule(subscription, now + wait)
+                continue
+            self._executor.submit(self._poll, subscription)
+
+        with self._condition:
+            if not self._heap:
+                return None
+            return max(0.0, self._heap[0][0] - self._clock())
+
+    def _poll(self, subscription):
+        middleware = self._middlewares[subscription.exchange]
+        try:
+            result = call(getattr(middleware, subscription.method),
+                           *subscription.args, **subscription.kwargs)
+        except Exception as error:
+            subscription.errors += 1
+            if isinstance(error, RateLimited):
+                # Every subscription of the exchange waits, not only this one
+                with self._condition:
+                    self._budgets[subscription.exchange].pause(error.retryAfter or subscription.interval,
+                                                               self._clock())
+            if isRetryable(error):
+                subscription.interval = min(subscription.maxInterval, subscription.interval * 2.0)
+            else:
+                subscription.interval = subscription.maxInterval
+            if subscription.onError is not None:
+                subscription.onError(subscription, error)
+            else:
+                print(f'Error polling {subscription.exchange} {subscription.method}: {error}')
+        else:
+            subscription.polls += 1
+            compared = result if subscription.compare is None else subscription.compare(result)
+            changed = subscription.polls == 1 or compared != subscription.compared
+            subscription.adapt(changed)
+            if changed:
+                subscription.changes += 1
+                subscription.result = result
+                subscription.compared = compared
+                subscription.updated = time.time()
+                if subscription.callback is not None:
+                    try:
+                        subscription.callback(subscription, result)
+                    except Exception as error:
+                        print(f'Error in polling callback: {error}')
+        finally:
+            if subscription.active:
+                self._schedule(subscription, self._clock() + subscription.interval)
+
+    def start(self):
+        '''
+            Run the scheduler in a background thread.
+        '''
+        if self._thread is not None:
+            return
+
+        def run():
+            while self._running:
+                wait = self.runPending()
+                with self._condition:
+                    if not self._running:
+                        break
+                    # Woken up early by subscribe and by finished polls
+                    self._condition.wait(wait)
+
+        self._running = True
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._executor.shutdown(wait=True)
+
+    def stats(self):
+        '''
+            :returns: dictionary with the budgets and the subscriptions state
+        '''
+        now = self._clock()
+        budgets = {}
+        for exchange, budget in self._budgets.items():
+            budget.refill(now)
+            budgets[exchange] = {'weightPerMinute': budget.rate * 60.0, 'tokens': budget.tokens}
+        subscriptions = list(self._subscriptions)
+        return {'budgets': budgets,
+                'subscriptions': [{'exchange': subscription.exchange,
+                                   'method': subscription.method,
+                                   'args': subscription.args,
+                                   'interval': subscription.interval,
+                                   'polls': subscription.polls,
+                                   'changes': subscription.changes,
+                                   'errors': subscription.errors}
+                                  for subscription in subscriptions]}
+
+
+if __name__ == '__main__':
+    import random
+
+    class SimulatedMiddleware(object):
+        # Tickers changing at different rates and a balance that never changes
+
+        periods = {'BTCUSDT': 0.2, 'ETHUSDT': 1.0, 'XRPUSDT': 5.0}
+
+        def __init__(self):
+            self.start = time.monotonic()
+
+        def fetchTicker(self, symbol):
+            time.sleep(random.uniform(0.005, 0.02))
+            return {'symbol': symbol,
+                    'lastPrice': int((time.monotonic() - self.start) / self.periods[symbol])}
+
+        def fetchBalance(self):
+            time.sleep(random.uniform(0.005, 0.02))
+            return {'BTC': {'free': 1.0, 'locked': 0.0}}
+
+    duration, freshness = 10.0, 0.25
+    middleware = SimulatedMiddleware()
+    scheduler = PollingScheduler({'binance': middleware})
+    for symbol in middleware.periods:
+        scheduler.subscribe('binance', 'fetchTicker', symbol, freshness=freshness, priority=1)
+    scheduler.subscribe('binance', 'fetchBalance', freshness=freshness, weight=10)
+    scheduler.start()
+    time.sleep(duration)
+    scheduler.stop()
+
+    naive = duration / freshness
+    for item in scheduler.stats()['subscriptions']:
+        name = ' '.join([item['method']] + list(item['args']))
+        print(f"{name:<22} {item['polls']:4d} polls ({naive:.0f} on a fixed timer), "
+              f"{item['changes']:3d} changes seen, interval {item['interval']:.2f} s")
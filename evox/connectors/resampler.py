@@ -0,0 +1,362 @@
+# coding=utf-8
+
+'''
+    Multi-timeframe candles from a single base interval
+
+    The candles of a symbol are fetched once at a base interval (the finest,
+    1m, by default), cached and refreshed incrementally; any other timeframe
+    (15m, 4h, 1w, 3d, 1M, ...) is aggregated locally with NumPy reduceat.
+    This gives every exchange the same timeframes and a single REST call per
+    symbol, whatever the number of timeframes used.
+
+    Buckets are aligned to the epoch, weeks on Mondays (epoch + 4 days) and
+    months on calendar months, like the exchanges' own candles.
+'''
+
+import re
+import threading
+import time
+
+import numpy as np
+
+from .dispatch import call
+from .errors import EvoxError
+from .indicators import CLOSE, HIGH, LOW, OPEN, TIME, VOLUME, ohlcvArray
+
+
+MINUTE = 60 * 1000
+UNITS = {'m': MINUTE, 'h': 60 * MINUTE, 'd': 1440 * MINUTE, 'D': 1440 * MINUTE,
+         'w': 7 * 1440 * MINUTE, 'W': 7 * 1440 * MINUTE}
+WEEK_OFFSET = 4 * 1440 * MINUTE
+
+# Exchanges whose candle timestamp marks the end of the bucket
+BUCKET_END = frozenset(['bitmex'])
+
+# Candles of a single fetchOHLCV request
+MAX_CANDLES = {'binance': 1000, 'bitmex': 1000, 'bitfinex': 10000}
+
+# Additive columns of the Binance klines kept after VOLUME: quote asset volume,
+# number of trades, taker buy base asset volume and taker buy quote asset volume
+BINANCE_EXTRA = (7, 8, 9, 10)
+
+# Resamplers of deriveOHLCV are kept by middleware (_resamplers) and base interval
+_resamplersLock = threading.Lock()
+
+
+class ResamplerException(EvoxError):
+    pass
+
+
+def parseInterval(interval):
+    '''
+        :returns: tuple (count, unit) where unit is milliseconds or 'M' for calendar months
+    '''
+    match = re.match(r'^(\d+)([mhdDwWM])$', str(interval))
+    if match is None or int(match.group(1)) <= 0:
+        raise ResamplerException(f'Interval not implemented ({interval}).')
+    count, unit = int(match.group(1)), match.group(2)
+    if unit == 'M':
+        return count, 'M'
+    return count, UNITS[unit]
+
+
+def bucketStarts(times, interval):
+    '''
+        Open time (ms) of the bucket of every time (ms).
+    '''
+    count, unit = parseInterval(interval)
+    times = np.asarray(times, dtype=np.int64)
+    if unit == 'M':
+        months = times.astype('datetime64[ms]').astype('datetime64[M]').astype(np.int64)
+        months = months // count * count
+        return months.astype('datetime64[M]').astype('datetime64[ms]').astype(np.int64)
+    length = count * unit
+    offset = WEEK_OFFSET if length % UNITS['w'] == 0 else 0
+    return (times - offset) // length * length + offset
+
+
+def bucketEnds(starts, interval):
+    '''
+        Close time (ms) of the buckets opened at starts (ms).
+    '''
+    count, unit = parseInterval(interval)
+    starts = np.asarray(starts, dtype=np.int64)
+    if unit == 'M':
+        months = starts.astype('datetime64[ms]').astype('datetime64[M]') + count
+        return months.astype('datetime64[ms]').astype(np.int64)
+    return starts + count * unit
+
+
+def binanceArray(klines):
+    '''
+        OHLCV array of Binance klines followed by the BINANCE_EXTRA columns.
+    '''
+    array = ohlcvArray(klines, 'binance')
+    if not len(array):
+        return np.empty((0, 6 + len(BINANCE_EXTRA)))
+    # The last kline of a repeated time, like ohlcvArray
+    extra = {float(kline[0]): [float(kline[index]) for index in BINANCE_EXTRA] for kline in klines}
+    return np.column_stack((array, [extra[openTime] for openTime in array[:, TIME].tolist()]))
+
+
+def binanceCandles(array, interval):
+    '''
+        Rows of an OHLCV array with the BINANCE_EXTRA columns in the Binance kline structure.
+
+        :returns: list of lists, oldest first
+    '''
+    closes = bucketEnds(array[:, TIME], interval) - 1
+    return [[int(row[TIME]), f'{row[OPEN]:.8f}', f'{row[HIGH]:.8f}', f'{row[LOW]:.8f}',
+             f'{row[CLOSE]:.8f}', f'{row[VOLUME]:.8f}', close, f'{row[6]:.8f}', int(row[7]),
+             f'{row[8]:.8f}', f'{row[9]:.8f}', '0']
+            for close, row in zip(closes.tolist(), array.tolist())]
+
+
+def bitmexCandles(symbol, array, interval):
+    '''
+        Rows of an OHLCV array in the Bitmex bucketed trades structure,
+        stamped at the end of the bucket like the native candles.
+
+        :returns: list of dictionaries, oldest first
+    '''
+    ends = np.datetime_as_string(bucketEnds(array[:, TIME], interval).astype('datetime64[ms]'),
+                                 unit='ms')
+    return [{'timestamp': f'{end}Z',
+             'symbol': symbol,
+             'open': row[OPEN],
+             'high': row[HIGH],
+             'low': row[LOW],
+             'close': row[CLOSE],
+             'volume': row[VOLUME]}
+            for end, row in zip(ends.tolist(), array.tolist())]
+
+
+def resample(array, interval, dropPartial=True):
+    '''
+        Aggregate an OHLCV array (see indicators.ohlcvArray) into a longer interval.
+
+        :param array: required - rows (time, open, high, low, close, volume), oldest first.
+            Columns after VOLUME are summed like the volume.
+        :type array: numpy.ndarray
+        :param interval: required, e.g. 15m, 4h, 1d, 1w, 1M
+        :type interval: str
+        :param dropPartial: - Default True. Drop the first bucket if the base candles
+            do not cover it from its start.
+        :type dropPartial: boolean
+
+        :returns: numpy.ndarray with the same columns
+    '''
+    if not len(array):
+        return np.empty((0, array.shape[1] if array.ndim == 2 else 6))
+    keys = bucketStarts(array[:, TIME], interval)
+    starts = np.flatnonzero(np.append(True, keys[1:] != keys[:-1]))
+    ends = np.append(starts[1:], len(array)) - 1
+
+    result = np.empty((len(starts), array.shape[1]))
+    result[:, TIME] = keys[starts]
+    result[:, OPEN] = array[starts, OPEN]
+    result[:, HIGH] = np.maximum.reduceat(array[:, HIGH], starts)
+    result[:, LOW] = np.minimum.reduceat(array[:, LOW], starts)
+    result[:, CLOSE] = array[ends, CLOSE]
+    result[:, VOLUME:] = np.add.reduceat(array[:, VOLUME:], starts, axis=0)
+
+    if dropPartial and array[0, TIME] != keys[0]:
+        result = result[1:]
+    return result
+
+
+def _length(interval):
+    # Milliseconds of an interval; a month counts as 31 days
+    count, unit = parseInterval(interval)
+    return count * (31 * UNITS['d'] if unit == 'M' else unit)
+
+
+def deriveOHLCV(middleware, exchange, symbol, interval, limit, intervals, reverse=False):
+    '''
+        Candles of an interval the exchange does not serve, aggregated from
+        the longest native interval dividing it. The base candles are cached by
+        a Resampler kept per middleware and base interval, so only the candles
+        since the previous call are fetched again.
+        Raise ResamplerException if the base candles needed do not fit in one request.
+
+        :param intervals: required - native intervals of the exchange
+        :type intervals: list
+        :param reverse: - Default False. Newest first.
+        :type reverse: boolean
+
+        :returns: list of lists [open time, open, high, low, close, volume], or
+            like the native candles for Binance (see binanceCandles) and Bitmex (see bitmexCandles)
+    '''
+    count, unit = parseInterval(interval)
+    target = UNITS['d'] if unit == 'M' else count * unit
+    divisors = [native for native in intervals
+                if parseInterval(native)[1] != 'M' and target % _length(native) == 0]
+    if not divisors:
+        raise ResamplerException(f'Interval not implemented ({interval}).')
+    base = max(divisors, key=_length)
+    ratio = -(-_length(interval) // _length(base))
+    # One more bucket: the first one may be partial
+    history = (int(limit) + 1) * ratio
+    if history > MAX_CANDLES.get(exchange, 1000):
+        raise ResamplerException(f'{limit} {interval} candles need {history} {base} candles, '
+                                 f'more than a request returns ({MAX_CANDLES.get(exchange, 1000)}).')
+    with _resamplersLock:
+        resamplers = getattr(middleware, '_resamplers', None)
+        if resamplers is None:
+            resamplers = middleware._resamplers = {}
+        resampler = resamplers.get(base)
+        if resampler is None or resampler.history < history:
+            # Refreshed on every call, like the native candles
+            resampler = resamplers[base] = Resampler(middleware, exchange, base,
+                                                     history=history, ttl=0)
+
+    if exchange in BUCKET_END:
+        candles = bitmexCandles(str(symbol), resampler.fetchOHLCV(symbol, interval, limit, asArray=True),
+                                interval)
+    elif exchange == 'binance':
+        candles = binanceCandles(resampler.fetchOHLCV(symbol, interval, limit, asArray=True), interval)
+    else:
+        candles = resampler.fetchOHLCV(symbol, interval, limit)
+    return candles[::-1] if reverse else candles
+
+
+class Resampler(object):
+    '''
+        Candles of any timeframe derived from one cached base interval per symbol
+
+        Attributes
+        ------------
+        middleware : object
+            BinanceMiddleware, BitmexMiddleware or BitfinexMiddleware
+
+        exchange : str
+            binance, bitmex or bitfinex
+
+        baseInterval : str
+            Interval fetched from the exchange. Default 1m; e.g. 1h to derive long timeframes.
+
+        history : int
+            Base candles kept per symbol and fetched on the first call
+
+        ttl : float
+            Seconds before the cached candles are refreshed. Default the base interval.
+    '''
+
+    def __init__(self, middleware, exchange, baseInterval='1m', history=1000, ttl=None,
+                 clock=time.time):
+        count, unit = parseInterval(baseInterval)
+        if unit == 'M':
+            raise ResamplerException('Base interval must be fixed (m, h, d or w).')
+        self.middleware = middleware
+        self.exchange = exchange
+        self.baseInterval = baseInterval
+        self.history = history
+        self._base = count * unit
+        self.ttl = ttl if ttl is not None else self._base / 1000.0
+        self._clock = clock
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def _fetch(self, symbol, limit):
+        candles = call(self.middleware.fetchOHLCV, symbol, self.baseInterval, limit)
+        if self.exchange == 'binance':
+            array = binanceArray(candles or [])
+        else:
+            array = ohlcvArray(candles or [], self.exchange)
+        if self.exchange in BUCKET_END:
+            array[:, TIME] -= self._base
+        return array
+
+    def candles(self, symbol):
+        '''
+            Base candles of a symbol, refreshed when older than ttl.
+            Only the candles since the last refresh are fetched.
+
+            :returns: numpy.ndarray (see indicators.ohlcvArray), followed by the
+                BINANCE_EXTRA columns for Binance
+        '''
+        now = self._clock()
+        with self._lock:
+            cached = self._cache.get(symbol)
+        if cached is not None and now - cached[1] < self.ttl:
+            return cached[0]
+
+        if cached is None or not len(cached[0]):
+            array = self._fetch(symbol, self.history)
+        else:
+            known = cached[0]
+            # The last known candle is fetched again, it may have been still forming
+            missing = int((now * 1000.0 - known[-1, TIME]) // self._base) + 2
+            fresh = self._fetch(symbol, min(missing, self.history))
+            if len(fresh) and fresh[0, TIME] <= known[-1, TIME]:
+                array = np.concatenate((known[known[:, TIME] < fresh[0, TIME]], fresh))
+            else:
+                # A gap longer than history: start over
+                array = fresh if len(fresh) else known
+            array = array[-self.history:]
+
+        with self._lock:
+            self._cache[symbol] = (array, now)
+        return array
+
+    def invalidate(self, symbol=None):
+        with self._lock:
+            if symbol is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(symbol, None)
+
+    def fetchOHLCV(self, symbol, interval='1d', limit=100, asArray=False):
+        '''
+            Kline/candlestick bars for a symbol in any interval, derived from the base candles.
+
+            :param symbol: required
+            :type symbol: str
+            :param interval: - Default 1d; any count of m, h, d, w or M.
+            :type interval: str
+            :param limit: - Default 100.
+            :type limit: int
+            :param asArray: - Default False.
+            :type asArray: boolean
+
+            :returns: list of lists (numpy.ndarray if asArray), oldest first
+
+            Response Example
+            --------
+            [
+                [
+                    1499040000000,  # Open time
+                    0.0163479,      # Open
+                    0.8,            # High
+                    0.015758,       # Low
+                    0.015771,       # Close
+                    148976.11427815 # Volume
+                ]
+            ]
+        '''
+        count, unit = parseInterval(interval)
+        if unit != 'M' and (count * unit) % self._base:
+            raise ResamplerException(f'Interval {interval} is not a multiple of {self.baseInterval}.')
+
+        array = self.candles(symbol)
+        if unit != 'M' and count * unit == self._base:
+            result = array
+        else:
+            result = resample(array, interval)
+        result = result[-int(limit):] if limit else result
+        if asArray:
+            return result
+        return [[int(row[TIME]), row[OPEN], row[HIGH], row[LOW], row[CLOSE], row[VOLUME]]
+                for row in result.tolist()]
+
+
+if __name__ == '__main__':
+    import timeit
+
+    count = 100000
+    close = 9000.0 + np.cumsum(np.random.randn(count))
+    array = np.column_stack((np.arange(count) * float(MINUTE), close, close + 5.0,
+                             close - 5.0, close, np.ones(count)))
+    for interval in ('15m', '4h', '1w', '1M'):
+        elapsed = timeit.timeit(lambda: resample(array, interval), number=100)
+        print(f'{interval}: {elapsed / 100 * 1e3:.2f} ms for {count} base candles')
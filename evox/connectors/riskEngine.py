@@ -0,0 +1,337 @@
+# coding=utf-8
+
+'''
+    Pre-trade risk checks
+
+    Every order goes through RiskEngine.check before being sent to the
+    exchange: max notional, max open orders per symbol, price band around the
+    last ticker price and order rate throttle.
+
+    Reference prices come from the trades of a TickerEngine (follow). Open
+    orders are tracked by id: added when accepted, removed when canceled or
+    when an execution report closes them (applyOrder), and resynced from
+    REST or an OrderStore with setOpenOrders/syncOpenOrders.
+
+    A new order passing check holds a reservation of its open order slot and
+    notional until it is accepted (onOrderAccepted) or released (release), so
+    orders checked in parallel (SmartOrderRouter children, amendOrders) cannot
+    all pass the limits of the same free slot.
+
+    Limits are resolved per symbol once and the price band bounds are
+    recomputed only when the reference price changes, so a check is a few
+    attribute reads and comparisons.
+'''
+
+import itertools
+import threading
+import time
+
+from .consolidatedOrderBook import CONTRACTS, inverseSymbols
+from .errors import EvoxError
+from .orderStore import OPEN_STATUSES, orderKey, orderStatus
+
+
+# Inverse contracts, valued in the base currency (contracts / price)
+INVERSE_SYMBOLS = inverseSymbols(CONTRACTS)
+
+
+class RiskException(EvoxError):
+    pass
+
+
+def _remaining(order):
+    if order.get('leavesQty') is not None:
+        return float(order['leavesQty'])
+    for total, executed in (('origQty', 'executedQty'), ('orderQty', 'cumQty')):
+        if order.get(total) is not None:
+            return float(order[total]) - float(order.get(executed) or 0)
+    return 0.0
+
+
+def orderNotional(order, inverse=False):
+    '''
+        Notional of the quantity still working of an open order (0 without a price).
+    '''
+    price = float(order.get('price') or 0)
+    if not price:
+        return 0.0
+    remaining = abs(_remaining(order))
+    return remaining / price if inverse else remaining * price
+
+
+class SymbolRisk(object):
+    '''
+        Precomputed limits and incremental state of a symbol
+    '''
+    __slots__ = ('maxNotional', 'maxOpenOrders', 'maxOpenNotional', 'priceBand', 'inverse',
+                 'lastPrice', 'low', 'high', 'orders', 'notionals', 'reserved')
+
+    def __init__(self, maxNotional, maxOpenOrders, priceBand, maxOpenNotional=None,
+                 inverse=False):
+        self.maxNotional = maxNotional
+        self.maxOpenOrders = maxOpenOrders
+        self.maxOpenNotional = maxOpenNotional
+        self.priceBand = priceBand
+        self.inverse = inverse
+        self.lastPrice = None
+        self.low = None
+        self.high = None
+        # Keys of the open orders
+        self.orders = set()
+        # Notional by key of the open orders
+        self.notionals = {}
+        # Notional by reservation of the checked orders not accepted yet
+        self.reserved = {}
+
+    @property
+    def openOrders(self):
+        return len(self.orders)
+
+    @property
+    def exposure(self):
+        '''
+            Notional of the open and reserved orders.
+        '''
+        return sum(self.notionals.values()) + sum(self.reserved.values())
+
+    def setOrders(self, orders):
+        self.notionals = {orderKey(order): orderNotional(order, self.inverse) for order in orders}
+        self.notionals.pop(None, None)
+        self.orders = set(self.notionals)
+
+    def addOrder(self, key, notional):
+        self.orders.add(key)
+        self.notionals[key] = notional
+
+    def removeOrder(self, key):
+        self.orders.discard(key)
+        self.notionals.pop(key, None)
+
+    def setPrice(self, price):
+        self.lastPrice = price
+        if self.priceBand is not None:
+            self.low = price * (1.0 - self.priceBand)
+            self.high = price * (1.0 + self.priceBand)
+
+
+class RiskEngine(object):
+    '''
+        Pre-trade risk engine
+
+        Attributes
+        ------------
+        maxNotional : float
+            Max price * quantity of a single order. Inverse contracts
+            (e.g. Bitmex XBTUSD) are valued as quantity / price, in XBT.
+
+        maxOpenOrders : int
+            Max open orders per symbol
+
+        maxOpenNotional : float
+            Max notional of the open orders of a symbol, including the order checked
+
+        priceBand : float
+            Max distance of a limit price to the last price, e.g. 0.05 for 5%
+
+        maxOrdersPerSecond : float
+            Order rate throttle, shared by every symbol
+
+        burst : int
+            Orders allowed at once by the throttle. Default maxOrdersPerSecond.
+
+        limits : dict
+            Overrides by symbol, e.g. {'BTCUSDT': {'maxNotional': 50000}}.
+            Inverse contracts other than INVERSE_SYMBOLS (the inverse contracts
+            of CONTRACTS) are set with {'inverse': True}.
+    '''
+
+    def __init__(self, maxNotional=None, maxOpenOrders=None, priceBand=None,
+                 maxOrdersPerSecond=None, burst=None, limits=None, maxOpenNotional=None):
+        self._defaults = {'maxNotional': maxNotional,
+                          'maxOpenOrders': maxOpenOrders,
+                          'maxOpenNotional': maxOpenNotional,
+                          'priceBand': priceBand}
+        self._limits = dict(limits or {})
+        self._symbols = {}
+        self._rate = maxOrdersPerSecond
+        self._burst = float(burst or maxOrdersPerSecond or 0)
+        self._tokens = self._burst
+        self._refilled = time.monotonic()
+        self._lock = threading.Lock()
+        self._reservations = itertools.count(1)
+
+    def _symbol(self, symbol):
+        state = self._symbols.get(symbol)
+        if state is None:
+            limits = dict(self._defaults, inverse=symbol in INVERSE_SYMBOLS,
+                          **self._limits.get(symbol, {}))
+            state = self._symbols.setdefault(symbol, SymbolRisk(**limits))
+        return state
+
+    def updatePrice(self, symbol, price):
+        '''
+            Set the reference (last ticker) price of a symbol.
+        '''
+        self._symbol(str(symbol)).setPrice(float(price))
+
+    def needsPrice(self, symbol):
+        '''
+            :returns: True if a market order of the symbol cannot be valued yet
+        '''
+        state = self._symbol(str(symbol))
+        return state.maxNotional is not None and state.lastPrice is None
+
+    def follow(self, tickerEngine):
+        '''
+            Update the reference prices with the trades of a TickerEngine.
+        '''
+        tickerEngine.addListener(self.updatePrice)
+
+    def setOpenOrders(self, symbol, orders):
+        '''
+            Set the open orders of a symbol, e.g. from fetchOpenOrders(symbol).
+
+            :param orders: required - open orders (dictionaries)
+            :type orders: list
+        '''
+        with self._lock:
+            self._symbol(str(symbol)).setOrders(orders)
+
+    def syncOpenOrders(self, orders):
+        '''
+            Set the open orders of every symbol, e.g. from OrderStore.openOrders()
+            after a reconcile. Symbols without open orders are reset.
+
+            :param orders: required - open orders (dictionaries)
+            :type orders: list
+        '''
+        bySymbol = {}
+        for order in orders:
+            bySymbol.setdefault(str(order.get('symbol')), []).append(order)
+        with self._lock:
+            for symbol, state in self._symbols.items():
+                state.setOrders(bySymbol.pop(symbol, []))
+            for symbol, symbolOrders in bySymbol.items():
+                self._symbol(symbol).setOrders(symbolOrders)
+
+    def onOrderAccepted(self, symbol, orderId, reservation=None):
+        '''
+            Count an order as open, with the notional of its reservation (check) if sent.
+        '''
+        with self._lock:
+            state = self._symbol(str(symbol))
+            state.addOrder(str(orderId), state.reserved.pop(reservation, 0.0))
+
+    def onOrderClosed(self, symbol, orderId):
+        with self._lock:
+            self._symbol(str(symbol)).removeOrder(str(orderId))
+
+    def release(self, symbol, reservation):
+        '''
+            Free the reservation of a checked order rejected, failed or not staying open (market).
+        '''
+        if reservation is None:
+            return
+        with self._lock:
+            self._symbol(str(symbol)).reserved.pop(reservation, None)
+
+    def applyOrder(self, order):
+        '''
+            Apply an order update of the execution stream, e.g. binanceExecutionReport(event)
+            or a Bitmex order row. Filled, canceled, expired and rejected orders no longer count.
+        '''
+        key = orderKey(order)
+        status = orderStatus(order)
+        symbol = order.get('symbol')
+        if key is None or status is None or symbol is None:
+            return
+        with self._lock:
+            state = self._symbol(str(symbol))
+            if status in OPEN_STATUSES:
+                state.addOrder(key, orderNotional(order, state.inverse))
+            else:
+                state.removeOrder(key)
+
+    def check(self, symbol, side, quantity, price=None, newOrder=True):
+        '''
+            Raise RiskException if the order breaks a limit.
+            Market orders (no price) are valued at the last price.
+            Amendments (newOrder False) do not count against the max open orders.
+            A new order reserves its open order slot and notional, to be passed
+            to onOrderAccepted once the exchange accepts it or to release otherwise.
+
+            :param symbol: required
+            :type symbol: str
+            :param side: required
+            :type side: str
+            :param quantity: required
+            :type quantity: float
+            :param price: -
+            :type price: float
+            :param newOrder: - Default True.
+            :type newOrder: boolean
+
+            :returns: reservation of a new order, None for amendments
+        '''
+        state = self._symbols.get(symbol) or self._symbol(str(symbol))
+
+        if price:
+            price = float(price)
+            if state.low is not None and not state.low <= price <= state.high:
+                raise RiskException(f'Price out of band ({symbol}: {price}, '
+                                    f'band {state.low:.8g} - {state.high:.8g}).')
+            reference = price
+        else:
+            reference = state.lastPrice
+
+        notional = 0.0
+        if state.maxNotional is not None or state.maxOpenNotional is not None:
+            if reference is None:
+                raise RiskException(f'No reference price to value the order ({symbol}).')
+            if state.inverse:
+                notional = abs(float(quantity)) / reference
+            else:
+                notional = abs(float(quantity)) * reference
+            if state.maxNotional is not None and notional > state.maxNotional:
+                raise RiskException(f'Max notional exceeded ({symbol}: {notional:.8g} > {state.maxNotional}).')
+
+        # Limits on the open orders and the throttle are checked and reserved atomically
+        with self._lock:
+            if newOrder and state.maxOpenOrders is not None and \
+                    len(state.orders) + len(state.reserved) >= state.maxOpenOrders:
+                raise RiskException(f'Max open orders reached ({symbol}: {state.maxOpenOrders}).')
+
+            if newOrder and state.maxOpenNotional is not None:
+                exposure = state.exposure + notional
+                if exposure > state.maxOpenNotional:
+                    raise RiskException(f'Max open notional exceeded ({symbol}: {exposure:.8g} > '
+                                        f'{state.maxOpenNotional}).')
+
+            if self._rate:
+                now = time.monotonic()
+                self._tokens = min(self._burst, self._tokens + (now - self._refilled) * self._rate)
+                self._refilled = now
+                if self._tokens < 1.0:
+                    raise RiskException(f'Order rate limit exceeded ({self._rate}/s).')
+                self._tokens -= 1.0
+
+            if not newOrder:
+                return None
+            reservation = next(self._reservations)
+            state.reserved[reservation] = notional
+            return reservation
+
+
+if __name__ == '__main__':
+    import timeit
+
+    engine = RiskEngine(maxNotional=100000, maxOpenOrders=50, priceBand=0.05,
+                        maxOrdersPerSecond=1e9)
+    engine.updatePrice('BTCUSDT', 9475.0)
+    number = 1000000
+
+    def checkAndRelease():
+        engine.release('BTCUSDT', engine.check('BTCUSDT', 'buy', 1.5, 9470.0))
+
+    elapsed = timeit.timeit(checkAndRelease, number=number)
+    print(f'{elapsed / number * 1e6:.2f} us per check')
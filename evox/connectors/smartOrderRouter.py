@@ -0,0 +1,361 @@
+# coding=utf-8
+
+'''
+    Smart order router
+
+    Splits a parent order across Binance, Bitmex and Bitfinex by walking the
+    consolidated (fee-adjusted) order book, then sends the child orders to
+    every venue in parallel through the middlewares' createLimitOrder.
+
+    Quantities are base asset quantities; children of venues quoting
+    contracts (Bitmex) are sent in contracts.
+'''
+
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+from .consolidatedOrderBook import (ASK, BID, BOOK_PARSERS, CONTRACTS, ConsolidatedOrderBook,
+                                    contractSpec, contractToBase)
+from .dispatch import call
+from .errors import EvoxError
+from .orderStore import bitfinexOrder, orderKey, orderStatus
+
+
+# Depth keyword of the middlewares' fetchOrderBook
+DEPTH_ARGUMENTS = {
+    'binance': 'limit',
+    'bitmex': 'depth',
+    'bitfinex': 'length',
+}
+
+# Child status of the order statuses of every venue; the others are final
+OPEN_STATUSES = frozenset(['NEW', 'PARTIALLY_FILLED', 'PENDING_NEW',
+                           'New', 'PartiallyFilled', 'PendingNew'])
+FILLED_STATUSES = frozenset(['FILLED', 'Filled'])
+
+
+class RouterException(EvoxError):
+    pass
+
+
+def _asOrder(order):
+    # Bitfinex middleware returns bfxapi Order objects
+    return order if isinstance(order, dict) else bitfinexOrder(order)
+
+
+def _filledQuantity(order):
+    for key in ('executedQty', 'cumQty'):
+        if key in order:
+            return float(order[key] or 0)
+    return 0.0
+
+
+def _fillPrice(order, price):
+    # Bitmex average fill price; contracts are converted at the child limit price without it
+    return float(order.get('avgPx') or price)
+
+
+def _childStatus(order):
+    status = orderStatus(order)
+    if status in OPEN_STATUSES:
+        return 'open'
+    if status in FILLED_STATUSES:
+        return 'filled'
+    # Canceled, expired or rejected by the exchange
+    return 'canceled'
+
+
+class SmartOrderRouter(object):
+    '''
+        Order router on top of the exchange middlewares
+
+        Attributes
+        ------------
+        venues : dict
+            Middleware by venue name, e.g. {'binance': BinanceMiddleware(...)}.
+            Venue names must be keys of BOOK_PARSERS to refresh books from REST.
+
+        fees : dict
+            Taker fee rate by venue, used to rank the levels
+
+        lotSizes : dict
+            Minimum quantity step by venue, in the venue unit (contracts for
+            contract venues, 1 by default); child quantities are rounded down
+
+        contracts : dict
+            Contract specification (size, inverse) by venue and symbol, see
+            ConsolidatedOrderBook. Default CONTRACTS.
+    '''
+
+    def __init__(self, venues, fees=None, lotSizes=None, maxWorkers=None, contracts=None):
+        if not venues:
+            raise RouterException('At least one venue is required.')
+        self._venues = dict(venues)
+        self._fees = dict(fees or {})
+        self._lotSizes = dict(lotSizes or {})
+        self._contracts = dict(CONTRACTS if contracts is None else contracts)
+        self._executor = ThreadPoolExecutor(max_workers=maxWorkers or len(self._venues))
+
+    @property
+    def venues(self):
+        return self._venues
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    def fetchBook(self, symbols, depth=100):
+        '''
+            Fetch the REST depth of every venue in parallel and merge it.
+
+            :param symbols: required - symbol by venue, e.g. {'binance': 'BTCUSDT', 'bitmex': 'XBTUSD'}
+            :type symbols: dict
+            :param depth: - Default 100.
+            :type depth: int
+
+            :returns: ConsolidatedOrderBook
+        '''
+        futures = {}
+        for venue, symbol in symbols.items():
+            if venue not in BOOK_PARSERS:
+                raise RouterException(f'No order book parser for venue ({venue}).')
+            arguments = {DEPTH_ARGUMENTS[venue]: int(depth)}
+            futures[venue] = self._executor.submit(call,
+                                                   self._venues[venue].fetchOrderBook,
+                                                   symbol, **arguments)
+
+        book = ConsolidatedOrderBook(self._fees, self._contracts, symbols)
+        for venue, future in futures.items():
+            bids, asks = BOOK_PARSERS[venue](future.result())
+            book.loadSnapshot(venue, bids, asks)
+        return book
+
+    def _roundLot(self, venue, size, contracts):
+        step = self._lotSizes.get(venue) or (1 if venue in contracts else None)
+        if not step:
+            return size
+        return math.floor(size / step + 1e-9) * step
+
+    def plan(self, book, side, quantity, limitPrice=None):
+        '''
+            Compute the best fill plan for a parent order.
+            Buys consume asks and sells consume bids, best fee-adjusted level first.
+
+            :param book: required
+            :type book: ConsolidatedOrderBook
+            :param side: required
+            :type side: str
+            :param quantity: required
+            :type quantity: float
+            :param limitPrice: - worst fee-adjusted price accepted
+            :type limitPrice: float
+
+            :returns: dictionary with the plan
+
+            Plan Example
+            --------
+            {
+                "side": "buy",
+                "quantity": 2.0,
+                "planned": 2.0,
+                "averagePrice": 9482.7,  # fee-adjusted, of the planned quantities
+                "children": {
+                    "bitmex": {"quantity": 1.0, "size": 9475, "price": 9475.0, "notional": 9475.0},
+                    "binance": {"quantity": 1.0, "size": 1.0, "price": 9475.1, "notional": 9475.1}
+                }
+            }
+        '''
+        side = str(side).lower()
+        if side not in ('buy', 'sell'):
+            raise RouterException('Error setting order side (buy or sell).')
+        bookSide = ASK if side == 'buy' else BID
+
+        remaining = float(quantity)
+        fills = {}
+        for adjusted, level in book.levels(bookSide):
+            if remaining <= 0:
+                break
+            if limitPrice is not None:
+                if side == 'buy' and adjusted > limitPrice:
+                    break
+                if side == 'sell' and adjusted < limitPrice:
+                    break
+            for venue, (price, available) in level.items():
+                if remaining <= 0:
+                    break
+                take = min(available, remaining)
+                fills.setdefault(venue, []).append((adjusted, price, take))
+                remaining -= take
+
+        contracts = book.contracts
+        planned = 0.0
+        cost = 0.0
+        children = {}
+        for venue, levels in fills.items():
+            # Worst price of the venue: the limit price of its child order
+            price = levels[-1][1]
+            wanted = sum(take for _, _, take in levels)
+            size = self._roundLot(venue, book.toVenue(venue, price, wanted), contracts)
+            if venue in contracts:
+                size = int(size)
+            if size <= 0:
+                continue
+            rounded = min(book.toBase(venue, price, size), wanted)
+
+            # Cost of the rounded quantity, best levels first
+            left = rounded
+            notional = 0.0
+            for adjusted, levelPrice, take in levels:
+                take = min(take, left)
+                notional += take * levelPrice
+                cost += take * adjusted
+                left -= take
+                if left <= 0:
+                    break
+            children[venue] = {'quantity': rounded,
+                               'size': size,
+                               'price': price,
+                               'notional': notional}
+            planned += rounded
+
+        return {'side': side,
+                'quantity': float(quantity),
+                'planned': planned,
+                'averagePrice': cost / planned if planned else None,
+                'children': children}
+
+    def _submitChild(self, venue, symbol, side, child):
+        try:
+            orderId = call(self._venues[venue].createLimitOrder,
+                            symbol, side, child['size'], child['price'])
+            return {'status': 'submitted', 'orderId': orderId, 'error': None}
+        except Exception as error:
+            return {'status': 'rejected', 'orderId': None, 'error': error}
+
+    def execute(self, symbols, side, quantity, book=None, limitPrice=None):
+        '''
+            Plan a parent order and dispatch its child orders in parallel.
+            Each child is a limit order at the worst price it needs on its venue.
+
+            :param symbols: required - symbol by venue
+            :type symbols: dict
+            :param side: required
+            :type side: str
+            :param quantity: required
+            :type quantity: float
+            :param book: - Default None; the REST depth is fetched when not sent.
+            :type book: ConsolidatedOrderBook
+            :param limitPrice: -
+            :type limitPrice: float
+
+            :returns: dictionary with the parent order status
+        '''
+        if book is None:
+            book = self.fetchBook(symbols)
+        plan = self.plan(book, side, quantity, limitPrice)
+        if not plan['children']:
+            raise RouterException('No liquidity available for the order.')
+
+        # Checked before anything is sent, not to leave orphan children
+        missing = [venue for venue in plan['children'] if venue not in symbols]
+        if missing:
+            raise RouterException(f"Symbol not defined for venue ({', '.join(missing)}).")
+
+        futures = {}
+        for venue, child in plan['children'].items():
+            futures[venue] = self._executor.submit(self._submitChild, venue,
+                                                   symbols[venue], plan['side'], child)
+
+        children = []
+        for venue, future in futures.items():
+            child = dict(plan['children'][venue])
+            child.update(future.result())
+            child.update({'venue': venue, 'symbol': symbols[venue], 'filled': 0.0})
+            children.append(child)
+
+        plan['children'] = children
+        plan['status'] = self._parentStatus(children)
+        return plan
+
+    def _closedOrder(self, child):
+        try:
+            return _asOrder(call(self._venues[child['venue']].fetchOrder,
+                                  child['symbol'], child['orderId']))
+        except Exception as error:
+            return error
+
+    def fetchParentStatus(self, parent):
+        '''
+            Refresh the fills of a parent order returned by execute.
+            Children no longer open are looked up (fetchOrder) for their final
+            status (filled or canceled, which includes expired and rejected by
+            the exchange) and executed quantity.
+            Filled quantities are base asset quantities.
+
+            :param parent: required
+            :type parent: dict
+
+            :returns: dictionary with the parent order status
+        '''
+        futures = {}
+        for child in parent['children']:
+            if child['status'] == 'rejected':
+                continue
+            key = (child['venue'], child['symbol'])
+            if key not in futures:
+                futures[key] = self._executor.submit(call,
+                                                     self._venues[child['venue']].fetchOpenOrders,
+                                                     child['symbol'])
+
+        openOrders = {}
+        for key, future in futures.items():
+            orders = map(_asOrder, future.result())
+            openOrders[key] = {orderKey(order): order for order in orders}
+
+        closed = {}
+        for index, child in enumerate(parent['children']):
+            if child['status'] in ('rejected', 'filled', 'canceled'):
+                continue
+            order = openOrders[(child['venue'], child['symbol'])].get(str(child['orderId']))
+            if order is None:
+                closed[index] = self._executor.submit(self._closedOrder, child)
+            else:
+                self._updateChild(child, order)
+
+        for index, future in closed.items():
+            child = parent['children'][index]
+            order = future.result()
+            if isinstance(order, Exception):
+                # Status unknown: kept as it was, not counted as filled
+                child['error'] = order
+            else:
+                self._updateChild(child, order)
+
+        filled = sum(child['filled'] for child in parent['children'])
+
+        parent['filled'] = filled
+        parent['status'] = self._parentStatus(parent['children'])
+        return parent
+
+    def _updateChild(self, child, order):
+        child['status'] = _childStatus(order)
+        contract = contractSpec(self._contracts, child['venue'], child['symbol'])
+        child['filled'] = contractToBase(contract, _fillPrice(order, child['price']),
+                                         _filledQuantity(order))
+
+    @staticmethod
+    def _parentStatus(children):
+        '''
+            rejected: every child rejected; filled: every child filled;
+            submitted or partially_filled: children still working;
+            partial: no child working, some not (completely) filled.
+        '''
+        statuses = set(child['status'] for child in children)
+        if statuses == {'rejected'}:
+            return 'rejected'
+        if statuses == {'filled'}:
+            return 'filled'
+        if statuses & {'submitted', 'open'}:
+            if 'filled' in statuses or any(child.get('filled') for child in children):
+                return 'partially_filled'
+            return 'submitted'
+        return 'partial'
@@ -0,0 +1,519 @@
+# coding=utf-8
+
+'''
+    In-memory ticker engine
+
+    Keeps mid, spread, microprice, rolling VWAP and 24 hours statistics of
+    every symbol from streamed trades and book tops, so fetchTicker can be
+    answered without a REST call.
+
+    Windows are rings of fixed-size buckets with running sums: a trade adds
+    to the head bucket and buckets leaving the window are subtracted as the
+    head moves, so updates are O(1) amortized whatever the window length.
+    High, low and open of the window are kept in monotonic queues.
+
+    The 24 hours window of a symbol only covers the trades seen since the
+    stream started, until it is seeded with the REST candles of the hours
+    before (seedDay, done once by the middlewares' fetchTicker).
+'''
+
+import time
+from collections import deque
+from datetime import datetime
+
+from .errors import EvoxError
+
+
+class TickerException(EvoxError):
+    pass
+
+
+class TradeWindow(object):
+    '''
+        Rolling sums of the trades of the last window seconds
+
+        Attributes
+        ------------
+        window : float
+            Seconds covered by the window
+
+        resolution : float
+            Seconds of a bucket; trades expire bucket by bucket
+    '''
+    __slots__ = ('resolution', 'size', 'volume', 'notional', 'count',
+                 '_volume', '_notional', '_count', '_head', '_first',
+                 '_highs', '_lows', '_opens')
+
+    def __init__(self, window, resolution=1.0):
+        self.resolution = float(resolution)
+        self.size = max(1, int(round(window / resolution)))
+        self.volume = 0.0
+        self.notional = 0.0
+        self.count = 0
+        self._volume = [0.0] * self.size
+        self._notional = [0.0] * self.size
+        self._count = [0] * self.size
+        self._head = None
+        # Oldest bucket added
+        self._first = None
+        # (bucket, price) queues: decreasing highs, increasing lows, first price of each bucket
+        self._highs = deque()
+        self._lows = deque()
+        self._opens = deque()
+
+    def _advance(self, bucket):
+        if self._head is None:
+            self._head = bucket
+            return
+        if bucket <= self._head:
+            return
+
+        for index in range(self._head + 1, self._head + 1 + min(bucket - self._head, self.size)):
+            slot = index % self.size
+            self.volume -= self._volume[slot]
+            self.notional -= self._notional[slot]
+            self.count -= self._count[slot]
+            self._volume[slot] = 0.0
+            self._notional[slot] = 0.0
+            self._count[slot] = 0
+        self._head = bucket
+
+        if not self.count:
+            # Avoid float drift once the window is empty
+            self.volume = 0.0
+            self.notional = 0.0
+        oldest = bucket - self.size + 1
+        for queue in (self._highs, self._lows, self._opens):
+            while queue and queue[0][0] < oldest:
+                queue.popleft()
+
+    def expire(self, timestamp):
+        '''
+            Move the window to timestamp without adding a trade.
+        '''
+        self._advance(int(timestamp // self.resolution))
+
+    def add(self, timestamp, price, quantity):
+        bucket = int(timestamp // self.resolution)
+        self._advance(bucket)
+        if bucket <= self._head - self.size:
+            return
+        # Late trades are accounted in the bucket they belong to,
+        # but ordered as the head bucket in the high/low queues
+        slot = bucket % self.size
+        self._volume[slot] += quantity
+        self._notional[slot] += quantity * price
+        self._count[slot] += 1
+        self.volume += quantity
+        self.notional += quantity * price
+        self.count += 1
+        if self._first is None or bucket < self._first:
+            self._first = bucket
+
+        head = self._head
+        highs = self._highs
+        while highs and highs[-1][1] <= price:
+            highs.pop()
+        highs.append((head, price))
+        lows = self._lows
+        while lows and lows[-1][1] >= price:
+            lows.pop()
+        lows.append((head, price))
+        if not self._opens or self._opens[-1][0] < bucket:
+            self._opens.append((bucket, price))
+
+    def prepend(self, bars):
+        '''
+            Add aggregated bars older than every trade of the window, e.g. 1 minute candles
+            of the hours before the stream started. Bars not older than the first trade are skipped.
+
+            :param bars: required - (timestamp, open, high, low, volume, notional, count), any order
+            :type bars: list
+        '''
+        first = self._first
+        bars = sorted((bar for bar in bars
+                       if first is None or int(bar[0] // self.resolution) < first),
+                      key=lambda bar: bar[0], reverse=True)
+        if not bars:
+            return
+        if self._head is None:
+            self._head = int(bars[0][0] // self.resolution)
+        # Newest first: an older high (low) is only kept if it is above (below) every newer one
+        for timestamp, open, high, low, volume, notional, count in bars:
+            bucket = int(timestamp // self.resolution)
+            if bucket <= self._head - self.size:
+                break
+            slot = bucket % self.size
+            self._volume[slot] += volume
+            self._notional[slot] += notional
+            self._count[slot] += count
+            self.volume += volume
+            self.notional += notional
+            self.count += count
+            self._first = bucket
+            if not self._highs or high > self._highs[0][1]:
+                self._highs.appendleft((bucket, high))
+            if not self._lows or low < self._lows[0][1]:
+                self._lows.appendleft((bucket, low))
+            self._opens.appendleft((bucket, open))
+
+    @property
+    def vwap(self):
+        return self.notional / self.volume if self.volume > 0 else None
+
+    @property
+    def high(self):
+        return self._highs[0][1] if self._highs else None
+
+    @property
+    def low(self):
+        return self._lows[0][1] if self._lows else None
+
+    @property
+    def open(self):
+        return self._opens[0][1] if self._opens else None
+
+
+class TickerState(object):
+    '''
+        Book top, last trade and trade windows of a symbol
+    '''
+    __slots__ = ('symbol', 'bidPrice', 'bidQty', 'askPrice', 'askQty',
+                 'lastPrice', 'lastQty', 'bookTime', 'tradeTime', 'recent', 'day', 'dayStart')
+
+    def __init__(self, symbol, vwapWindow, dayResolution):
+        self.symbol = symbol
+        self.bidPrice = None
+        self.bidQty = None
+        self.askPrice = None
+        self.askQty = None
+        self.lastPrice = None
+        self.lastQty = None
+        self.bookTime = None
+        self.tradeTime = None
+        self.recent = TradeWindow(vwapWindow, 1.0)
+        self.day = TradeWindow(86400.0, dayResolution)
+        # Time since which the day window has every trade
+        self.dayStart = None
+
+    @property
+    def updateTime(self):
+        times = [value for value in (self.bookTime, self.tradeTime) if value is not None]
+        return max(times) if times else None
+
+    @property
+    def mid(self):
+        if self.bidPrice is None or self.askPrice is None:
+            return None
+        return (self.bidPrice + self.askPrice) / 2.0
+
+    @property
+    def spread(self):
+        if self.bidPrice is None or self.askPrice is None:
+            return None
+        return self.askPrice - self.bidPrice
+
+    @property
+    def microprice(self):
+        '''
+            Mid weighted by the opposite side size: closer to the ask when the bid is heavier.
+        '''
+        if self.bidPrice is None or self.askPrice is None:
+            return None
+        size = self.bidQty + self.askQty
+        if size <= 0:
+            return self.mid
+        return (self.bidPrice * self.askQty + self.askPrice * self.bidQty) / size
+
+
+def _isoSeconds(timestamp):
+    # Bitmex timestamps, e.g. 2020-06-01T12:00:00.000Z
+    return datetime.fromisoformat(timestamp.replace('Z', '+00:00')).timestamp()
+
+
+def binanceBars(klines):
+    '''
+        seedDay bars of Binance klines (REST lists).
+    '''
+    return [(kline[0] / 1000.0, float(kline[1]), float(kline[2]), float(kline[3]),
+             float(kline[5]), float(kline[7]), int(kline[8]))
+            for kline in klines]
+
+
+def bitmexBars(rows, binSeconds=60.0):
+    '''
+        seedDay bars of Bitmex bucketed trades, stamped at the end of the bucket.
+        Buckets without trades are skipped.
+    '''
+    bars = []
+    for row in rows:
+        if not row.get('trades'):
+            continue
+        timestamp = row['timestamp']
+        if isinstance(timestamp, str):
+            timestamp = _isoSeconds(timestamp)
+        elif isinstance(timestamp, datetime):
+            timestamp = timestamp.timestamp()
+        volume = float(row['volume'])
+        price = row.get('vwap') or row['close']
+        bars.append((timestamp - binSeconds, float(row['open']), float(row['high']),
+                     float(row['low']), volume, volume * float(price), int(row['trades'])))
+    return bars
+
+
+class TickerEngine(object):
+    '''
+        Tickers of many symbols kept from stream updates
+
+        Attributes
+        ------------
+        vwapWindow : float
+            Seconds of the rolling VWAP. Default 5 minutes.
+
+        maxAge : float
+            Seconds after the last update a ticker is stale
+
+        dayResolution : float
+            Seconds of a bucket of the 24 hours statistics. Default 1 minute.
+
+        clock : callable
+            Current time in seconds. Default time.time.
+    '''
+
+    def __init__(self, vwapWindow=300.0, maxAge=5.0, dayResolution=60.0, clock=time.time):
+        self.vwapWindow = vwapWindow
+        self.maxAge = maxAge
+        self.dayResolution = dayResolution
+        self._clock = clock
+        self._states = {}
+        self._listeners = []
+
+    def addListener(self, callback):
+        '''
+            Call callback(symbol, price) on every trade, e.g. RiskEngine.updatePrice.
+        '''
+        if callback not in self._listeners:
+            self._listeners.append(callback)
+
+    def _state(self, symbol):
+        state = self._states.get(symbol)
+        if state is None:
+            state = self._states[symbol] = TickerState(symbol, self.vwapWindow, self.dayResolution)
+        return state
+
+    def __contains__(self, symbol):
+        return str(symbol) in self._states
+
+    @property
+    def symbols(self):
+        return list(self._states)
+
+    def onTrade(self, symbol, price, quantity, timestamp=None):
+        '''
+            :param timestamp: - seconds. Default the current time.
+            :type timestamp: float
+        '''
+        timestamp = self._clock() if timestamp is None else timestamp
+        price = float(price)
+        quantity = abs(float(quantity))
+        state = self._state(symbol)
+        state.lastPrice = price
+        state.lastQty = quantity
+        state.tradeTime = timestamp
+        state.recent.add(timestamp, price, quantity)
+        state.day.add(timestamp, price, quantity)
+        if state.dayStart is None or timestamp < state.dayStart:
+            state.dayStart = timestamp
+        for listener in self._listeners:
+            listener(symbol, price)
+
+    def onBookTop(self, symbol, bidPrice, bidQty, askPrice, askQty, timestamp=None):
+        state = self._state(symbol)
+        state.bidPrice = float(bidPrice)
+        state.bidQty = float(bidQty)
+        state.askPrice = float(askPrice)
+        state.askQty = float(askQty)
+        state.bookTime = self._clock() if timestamp is None else timestamp
+
+    def coversDay(self, symbol):
+        '''
+            :returns: True if the 24 hours statistics of the symbol cover a whole day
+        '''
+        state = self._states.get(str(symbol))
+        if state is None or state.dayStart is None:
+            return False
+        return self._clock() - state.dayStart >= 86400.0 - self.dayResolution
+
+    def seedDay(self, symbol, bars, since=None):
+        '''
+            Fill the 24 hours window with the candles of the hours before the first
+            streamed trade, e.g. binanceBars(client.get_klines(symbol=symbol, interval='1m', ...)).
+
+            :param bars: required - (timestamp in seconds, open, high, low, volume, notional, count)
+            :type bars: list
+            :param since: - Default the oldest bar. Seconds since which the bars cover every trade.
+            :type since: float
+        '''
+        state = self._state(str(symbol))
+        state.day.prepend(bars)
+        if since is None and bars:
+            since = min(bar[0] for bar in bars)
+        if since is not None and (state.dayStart is None or since < state.dayStart):
+            state.dayStart = since
+
+    def isFresh(self, symbol):
+        state = self._states.get(str(symbol))
+        if state is None or state.updateTime is None:
+            return False
+        return self._clock() - state.updateTime <= self.maxAge
+
+    def ticker(self, symbol):
+        '''
+            Ticker of a symbol, with Binance 24 hours ticker keys where they exist.
+
+            :param symbol: required
+            :type symbol: str
+
+            :returns: dictionary
+
+            Ticker Example
+            --------
+            {
+                "symbol": "BTCUSDT",
+                "bidPrice": 9475.0,
+                "bidQty": 1.2,
+                "askPrice": 9475.5,
+                "askQty": 0.4,
+                "midPrice": 9475.25,
+                "spread": 0.5,
+                "microPrice": 9475.375,
+                "lastPrice": 9475.5,
+                "lastQty": 0.01,
+                "vwap": 9470.12,           # rolling vwapWindow seconds
+                "weightedAvgPrice": 9402.3, # 24 hours
+                "openPrice": 9310.0,
+                "highPrice": 9520.0,
+                "lowPrice": 9280.5,
+                "volume": 48213.1,
+                "quoteVolume": 453311980.2,
+                "count": 812345,
+                "priceChange": 165.5,
+                "priceChangePercent": 1.778,
+                "updateTime": 1591012800.123,
+                "age": 0.051,
+                "stale": false
+            }
+
+            The 24 hours statistics only cover the time since the first streamed trade
+            until the window is seeded (seedDay) or a day has passed (coversDay).
+        '''
+        state = self._states.get(str(symbol))
+        if state is None:
+            raise TickerException(f'No stream data for symbol ({symbol}).')
+
+        now = self._clock()
+        state.recent.expire(now)
+        state.day.expire(now)
+        day = state.day
+        openPrice = day.open
+        change = None
+        changePercent = None
+        if openPrice is not None and state.lastPrice is not None:
+            change = state.lastPrice - openPrice
+            changePercent = change / openPrice * 100.0 if openPrice else None
+
+        updateTime = state.updateTime
+        age = now - updateTime if updateTime is not None else None
+        return {'symbol': state.symbol,
+                'bidPrice': state.bidPrice,
+                'bidQty': state.bidQty,
+                'askPrice': state.askPrice,
+                'askQty': state.askQty,
+                'midPrice': state.mid,
+                'spread': state.spread,
+                'microPrice': state.microprice,
+                'lastPrice': state.lastPrice,
+                'lastQty': state.lastQty,
+                'vwap': state.recent.vwap,
+                'weightedAvgPrice': day.vwap,
+                'openPrice': openPrice,
+                'highPrice': day.high,
+                'lowPrice': day.low,
+                'volume': day.volume,
+                'quoteVolume': day.notional,
+                'count': day.count,
+                'priceChange': change,
+                'priceChangePercent': changePercent,
+                'updateTime': updateTime,
+                'age': age,
+                'stale': age is None or age > self.maxAge}
+
+    # --- Stream adapters
+
+    def handler(self, exchange, channel, symbol):
+        '''
+            Callback for a WebSocketManager subscription, e.g.
+            manager.subscribe('binance', 'trade', 'BTCUSDT', callback=engine.handler('binance', 'trade', 'BTCUSDT'))
+
+            Channels: binance trade/aggTrade/bookTicker, bitmex trade/quote, bitfinex trades/ticker.
+        '''
+        try:
+            adapter = getattr(self, f'_{exchange}_{channel}')
+        except AttributeError:
+            raise TickerException(f'Channel not supported ({exchange} {channel}).')
+        symbol = str(symbol)
+        return lambda message: adapter(symbol, message)
+
+    def _binance_trade(self, symbol, message):
+        self.onTrade(symbol, message['p'], message['q'], message['T'] / 1000.0)
+
+    _binance_aggTrade = _binance_trade
+
+    def _binance_bookTicker(self, symbol, message):
+        self.onBookTop(symbol, message['b'], message['B'], message['a'], message['A'])
+
+    def _bitmex_trade(self, symbol, message):
+        for row in message['data']:
+            self.onTrade(symbol, row['price'], row['size'], _isoSeconds(row['timestamp']))
+
+    def _bitmex_quote(self, symbol, message):
+        row = message['data'][-1]
+        if row.get('bidPrice') is None or row.get('askPrice') is None:
+            return
+        self.onBookTop(symbol, row['bidPrice'], row['bidSize'], row['askPrice'], row['askSize'],
+                       _isoSeconds(row['timestamp']))
+
+    def _bitfinex_trades(self, symbol, message):
+        # Snapshot: [[ID, MTS, AMOUNT, PRICE], ...], update: ['te', [ID, MTS, AMOUNT, PRICE]]
+        if message and isinstance(message[0], str):
+            if message[0] != 'te':
+                return
+            trades = [message[1]]
+        else:
+            trades = sorted(message, key=lambda trade: trade[1])
+        for _, mts, amount, price in trades:
+            self.onTrade(symbol, price, amount, mts / 1000.0)
+
+    def _bitfinex_ticker(self, symbol, message):
+        # [BID, BID_SIZE, ASK, ASK_SIZE, DAILY_CHANGE, DAILY_CHANGE_RELATIVE, LAST_PRICE, VOLUME, HIGH, LOW]
+        self.onBookTop(symbol, message[0], message[1], message[2], message[3])
+
+
+if __name__ == '__main__':
+    import random
+    import timeit
+
+    engine = TickerEngine()
+    clock = [1591012800.0]
+    engine._clock = lambda: clock[0]
+
+    def trade():
+        clock[0] += 0.01
+        engine.onTrade('BTCUSDT', 9475.0 + random.random(), 0.01, clock[0])
+
+    number = 1000000
+    elapsed = timeit.timeit(trade, number=number)
+    print(f'{elapsed / number * 1e6:.2f} us per trade')
+    engine.onBookTop('BTCUSDT', 9475.0, 1.2, 9475.5, 0.4)
+    elapsed = timeit.timeit(lambda: engine.ticker('BTCUSDT'), number=100000)
+    print(f'{elapsed / 100000 * 1e6:.2f} us per ticker')
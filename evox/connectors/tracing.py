@@ -0,0 +1,331 @@
+# coding=utf-8
+
+'''
+    Tracing of connector calls
+
+    Opt-in breakdown of middleware calls into spans: prepare, sign, send,
+    wait, decode and normalize. A TracingMiddleware opens a root span per
+    call (sampled); the vendor clients record the phases of the calls being
+    traced through the module span() context manager, which is a no-op when
+    no trace is active in the current context.
+
+    normalize is the shaping of the response into the middleware result
+    (vendor models, typed rows, derived candles): the time from the end of
+    the last wait or decode phase to the end of the call, unless the call
+    recorded its own normalize span.
+
+    Spans are kept in a fixed size ring buffer of tuples and can be exported
+    as Chrome trace JSON (chrome://tracing, Perfetto, speedscope) or to
+    OpenTelemetry, if installed.
+'''
+
+import contextvars
+import inspect
+import itertools
+import json
+import random
+import threading
+import time
+
+import requests
+
+from .errors import EvoxError
+
+
+PHASES = ('prepare', 'sign', 'send', 'wait', 'decode', 'normalize')
+
+# (tracer, call id, root span) of the call being traced
+_current = contextvars.ContextVar('evoxTrace', default=None)
+
+
+class TracingException(EvoxError):
+    pass
+
+
+class _NullSpan(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span(object):
+    __slots__ = ('tracer', 'callId', 'name', 'category', 'args', 'start', 'root')
+
+    def __init__(self, tracer, callId, name, category, args, root=None):
+        self.tracer = tracer
+        self.callId = callId
+        self.name = name
+        self.category = category
+        self.args = args
+        self.root = root
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, excType, exc, traceback):
+        args = self.args
+        if excType is not None:
+            args = dict(args or {}, error=excType.__name__)
+        end = time.perf_counter_ns()
+        self.tracer.record(self.name, self.start, end, self.category, self.callId, args)
+        if self.root is not None:
+            self.root.phaseEnded(self.name, end)
+        return False
+
+
+class _Trace(_Span):
+    __slots__ = ('token', 'lastPhase', 'lastEnd')
+
+    def __enter__(self):
+        self.lastPhase = None
+        self.lastEnd = None
+        self.token = _current.set((self.tracer, self.callId, self))
+        return super().__enter__()
+
+    def phaseEnded(self, name, end):
+        if self.lastEnd is None or end >= self.lastEnd:
+            self.lastPhase = name
+            self.lastEnd = end
+
+    def __exit__(self, excType, exc, traceback):
+        _current.reset(self.token)
+        if excType is None and self.lastPhase in ('wait', 'decode'):
+            self.tracer.record('normalize', self.lastEnd, time.perf_counter_ns(),
+                               'phase', self.callId, None)
+        return super().__exit__(excType, exc, traceback)
+
+
+def span(name, **args):
+    '''
+        Phase span of the call being traced, e.g. "with span('sign'): ...".
+    '''
+    current = _current.get()
+    if current is None:
+        return _NULL_SPAN
+    return _Span(current[0], current[1], name, 'phase', args or None, current[2])
+
+
+def record(name, start, end, **args):
+    '''
+        Record a phase measured by the caller (perf_counter_ns start and end).
+    '''
+    current = _current.get()
+    if current is not None:
+        current[0].record(name, start, end, 'phase', current[1], args or None)
+        current[2].phaseEnded(name, end)
+
+
+def isTracing():
+    return _current.get() is not None
+
+
+class Tracer(object):
+    '''
+        Ring buffer of spans
+
+        Attributes
+        ------------
+        capacity : int
+            Spans kept; the oldest are overwritten
+
+        sampleRate : float
+            Fraction of the calls traced, e.g. 0.01 to leave it on in production
+    '''
+
+    def __init__(self, capacity=65536, sampleRate=1.0):
+        self.capacity = capacity
+        self.sampleRate = sampleRate
+        self._buffer = [None] * capacity
+        self._counter = itertools.count()
+        self._calls = itertools.count(1)
+        self._written = 0
+        # Wall clock of perf_counter_ns 0, for exports
+        self._epoch = time.time_ns() - time.perf_counter_ns()
+
+    def trace(self, name, **args):
+        '''
+            Root span of a call. Its phases are recorded only if the call is sampled.
+        '''
+        if self.sampleRate < 1.0 and random.random() >= self.sampleRate:
+            return _NULL_SPAN
+        return _Trace(self, next(self._calls), name, 'call', args or None)
+
+    def record(self, name, start, end, category='phase', callId=0, args=None):
+        index = next(self._counter)
+        self._buffer[index % self.capacity] = (name, category, start, end - start,
+                                               threading.get_ident(), callId, args)
+        self._written = index + 1
+
+    def clear(self):
+        self._buffer = [None] * self.capacity
+        self._counter = itertools.count()
+        self._written = 0
+
+    def spans(self):
+        '''
+            :returns: list of tuples (name, category, start ns, duration ns, thread, call id, args), oldest first
+        '''
+        written = self._written
+        if written <= self.capacity:
+            spans = self._buffer[:written]
+        else:
+            split = written % self.capacity
+            spans = self._buffer[split:] + self._buffer[:split]
+        return [item for item in spans if item is not None]
+
+    def summary(self):
+        '''
+            :returns: dictionary {span name: {"count", "total", "mean", "max"}} in microseconds
+        '''
+        result = {}
+        for name, _, _, duration, _, _, _ in self.spans():
+            entry = result.setdefault(name, {'count': 0, 'total': 0.0, 'max': 0.0})
+            entry['count'] += 1
+            entry['total'] += duration / 1e3
+            entry['max'] = max(entry['max'], duration / 1e3)
+        for entry in result.values():
+            entry['mean'] = entry['total'] / entry['count']
+        return result
+
+    def chromeTrace(self):
+        '''
+            :returns: dictionary in Chrome trace event format
+        '''
+        events = []
+        for name, category, start, duration, thread, callId, args in self.spans():
+            event = {'name': name, 'cat': category, 'ph': 'X',
+                     'ts': (self._epoch + start) / 1e3, 'dur': duration / 1e3,
+                     'pid': 0, 'tid': thread, 'args': dict(args or {}, call=callId)}
+            events.append(event)
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def saveChromeTrace(self, path):
+        with open(path, 'w') as file:
+            json.dump(self.chromeTrace(), file)
+
+    def exportOpenTelemetry(self, tracer=None):
+        '''
+            Emit the spans to OpenTelemetry, phases as children of their call.
+
+            :param tracer: - Default opentelemetry.trace.get_tracer(__name__).
+            :type tracer: opentelemetry.trace.Tracer
+        '''
+        try:
+            from opentelemetry import trace
+        except ImportError:
+            raise TracingException('OpenTelemetry is not installed (pip install opentelemetry-sdk).')
+        tracer = tracer or trace.get_tracer(__name__)
+
+        calls = {}
+        phases = []
+        for item in self.spans():
+            if item[1] == 'call':
+                calls[item[5]] = item
+            else:
+                phases.append(item)
+
+        parents = {}
+        for callId, (name, _, start, duration, _, _, args) in calls.items():
+            root = tracer.start_span(name, start_time=self._epoch + start, attributes=args or {})
+            root.end(end_time=self._epoch + start + duration)
+            parents[callId] = trace.set_span_in_context(root)
+        for name, _, start, duration, _, callId, args in phases:
+            child = tracer.start_span(name, context=parents.get(callId),
+                                      start_time=self._epoch + start, attributes=args or {})
+            child.end(end_time=self._epoch + start + duration)
+
+
+class TracedSession(requests.Session):
+    '''
+        requests session splitting the HTTP time of traced calls into
+        send (connection, upload, body download) and wait (response.elapsed:
+        request sent until the response headers arrive).
+    '''
+
+    def send(self, request, **kwargs):
+        if _current.get() is None:
+            return super().send(request, **kwargs)
+        start = time.perf_counter_ns()
+        response = super().send(request, **kwargs)
+        end = time.perf_counter_ns()
+        wait = min(int(response.elapsed.total_seconds() * 1e9), end - start)
+        record('send', start, end - wait)
+        record('wait', end - wait, end, status=response.status_code)
+        return response
+
+
+def traceSession(session):
+    '''
+        Turn the requests session of a vendor client into a TracedSession.
+        TracedSession adds no state, so the session keeps its adapters and settings.
+    '''
+    if isinstance(session, requests.Session) and not isinstance(session, TracedSession):
+        session.__class__ = TracedSession
+    return session
+
+
+class TracingMiddleware(object):
+    '''
+        Middleware proxy opening a root span for every call
+
+        Attributes
+        ------------
+        middleware : object
+            Any middleware
+
+        tracer : Tracer
+
+        name : str
+            Prefix of the spans. Default the middleware class name.
+    '''
+
+    def __init__(self, middleware, tracer, name=None):
+        self._middleware = middleware
+        self.tracer = tracer
+        self._name = name or type(middleware).__name__
+
+    def __getattr__(self, name):
+        method = getattr(self._middleware, name)
+        if name.startswith('_') or not callable(method):
+            return method
+        spanName = f'{self._name}.{name}'
+        tracer = self.tracer
+
+        if inspect.iscoroutinefunction(method):
+            async def call(*args, **kwargs):
+                with tracer.trace(spanName):
+                    return await method(*args, **kwargs)
+            return call
+
+        def call(*args, **kwargs):
+            with tracer.trace(spanName):
+                return method(*args, **kwargs)
+        return call
+
+
+if __name__ == '__main__':
+    import timeit
+
+    tracer = Tracer(sampleRate=1.0)
+
+    def traced():
+        with tracer.trace('call'):
+            with span('sign'):
+                pass
+            with span('decode'):
+                pass
+
+    number = 100000
+    elapsed = timeit.timeit(traced, number=number)
+    print(f'{elapsed / number * 1e6:.2f} us per traced call (3 spans)')
+    tracer.sampleRate = 0.01
+    elapsed = timeit.timeit(traced, number=number)
+    print(f'{elapsed / number * 1e6:.2f} us per call sampled at 1%')
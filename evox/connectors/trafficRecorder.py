@@ -0,0 +1,534 @@
+# coding=utf-8
+
+'''
+    Record and replay of exchange traffic
+
+    Every REST response returned by a middleware and every websocket frame
+    received by the WebSocketManager can be appended to a compact binary log
+    and replayed later, without a network, through the same middleware API.
+
+    Log format
+    --------
+    MAGIC, then one record after the other:
+
+        <I  length of key + payload
+        <q  timestamp in nanoseconds (time.time_ns)
+        <B  kind (REST_RESPONSE or WS_MESSAGE)
+        <B  flags (FLAG_*)
+        <H  length of key
+        key      utf-8 (method call or exchange name)
+        payload  JSON, zlib compressed if FLAG_COMPRESSED
+
+    Vendor model objects (e.g. bfxapi Order) are recorded as dictionaries
+    tagged with their type (FLAG_OBJECTS) and replayed as RecordedObject,
+    so their attributes are read the same way.
+
+    Errors (FLAG_ERROR) are recorded with their class, kind, code and HTTP
+    status and raised again as the ReplayException of the same kind (e.g.
+    ReplayRateLimited), so retry logic branches on them as it does live.
+'''
+
+import asyncio
+import inspect
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from array import array
+from bisect import bisect_left
+from collections import deque, namedtuple
+from types import SimpleNamespace
+
+from .errors import EvoxError, exchangeErrors, kindOf
+from .jsonCodec import dumps, loads
+
+
+MAGIC = b'EVOXLOG1'
+HEADER = struct.Struct('<IqBBH')
+
+REST_RESPONSE = 0
+WS_MESSAGE = 1
+
+FLAG_COMPRESSED = 1
+FLAG_ERROR = 2
+FLAG_ASYNC = 4
+FLAG_PAGE = 8
+FLAG_END = 16
+FLAG_OBJECTS = 32
+
+OBJECT_KEY = '__object__'
+
+Record = namedtuple('Record', ['timestamp', 'kind', 'flags', 'key', 'payload'])
+
+
+class ReplayException(EvoxError):
+    pass
+
+
+REPLAY_ERRORS = exchangeErrors(ReplayException)
+KIND_NAMES = {kind.__name__: kind for kind in REPLAY_ERRORS}
+
+
+def callKey(method, args, kwargs):
+    '''
+        Key identifying a middleware call in the log.
+    '''
+    return f'{method}{dumps([list(args), sorted(kwargs.items())])}'
+
+
+def errorPayload(error):
+    '''
+        :returns: dictionary recorded for an error raised by a middleware
+    '''
+    return {
+        'error': getattr(error, 'message', None) or str(error),
+        'type': type(error).__name__,
+        'kind': kindOf(error).__name__,
+        'code': getattr(error, 'code', None),
+        'exchange': getattr(error, 'exchange', None),
+        'status': getattr(error, 'status', None),
+        'retryAfter': getattr(error, 'retryAfter', None),
+    }
+
+
+def replayError(payload):
+    '''
+        :returns: ReplayException of the recorded kind, with its code and status
+    '''
+    kind = KIND_NAMES.get(payload.get('kind'), EvoxError)
+    error = REPLAY_ERRORS[kind](payload['error'], code=payload.get('code'),
+                                exchange=payload.get('exchange'), status=payload.get('status'),
+                                retryAfter=payload.get('retryAfter'))
+    error.type = payload.get('type')
+    return error
+
+
+def rawPayload(record):
+    if record.flags & FLAG_COMPRESSED:
+        return zlib.decompress(record.payload)
+    return bytes(record.payload)
+
+
+class RecordedObject(SimpleNamespace):
+    '''
+        Vendor model object read from a traffic log
+    '''
+    pass
+
+
+def _decodeObjects(value):
+    if isinstance(value, list):
+        return [_decodeObjects(item) for item in value]
+    if isinstance(value, dict):
+        items = {key: _decodeObjects(item) for key, item in value.items()}
+        if items.pop(OBJECT_KEY, None) is None:
+            return items
+        return RecordedObject(**items)
+    return value
+
+
+def decodePayload(record):
+    payload = rawPayload(record)
+    if not payload:
+        return None
+    value = loads(payload)
+    if record.flags & FLAG_OBJECTS:
+        return _decodeObjects(value)
+    return value
+
+
+class TrafficRecorder(object):
+    '''
+        Append-only traffic log writer
+
+        Attributes
+        ------------
+        path : str
+            Log file, created if it does not exist
+
+        compress : bool
+            Compress every payload with zlib
+    '''
+
+    def __init__(self, path, compress=False, compressLevel=1):
+        self._compress = compress
+        self._compressLevel = compressLevel
+        self._lock = threading.Lock()
+        self._file = open(path, 'ab')
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def record(self, kind, key, payload, flags=0, timestamp=None):
+        '''
+            Append a record to the log.
+
+            :param kind: required - REST_RESPONSE or WS_MESSAGE
+            :type kind: int
+            :param key: required
+            :type key: str
+            :param payload: required - raw frame (str or bytes) or object serialized as JSON
+            :type payload: object
+        '''
+        if timestamp is None:
+            timestamp = time.time_ns()
+        if isinstance(payload, str):
+            payload = payload.encode()
+        elif not isinstance(payload, bytes):
+            objects = []
+
+            def encodeObject(obj):
+                if not hasattr(obj, '__dict__'):
+                    return str(obj)
+                objects.append(obj)
+                return {OBJECT_KEY: type(obj).__name__, **vars(obj)}
+
+            payload = dumps(payload, default=encodeObject).encode()
+            if objects:
+                flags |= FLAG_OBJECTS
+        if self._compress and payload:
+            payload = zlib.compress(payload, self._compressLevel)
+            flags |= FLAG_COMPRESSED
+
+        key = key.encode()
+        header = HEADER.pack(len(key) + len(payload), timestamp, kind, flags, len(key))
+        with self._lock:
+            self._file.write(header + key + payload)
+
+    def flush(self):
+        with self._lock:
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+    def wrap(self, middleware):
+        '''
+            :returns: RecordingMiddleware recording every call of the middleware
+        '''
+        return RecordingMiddleware(middleware, self)
+
+
+class RecordingMiddleware(object):
+    '''
+        Proxy recording the responses (and errors) of a middleware.
+        Coroutines, generators and async generators (paginated methods)
+        are recorded as they are consumed.
+    '''
+
+    def __init__(self, middleware, recorder):
+        self._middleware = middleware
+        self._recorder = recorder
+
+    def __getattr__(self, name):
+        attribute = getattr(self._middleware, name)
+        if name.startswith('_') or not inspect.ismethod(attribute):
+            return attribute
+        if inspect.iscoroutinefunction(attribute):
+            return self._wrapAsync(name, attribute)
+        return self._wrap(name, attribute)
+
+    def _record(self, key, payload, flags=0):
+        self._recorder.record(REST_RESPONSE, key, payload, flags)
+
+    def _wrap(self, name, method):
+        def call(*args, **kwargs):
+            key = callKey(name, args, kwargs)
+            try:
+                result = method(*args, **kwargs)
+            except Exception as error:
+                self._record(key, errorPayload(error), FLAG_ERROR)
+                raise
+            if inspect.isgenerator(result):
+                return self._pages(key, result)
+            if inspect.isasyncgen(result):
+                return self._asyncPages(key, result)
+            self._record(key, result)
+            return result
+        return call
+
+    def _wrapAsync(self, name, method):
+        async def call(*args, **kwargs):
+            key = callKey(name, args, kwargs)
+            try:
+                result = await method(*args, **kwargs)
+            except Exception as error:
+                self._record(key, errorPayload(error), FLAG_ASYNC | FLAG_ERROR)
+                raise
+            self._record(key, result, FLAG_ASYNC)
+            return result
+        return call
+
+    # END is also written when the consumer stops early (generator closed),
+    # only an error ends the pages without it
+
+    def _pages(self, key, pages):
+        failed = False
+        try:
+            for page in pages:
+                self._record(key, page, FLAG_PAGE)
+                yield page
+        except Exception as error:
+            failed = True
+            self._record(key, errorPayload(error), FLAG_PAGE | FLAG_ERROR)
+            raise
+        finally:
+            if not failed:
+                self._record(key, b'', FLAG_PAGE | FLAG_END)
+
+    async def _asyncPages(self, key, pages):
+        failed = False
+        try:
+            async for page in pages:
+                self._record(key, page, FLAG_PAGE | FLAG_ASYNC)
+                yield page
+        except Exception as error:
+            failed = True
+            self._record(key, errorPayload(error), FLAG_PAGE | FLAG_ASYNC | FLAG_ERROR)
+            raise
+        finally:
+            if not failed:
+                self._record(key, b'', FLAG_PAGE | FLAG_ASYNC | FLAG_END)
+
+
+class TrafficLog(object):
+    '''
+        Memory-mapped traffic log reader
+
+        The log is indexed in a single pass on open (offsets and timestamps
+        in compact arrays), so seeking by time is a binary search and the
+        payloads are only sliced and decoded when they are used.
+    '''
+
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        if size < len(MAGIC):
+            raise ReplayException(f'Invalid traffic log ({path}).')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(MAGIC)] != MAGIC:
+            raise ReplayException(f'Invalid traffic log ({path}).')
+
+        self._offsets = array('q')
+        self._timestamps = array('q')
+        offset = len(MAGIC)
+        unpack = HEADER.unpack_from
+        while offset + HEADER.size <= size:
+            length, timestamp, _, _, _ = unpack(self._map, offset)
+            if offset + HEADER.size + length > size:
+                # Truncated last record (recorder still writing or crashed)
+                break
+            self._offsets.append(offset)
+            self._timestamps.append(timestamp)
+            offset += HEADER.size + length
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    @property
+    def start(self):
+        return self._timestamps[0] if self._timestamps else None
+
+    @property
+    def end(self):
+        return self._timestamps[-1] if self._timestamps else None
+
+    def seek(self, timestamp):
+        '''
+            :returns: index of the first record at or after the timestamp (ns)
+        '''
+        return bisect_left(self._timestamps, timestamp)
+
+    def read(self, index):
+        offset = self._offsets[index]
+        length, timestamp, kind, flags, keyLength = HEADER.unpack_from(self._map, offset)
+        start = offset + HEADER.size
+        key = self._map[start:start + keyLength].decode()
+        payload = self._map[start + keyLength:start + length]
+        return Record(timestamp, kind, flags, key, payload)
+
+    def records(self, start=None, end=None, kind=None):
+        '''
+            Iterate over the records between two timestamps (ns).
+
+            :returns: generator of Record
+        '''
+        index = 0 if start is None else self.seek(start)
+        stop = len(self._offsets) if end is None else self.seek(end)
+        read = self.read
+        for index in range(index, stop):
+            record = read(index)
+            if kind is None or record.kind == kind:
+                yield record
+
+
+class TrafficReplayer(object):
+    '''
+        Replay of a traffic log
+
+        Attributes
+        ------------
+        path : str
+            Log written by TrafficRecorder
+
+        speed : float
+            1 replays in real time, N replays N times faster and
+            None (or 0) replays as fast as possible
+    '''
+
+    def __init__(self, path, speed=None):
+        self.log = TrafficLog(path)
+        self.speed = speed
+        self._calls = None
+
+    def close(self):
+        self.log.close()
+
+    def _delays(self, records):
+        origin = None
+        clock = None
+        for record in records:
+            if not self.speed:
+                yield 0.0, record
+                continue
+            if origin is None:
+                origin = record.timestamp
+                clock = time.monotonic()
+            due = clock + (record.timestamp - origin) / 1e9 / self.speed
+            yield due - time.monotonic(), record
+
+    def play(self, start=None, end=None, kind=WS_MESSAGE):
+        '''
+            Yield the records at the replay speed.
+
+            :returns: generator of Record
+        '''
+        for delay, record in self._delays(self.log.records(start, end, kind)):
+            if delay > 0:
+                time.sleep(delay)
+            yield record
+
+    async def playAsync(self, start=None, end=None, kind=WS_MESSAGE):
+        '''
+            Async version of play.
+
+            :returns: async generator of Record
+        '''
+        for delay, record in self._delays(self.log.records(start, end, kind)):
+            if delay > 0:
+                await asyncio.sleep(delay)
+            yield record
+
+    def _next(self, key):
+        if self._calls is None:
+            self._calls = {}
+            # Indexes in the whole log, websocket frames included
+            for index in range(len(self.log)):
+                record = self.log.read(index)
+                if record.kind == REST_RESPONSE:
+                    self._calls.setdefault(record.key, deque()).append(index)
+        indexes = self._calls.get(key)
+        if not indexes:
+            raise ReplayException(f'No recorded response for {key}.')
+        return self.log.read(indexes.popleft())
+
+    def middleware(self):
+        '''
+            :returns: ReplayMiddleware answering calls from the log
+        '''
+        return ReplayMiddleware(self)
+
+
+class ReplayMiddleware(object):
+    '''
+        Middleware stand-in answering every call with the next response
+        recorded for the same method and arguments. Recorded errors are
+        raised again as the ReplayException of their kind.
+    '''
+
+    def __init__(self, replayer):
+        self._replayer = replayer
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        def call(*args, **kwargs):
+            key = callKey(name, args, kwargs)
+            record = self._replayer._next(key)
+            if record.flags & FLAG_PAGE:
+                pages = self._pages(key, record)
+                return self._asyncPages(pages) if record.flags & FLAG_ASYNC else pages
+            if record.flags & FLAG_ASYNC:
+                return self._result(record)
+            return self._value(record)
+        return call
+
+    @staticmethod
+    def _value(record):
+        value = decodePayload(record)
+        if record.flags & FLAG_ERROR:
+            raise replayError(value)
+        return value
+
+    async def _result(self, record):
+        return self._value(record)
+
+    def _pages(self, key, record):
+        try:
+            while not record.flags & FLAG_END:
+                yield self._value(record)
+                record = self._replayer._next(key)
+        except GeneratorExit:
+            # Consumer stopped early: skip the rest of the recorded pages
+            while not record.flags & (FLAG_END | FLAG_ERROR):
+                try:
+                    record = self._replayer._next(key)
+                except ReplayException:
+                    break
+            raise
+
+    async def _asyncPages(self, pages):
+        try:
+            for page in pages:
+                yield page
+        finally:
+            pages.close()
+
+
+if __name__ == '__main__':
+    import tempfile
+
+    path = os.path.join(tempfile.mkdtemp(), 'traffic.log')
+    frame = '{"table":"quote","action":"insert","data":[{"symbol":"XBTUSD","bidPrice":9474.5,"askPrice":9475}]}'
+    count = 1000000
+
+    with TrafficRecorder(path) as recorder:
+        for _ in range(count):
+            recorder.record(WS_MESSAGE, 'bitmex', frame)
+
+    replayer = TrafficReplayer(path)
+    start = time.time()
+    replayed = sum(1 for _ in replayer.play())
+    elapsed = time.time() - start
+    print(f'{replayed} messages replayed in {elapsed:.2f}s '
+          f'({replayed / elapsed * 60 / 1e6:.1f}M messages/minute)')
@@ -0,0 +1,551 @@
+# coding=utf-8
+
+'''
+    Shared websocket session manager
+
+    Multiplexes many channel/symbol subscriptions over as few sockets as each
+    exchange allows, keeps the sockets alive with heartbeats and reconnects
+    with resubscribe and snapshot resync.
+
+    Subscriptions added in the same event loop iteration are sent in one
+    batch and control frames are paced to the exchange limit (Binance drops
+    a connection receiving more than 5 messages per second).
+
+    Official Documentation
+    # Binance: https://binance-docs.github.io/apidocs/spot/en/#websocket-market-streams
+    # Bitmex: https://www.bitmex.com/app/wsAPI
+    # Bitfinex: https://docs.bitfinex.com/docs/ws-general
+'''
+
+import asyncio
+import json
+
+import websockets
+
+from .errors import EvoxError
+from .jsonCodec import loads
+from .trafficRecorder import WS_MESSAGE, rawPayload
+
+
+class WebsocketException(EvoxError):
+    pass
+
+
+class BinanceStream(object):
+    '''
+        Binance combined stream protocol.
+        The server sends ping frames, answered by the websocket library.
+    '''
+    url = 'wss://stream.binance.com:9443/stream'
+    maxSubscriptions = 1024
+    heartbeat = None
+    batchSize = 200
+    # Limit of 5 incoming messages per second, with a margin
+    maxMessagesPerSecond = 4.0
+
+    def __init__(self):
+        self._requestId = 0
+
+    def reset(self):
+        pass
+
+    def topic(self, channel, symbol):
+        return f'{str(symbol).lower()}@{channel}'
+
+    def subscribeMessages(self, topics, subscribe=True):
+        method = 'SUBSCRIBE' if subscribe else 'UNSUBSCRIBE'
+        for index in range(0, len(topics), self.batchSize):
+            self._requestId += 1
+            yield json.dumps({'method': method,
+                              'params': topics[index:index + self.batchSize],
+                              'id': self._requestId})
+
+    def ping(self):
+        return None
+
+    def route(self, message):
+        if isinstance(message, dict) and 'stream' in message:
+            return ((message['stream'], message['data']),)
+        return ()
+
+
+class BitmexStream(object):
+    '''
+        Bitmex realtime protocol.
+        The client sends "ping" when the socket is idle and expects "pong".
+    '''
+    url = 'wss://ws.bitmex.com/realtime'
+    maxSubscriptions = None
+    heartbeat = 5.0
+    maxMessagesPerSecond = None
+
+    def reset(self):
+        pass
+
+    def topic(self, channel, symbol):
+        return f'{channel}:{symbol}'
+
+    def subscribeMessages(self, topics, subscribe=True):
+        yield json.dumps({'op': 'subscribe' if subscribe else 'unsubscribe',
+                          'args': list(topics)})
+
+    def ping(self):
+        return 'ping'
+
+    def route(self, message):
+        if not isinstance(message, dict):
+            return ()
+        table = message.get('table')
+        data = message.get('data')
+        if not table or not data:
+            return ()
+
+        symbol = data[0].get('symbol')
+        if all(row.get('symbol') == symbol for row in data):
+            return ((f'{table}:{symbol}', message),)
+
+        # A single message may carry rows of several subscribed symbols.
+        bySymbol = {}
+        for row in data:
+            bySymbol.setdefault(row.get('symbol'), []).append(row)
+        return tuple((f'{table}:{symbol}', dict(message, data=rows))
+                     for symbol, rows in bySymbol.items())
+
+
+class BitfinexStream(object):
+    '''
+        Bitfinex public v2 protocol.
+        Channels are identified by the chanId sent on subscription and
+        every channel receives a heartbeat every 15 seconds.
+        Candle channels are subscribed by key instead of symbol,
+        e.g. subscribe('bitfinex', 'candles', 'trade:1m:tBTCUSD').
+    '''
+    url = 'wss://api-pub.bitfinex.com/ws/2'
+    maxSubscriptions = 25
+    heartbeat = 15.0
+    maxMessagesPerSecond = None
+
+    def __init__(self):
+        self._channels = {}
+        self._topics = {}
+        self._cid = 0
+
+    def reset(self):
+        self._channels = {}
+        self._topics = {}
+
+    def topic(self, channel, symbol):
+        return f'{channel}:{symbol}'
+
+    def subscribeMessages(self, topics, subscribe=True):
+        for topic in topics:
+            if subscribe:
+                channel, symbol = topic.split(':', 1)
+                field = 'key' if channel == 'candles' else 'symbol'
+                yield json.dumps({'event': 'subscribe',
+                                  'channel': channel,
+                                  field: symbol})
+            elif topic in self._topics:
+                yield json.dumps({'event': 'unsubscribe',
+                                  'chanId': self._topics[topic]})
+
+    def ping(self):
+        self._cid += 1
+        return json.dumps({'event': 'ping', 'cid': self._cid})
+
+    def route(self, message):
+        if isinstance(message, dict):
+            if message.get('event') == 'subscribed':
+                # Candle channels answer with their key and no symbol
+                symbol = message.get('symbol', message.get('key'))
+                topic = f"{message['channel']}:{symbol}"
+                self._channels[message['chanId']] = topic
+                self._topics[topic] = message['chanId']
+            elif message.get('event') == 'unsubscribed':
+                topic = self._channels.pop(message.get('chanId'), None)
+                self._topics.pop(topic, None)
+            return ()
+
+        if len(message) < 2 or message[1] == 'hb':
+            return ()
+        topic = self._channels.get(message[0])
+        if topic is None:
+            return ()
+        return ((topic, message[1] if len(message) == 2 else message[1:]),)
+
+
+STREAM_PROFILES = {
+    'binance': BinanceStream,
+    'bitmex': BitmexStream,
+    'bitfinex': BitfinexStream,
+}
+
+
+class Subscription(object):
+    '''
+        A single channel/symbol subscription
+
+        Messages are buffered in a bounded queue. When the consumer falls
+        behind and the queue overflows, the buffered messages are dropped and
+        onResync is called so the consumer can rebuild its state from a
+        fresh snapshot instead of applying deltas with a gap.
+
+        Attributes
+        ------------
+        callback : callable
+            Called (or awaited) with every message, if sent
+
+        onResync : callable
+            Called (or awaited) after every (re)subscription and queue overflow
+    '''
+
+    def __init__(self, exchange, topic, callback=None, onResync=None, maxQueue=1000):
+        self.exchange = exchange
+        self.topic = topic
+        self.callback = callback
+        self.onResync = onResync
+        self.dropped = 0
+        self.resyncs = 0
+        self._queue = asyncio.Queue(maxsize=maxQueue)
+        self._consumer = None
+
+    def put(self, message):
+        try:
+            self._queue.put_nowait(message)
+        except asyncio.QueueFull:
+            while not self._queue.empty():
+                self._queue.get_nowait()
+                self.dropped += 1
+            self._queue.put_nowait(message)
+            self.resync()
+
+    def resync(self):
+        self.resyncs += 1
+        if self.onResync is None:
+            return
+        result = self.onResync(self)
+        if asyncio.iscoroutine(result):
+            asyncio.ensure_future(result)
+
+    async def get(self):
+        return await self._queue.get()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self._queue.get()
+
+    def start(self):
+        if self.callback is not None and self._consumer is None:
+            self._consumer = asyncio.ensure_future(self._consume())
+
+    def stop(self):
+        if self._consumer is not None:
+            self._consumer.cancel()
+            self._consumer = None
+
+    async def _consume(self):
+        while True:
+            message = await self._queue.get()
+            try:
+                result = self.callback(message)
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception as error:
+                print(f'Error handling message ({self.exchange} {self.topic}): {error}')
+
+
+class WebSocketSession(object):
+    '''
+        One socket carrying several subscriptions of an exchange
+
+        Subscribe and unsubscribe requests made while connected are queued
+        and sent together by a flush task, so subscribing to many topics at
+        once costs one frame per batch instead of one per topic.
+    '''
+
+    def __init__(self, exchange, recorder=None, maxReconnectDelay=60.0, reconnectDelay=1.0):
+        self.exchange = exchange
+        self.profile = STREAM_PROFILES[exchange]()
+        self.subscriptions = {}
+        self.reconnects = 0
+        self._recorder = recorder
+        self._reconnectDelay = reconnectDelay
+        self._maxReconnectDelay = maxReconnectDelay
+        self._socket = None
+        self._task = None
+        self._closed = False
+        # Topic: True to subscribe, False to unsubscribe (the last request wins)
+        self._pending = {}
+        self._flusher = None
+        self._nextSend = 0.0
+
+    @property
+    def connected(self):
+        return self._socket is not None
+
+    def hasCapacity(self):
+        limit = self.profile.maxSubscriptions
+        return limit is None or len(self.subscriptions) < limit
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def add(self, subscription):
+        self.subscriptions[subscription.topic] = subscription
+        subscription.start()
+        if self._socket is not None:
+            self._request(subscription.topic, True)
+
+    async def remove(self, subscription):
+        self.subscriptions.pop(subscription.topic, None)
+        subscription.stop()
+        if self._socket is not None:
+            self._request(subscription.topic, False)
+
+    def _request(self, topic, subscribe):
+        self._pending[topic] = subscribe
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.ensure_future(self._flush())
+
+    async def _flush(self):
+        # Let the subscriptions of the same loop iteration join the batch
+        await asyncio.sleep(0)
+        while self._pending and self._socket is not None:
+            pending, self._pending = self._pending, {}
+            subscribe = [topic for topic, flag in pending.items() if flag]
+            unsubscribe = [topic for topic, flag in pending.items() if not flag]
+            try:
+                if unsubscribe:
+                    await self._send(self.profile.subscribeMessages(unsubscribe, subscribe=False))
+                if subscribe:
+                    await self._send(self.profile.subscribeMessages(subscribe))
+            except Exception as error:
+                # The socket is closing: every subscription is sent again on reconnect
+                print(f'Websocket subscription error ({self.exchange}): {error}')
+                return
+
+    async def close(self):
+        self._closed = True
+        for subscription in self.subscriptions.values():
+            subscription.stop()
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _send(self, messages):
+        rate = self.profile.maxMessagesPerSecond
+        for message in messages:
+            if rate:
+                now = asyncio.get_running_loop().time()
+                wait = self._nextSend - now
+                self._nextSend = max(now, self._nextSend) + 1.0 / rate
+                if wait > 0:
+                    await asyncio.sleep(wait)
+            socket = self._socket
+            if socket is None:
+                raise WebsocketException('Not connected.')
+            await socket.send(message)
+
+    async def _run(self):
+        delay = self._reconnectDelay
+        while not self._closed:
+            try:
+                async with websockets.connect(self.profile.url) as socket:
+                    self._socket = socket
+                    self.profile.reset()
+                    delay = self._reconnectDelay
+                    # Every subscription is sent below
+                    self._pending = {}
+                    await self._send(self.profile.subscribeMessages(list(self.subscriptions)))
+                    for subscription in list(self.subscriptions.values()):
+                        subscription.resync()
+                    await self._receive(socket)
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                print(f'Websocket connection error ({self.exchange}): {error}')
+            finally:
+                self._socket = None
+
+            if self._closed:
+                break
+            self.reconnects += 1
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self._maxReconnectDelay)
+
+    async def _receive(self, socket):
+        heartbeat = self.profile.heartbeat
+        waiting = False
+        while True:
+            try:
+                if heartbeat is None:
+                    raw = await socket.recv()
+                else:
+                    raw = await asyncio.wait_for(socket.recv(), heartbeat)
+            except asyncio.TimeoutError:
+                if waiting:
+                    raise WebsocketException('Heartbeat timeout.')
+                ping = self.profile.ping()
+                if ping is not None:
+                    await self._send((ping,))
+                waiting = True
+                continue
+
+            waiting = False
+            self._dispatch(raw)
+
+    def _dispatch(self, raw):
+        if self._recorder is not None:
+            self._recorder.record(WS_MESSAGE, self.exchange, raw)
+        if raw == 'pong':
+            return
+        message = loads(raw)
+        for topic, payload in self.profile.route(message):
+            subscription = self.subscriptions.get(topic)
+            if subscription is not None:
+                subscription.put(payload)
+
+
+class WebSocketManager(object):
+    '''
+        Websocket session manager shared by the connectors
+
+        Attributes
+        ------------
+        maxQueue : int
+            Size of the bounded message queue of every subscription
+
+        recorder : TrafficRecorder
+            Records every frame received, if sent
+
+        offline : bool
+            Do not open sockets; messages are fed by replay
+    '''
+
+    def __init__(self, maxQueue=1000, recorder=None, offline=False):
+        self._maxQueue = maxQueue
+        self._recorder = recorder
+        self._offline = offline
+        self._sessions = {exchange: [] for exchange in STREAM_PROFILES}
+        self._profiles = {exchange: profile() for exchange, profile in STREAM_PROFILES.items()}
+
+    def _session(self, exchange):
+        for session in self._sessions[exchange]:
+            if session.hasCapacity():
+                return session
+        session = WebSocketSession(exchange, recorder=self._recorder)
+        self._sessions[exchange].append(session)
+        if not self._offline:
+            session.start()
+        return session
+
+    async def subscribe(self, exchange, channel, symbol, callback=None, onResync=None):
+        '''
+            Subscribe to a channel of a symbol.
+            Without a callback, consume the messages with "async for" over the subscription.
+
+            :param exchange: required - binance, bitmex or bitfinex
+            :type exchange: str
+            :param channel: required - e.g. depth (binance), orderBookL2_25 (bitmex), book (bitfinex)
+            :type channel: str
+            :param symbol: required
+            :type symbol: str
+            :param callback: -
+            :type callback: callable
+            :param onResync: -
+            :type onResync: callable
+
+            :returns: Subscription
+        '''
+        if exchange not in STREAM_PROFILES:
+            raise WebsocketException(f'Exchange not implemented ({exchange}).')
+
+        # Checked before a session (and its socket) is started
+        topic = self._profiles[exchange].topic(channel, symbol)
+        for session in self._sessions[exchange]:
+            if topic in session.subscriptions:
+                raise WebsocketException(f'Already subscribed ({exchange} {topic}).')
+
+        session = self._session(exchange)
+        subscription = Subscription(exchange, topic, callback=callback,
+                                    onResync=onResync, maxQueue=self._maxQueue)
+        await session.add(subscription)
+        return subscription
+
+    async def unsubscribe(self, subscription):
+        for session in self._sessions[subscription.exchange]:
+            if session.subscriptions.get(subscription.topic) is subscription:
+                await session.remove(subscription)
+                if not session.subscriptions:
+                    await session.close()
+                    self._sessions[subscription.exchange].remove(session)
+                return
+
+    async def close(self):
+        for sessions in self._sessions.values():
+            for session in sessions:
+                await session.close()
+            sessions.clear()
+
+    async def replay(self, replayer):
+        '''
+            Feed the frames of a traffic log to the subscriptions,
+            at the speed of the replayer.
+
+            :param replayer: required
+            :type replayer: TrafficReplayer
+        '''
+        profiles = {exchange: profile() for exchange, profile in STREAM_PROFILES.items()}
+        async for record in replayer.playAsync(kind=WS_MESSAGE):
+            exchange = record.key
+            raw = rawPayload(record)
+            if raw == b'pong':
+                continue
+            for topic, payload in profiles[exchange].route(loads(raw)):
+                for session in self._sessions[exchange]:
+                    subscription = session.subscriptions.get(topic)
+                    if subscription is not None:
+                        subscription.put(payload)
+                        break
+            # Let the consumers run between frames
+            await asyncio.sleep(0)
+
+    def stats(self):
+        '''
+            :returns: dictionary with sockets, subscriptions, dropped messages and reconnects by exchange
+        '''
+        stats = {}
+        for exchange, sessions in self._sessions.items():
+            subscriptions = [subscription for session in sessions
+                             for subscription in session.subscriptions.values()]
+            stats[exchange] = {
+                'sockets': len(sessions),
+                'subscriptions': len(subscriptions),
+                'dropped': sum(subscription.dropped for subscription in subscriptions),
+                'reconnects': sum(session.reconnects for session in sessions),
+            }
+        return stats
+
+
+if __name__ == '__main__':
+    manager = WebSocketManager()
+
+    async def run():
+        await manager.subscribe('binance', 'bookTicker', 'BTCUSDT', callback=print)
+        await manager.subscribe('bitmex', 'quote', 'XBTUSD', callback=print)
+        await manager.subscribe('bitfinex', 'ticker', 'tBTCUSD', callback=print)
+        await asyncio.sleep(10)
+        print(manager.stats())
+        await manager.close()
+
+    asyncio.get_event_loop().run_until_complete(run())
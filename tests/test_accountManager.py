@@ -0,0 +1,96 @@
+# coding=utf-8
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from evox.connectors.accountManager import (AccountException, AccountManager, PublicCache,
+                                            currentCredentials)
+
+
+class Middleware(object):
+
+    def fetchBalance(self):
+        return currentCredentials()[0]
+
+    async def fetchOpenOrders(self, symbol):
+        await asyncio.sleep(0)
+        return (symbol, currentCredentials()[0])
+
+
+def manager():
+    manager = AccountManager.__new__(AccountManager)
+    manager.middleware = Middleware()
+    manager.cache = None
+    manager._accounts = {}
+    manager._executor = ThreadPoolExecutor(max_workers=2)
+    manager.addAccount('main', 'key1', 'secret1')
+    manager.addAccount('sub', 'key2', 'secret2')
+    return manager
+
+
+def testCacheEvictsExpiredAndOldestEntries():
+    cache = PublicCache(ttl=60.0, maxSize=3)
+    for index in range(5):
+        cache.set(index, index)
+
+    assert len(cache) == 3
+    assert cache.get(0) is None
+    assert [cache.get(index) for index in (2, 3, 4)] == [2, 3, 4]
+
+    cache.ttl = 0.01
+    time.sleep(0.02)
+    cache.set('ticker', None)
+    assert len(cache) == 1
+
+
+def testCacheServesNoneResults():
+    calls = []
+
+    def fetchTicker(symbol):
+        calls.append(symbol)
+        return None
+
+    manager = AccountManager.__new__(AccountManager)
+    manager.cache = PublicCache(ttl=60.0)
+    cached = manager._cached('fetchTicker', fetchTicker)
+
+    assert cached('XBTUSD') is None
+    assert cached('XBTUSD') is None
+    assert calls == ['XBTUSD']
+
+
+def testUnhashableArgumentsAreNotCached():
+    calls = []
+
+    def fetchTicker(symbols):
+        calls.append(symbols)
+        return len(symbols)
+
+    manager = AccountManager.__new__(AccountManager)
+    manager.cache = PublicCache(ttl=60.0)
+    cached = manager._cached('fetchTicker', fetchTicker)
+
+    assert cached(['XBTUSD', 'ETHUSD']) == 2
+    assert cached(['XBTUSD', 'ETHUSD']) == 2
+    assert len(calls) == 2
+    assert len(manager.cache) == 0
+
+
+def testMapAsyncInARunningLoop():
+    accounts = manager()
+
+    async def run():
+        with pytest.raises(AccountException):
+            accounts.map('fetchOpenOrders', 'BTCUSD')
+        return (await accounts.mapAsync('fetchOpenOrders', 'BTCUSD'),
+                await accounts.mapAsync('fetchBalance', accounts=['sub']))
+
+    orders, balances = asyncio.run(run())
+
+    assert orders == {'main': ('BTCUSD', 'key1'), 'sub': ('BTCUSD', 'key2')}
+    assert balances == {'sub': 'key2'}
+    assert accounts.map('fetchOpenOrders', 'BTCUSD') == orders
+    accounts.close()
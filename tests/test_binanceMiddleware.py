@@ -0,0 +1,106 @@
+# coding=utf-8
+
+import itertools
+
+import pytest
+
+pytest.importorskip('binance')
+
+from evox.connectors.binanceMiddleware import BinanceException, BinanceMiddleware
+from evox.connectors.jsonCodec import BinanceKline
+from evox.connectors.riskEngine import RiskEngine
+from evox.connectors.tickerEngine import TickerEngine
+
+
+class FakeClient(object):
+    '''
+        python-binance client double answering cancel-replace requests
+    '''
+
+    def __init__(self):
+        self.posted = []
+        self.ids = itertools.count(101)
+
+    def get_order(self, symbol, orderId):
+        return {'symbol': symbol, 'orderId': orderId, 'side': 'BUY', 'price': '9475.00',
+                'origQty': '1.0', 'executedQty': '0.4', 'status': 'PARTIALLY_FILLED'}
+
+    def _post(self, path, signed, data):
+        assert path == 'order/cancelReplace'
+        self.posted.append(data)
+        return {'cancelResult': 'SUCCESS',
+                'newOrderResponse': {'symbol': data['symbol'], 'orderId': next(self.ids),
+                                     'side': data['side'], 'price': data['price'],
+                                     'origQty': str(data['quantity']), 'executedQty': '0',
+                                     'status': 'NEW'}}
+
+
+def testAmendOrderMovesTheRiskSlotToTheNewId():
+    engine = RiskEngine(maxOpenOrders=1)
+    client = FakeClient()
+    middleware = BinanceMiddleware(None, None, riskEngine=engine, client=client)
+    engine.onOrderAccepted('BTCUSDT', 28)
+
+    order = middleware.amendOrder(28, price='9480.00', symbol='BTCUSDT')
+
+    assert order['orderId'] == 101
+    # The remaining quantity is read from the order
+    assert client.posted[0]['quantity'] == pytest.approx(0.6)
+    assert client.posted[0]['cancelOrderId'] == 28
+    assert engine._symbol('BTCUSDT').orders == {'101'}
+
+
+def testAmendOrdersKeepsTheOrderOfTheAmendments():
+    engine = RiskEngine(maxOpenOrders=2)
+    middleware = BinanceMiddleware(None, None, riskEngine=engine, client=FakeClient())
+    engine.onOrderAccepted('BTCUSDT', 1)
+    engine.onOrderAccepted('BTCUSDT', 2)
+
+    results = middleware.amendOrders([{'orderId': 1, 'symbol': 'BTCUSDT', 'price': '9476.00'},
+                                      {'orderId': 2, 'price': '9477.00'},
+                                      {'orderId': 3, 'symbol': 'BTCUSDT', 'price': '9478.00'}])
+
+    assert isinstance(results[1], BinanceException)
+    assert [results[0]['price'], results[2]['price']] == ['9476.00', '9478.00']
+    # Order 2 was not replaced, 1 and 3 were
+    assert engine._symbol('BTCUSDT').openOrders == 3
+    assert '1' not in engine._symbol('BTCUSDT').orders
+
+
+def testRestTickerHasTheTickerEngineShape():
+    class TickerClient(object):
+
+        def get_ticker(self, symbol):
+            return {'symbol': symbol, 'priceChange': '165.50000000', 'priceChangePercent': '1.778',
+                    'weightedAvgPrice': '9402.30000000', 'lastPrice': '9475.50000000',
+                    'lastQty': '0.01000000', 'bidPrice': '9475.00000000', 'bidQty': '3.00000000',
+                    'askPrice': '9475.50000000', 'askQty': '1.00000000', 'openPrice': '9310.00000000',
+                    'highPrice': '9520.00000000', 'lowPrice': '9280.50000000',
+                    'volume': '48213.10000000', 'quoteVolume': '453311980.20000000',
+                    'openTime': 1591012800000, 'closeTime': 1591099200000, 'count': 812345}
+
+    ticker = BinanceMiddleware(None, None, client=TickerClient()).fetchTicker('BTCUSDT')
+    engine = TickerEngine()
+    engine.onTrade('BTCUSDT', 9475.0, 0.1)
+
+    assert set(ticker) == set(engine.ticker('BTCUSDT'))
+    assert ticker['lastPrice'] == 9475.5
+    assert ticker['spread'] == 0.5
+    # Closer to the ask, the bid is heavier
+    assert ticker['microPrice'] == pytest.approx(9475.375)
+    assert ticker['updateTime'] == 1591099200.0
+    assert ticker['stale'] is False
+
+
+def testTypedKlinesWithAPlainClient():
+    class KlinesClient(object):
+
+        def get_klines(self, symbol, interval, limit):
+            return [[1499040000000, '0.01634790', '0.80000000', '0.01575800', '0.01577100',
+                     '148976.11427815', 1499644799999, '2434.19055334', 308, '1756.87402397',
+                     '28.46694368', '0']]
+
+    kline, = BinanceMiddleware(None, None, client=KlinesClient()).fetchOHLCV('BNBBTC', '1d',
+                                                                             typed=True)
+    assert isinstance(kline, BinanceKline)
+    assert kline.trades == 308
@@ -0,0 +1,120 @@
+# coding=utf-8
+
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('bfxapi')
+
+from bfxapi.rest.bfx_rest import BfxRest
+
+from evox.connectors.bitfinexMiddleware import AsyncRateLimiter, BitfinexMiddleware
+from evox.connectors.jsonCodec import BitfinexCandle
+
+
+class FakeRest(BfxRest):
+    '''
+        Rest client double serving account trades, newest first
+    '''
+
+    def __init__(self, trades):
+        super().__init__(API_KEY='key', API_SECRET='secret')
+        self.trades = trades
+        self.requests = []
+
+    async def get_trades(self, start, end, symbol=None, limit=25):
+        self.requests.append((symbol, start, end, limit))
+        rows = [trade for trade in self.trades if (not start or trade.mts_create >= start)
+                and trade.mts_create <= end]
+        return rows[:limit]
+
+
+def trade(tradeId, mts):
+    return SimpleNamespace(id=tradeId, mts_create=mts)
+
+
+def testMyTradesSharingAMillisecondAreAllFetched():
+    async def collect():
+        # bfxapi clients take the running loop
+        rest = FakeRest([trade(7, 700), trade(6, 500), trade(5, 500), trade(4, 500),
+                         trade(2, 200), trade(1, 100)])
+        middleware = BitfinexMiddleware(client=rest)
+        return rest, [page async for page in middleware.fetchMyTrades('BTCUSD', end=1000, limit=3)]
+
+    rest, pages = asyncio.run(collect())
+    assert [item.id for page in pages for item in page] == [7, 6, 5, 4, 2, 1]
+    assert rest.requests[0] == ('tBTCUSD', '', 1000, 3)
+    assert [request[2] for request in rest.requests] == [1000, 500, 499]
+
+
+def testTypedCandlesWithAPlainRestClient():
+    class CandlesRest(FakeRest):
+
+        async def get_public_candles(self, symbol, start, end, section='hist', tf='1m',
+                                     limit=100, sort=-1):
+            return [[1499040000000, 8744.9, 8756.1, 8761.0, 8730.5, 123.45]]
+
+    async def fetch():
+        # bfxapi clients take the running loop
+        middleware = BitfinexMiddleware(client=CandlesRest([]))
+        return await middleware.fetchOHLCV('BTCUSD', '1m', typed=True)
+
+    candle, = asyncio.run(fetch())
+
+    assert isinstance(candle, BitfinexCandle)
+    assert candle.close == 8756.1
+
+
+def testRateLimiterSpacesAndBoundsRequests():
+    limiter = AsyncRateLimiter(requestsPerMinute=1200, concurrency=2)
+    started = []
+    inFlight = [0, 0]
+
+    async def request():
+        async with limiter:
+            started.append(time.monotonic())
+            inFlight[0] += 1
+            inFlight[1] = max(inFlight)
+            await asyncio.sleep(0.1)
+            inFlight[0] -= 1
+
+    async def run():
+        await asyncio.gather(*(request() for _ in range(5)))
+
+    asyncio.run(run())
+
+    gaps = [later - earlier for earlier, later in zip(started, started[1:])]
+    assert all(gap >= limiter.interval * 0.9 for gap in gaps)
+    assert inFlight[1] == 2
+    # A new event loop gets new primitives
+    asyncio.run(run())
+    assert len(started) == 10
+
+
+def testRangeChunksAreStitchedOldestFirstWithoutDuplicates():
+    minute = 60000
+
+    class CandlesRest(FakeRest):
+
+        async def get_public_candles(self, symbol, start, end, section='hist', tf='1m',
+                                     limit=100, sort=-1):
+            self.requests.append((start, end, limit))
+            # The exchange also sends the candle after the end of the chunk
+            rows = [[mts, 1.0, 1.0, 1.0, 1.0, 1.0] for mts in range(start, end + minute + 1, minute)]
+            # Chunks complete in any order
+            await asyncio.sleep(0.01 if start == 0 else 0)
+            return rows
+
+    async def fetch():
+        rest = CandlesRest([])
+        middleware = BitfinexMiddleware(client=rest, requestsPerMinute=60000)
+        candles = await middleware.fetchOHLCVRange('BTCUSD', '1m', 0, 7 * minute, chunk=3)
+        return rest, candles
+
+    rest, candles = asyncio.run(fetch())
+
+    assert sorted(rest.requests) == [(0, 3 * minute - 1, '3'), (3 * minute, 6 * minute - 1, '3'),
+                                     (6 * minute, 7 * minute, '3')]
+    assert [candle[0] for candle in candles] == [mts * minute for mts in range(9)]
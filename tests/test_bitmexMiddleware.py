@@ -0,0 +1,56 @@
+# coding=utf-8
+
+import pytest
+
+pytest.importorskip('bitmex')
+pytest.importorskip('requests')
+
+from evox.connectors.bitmexMiddleware import BitmexMiddleware
+from evox.connectors.riskEngine import RiskEngine, RiskException
+
+
+class FakeTransport(object):
+    '''
+        Lean transport double with one open order
+    '''
+
+    def __init__(self):
+        self.amended = []
+
+    def orders(self, filter=None, **kwargs):
+        return [{'orderID': filter['orderID'], 'symbol': 'XBTUSD', 'side': 'Buy',
+                 'orderQty': 9000, 'price': 9000.0, 'ordStatus': 'New'}]
+
+    def amendOrder(self, **fields):
+        self.amended.append(fields)
+        return dict(fields, symbol='XBTUSD', ordStatus='New')
+
+
+def middleware(engine):
+    middleware = BitmexMiddleware(lean=True, api_key='key', api_secret='secret', riskEngine=engine)
+    middleware._transport = FakeTransport()
+    return middleware
+
+
+def testAmendOrderIsCheckedWithTheOrderFields():
+    engine = RiskEngine(maxNotional=1.0)
+    engine.updatePrice('XBTUSD', 9000.0)
+    bitmex = middleware(engine)
+
+    bitmex.amendOrder('a1', price=9005.0)
+    # 9000 contracts at 8000 are worth more than 1 XBT
+    with pytest.raises(RiskException):
+        bitmex.amendOrder('a1', price=8000.0)
+    assert bitmex.transport.amended == [{'orderID': 'a1', 'price': 9005.0}]
+
+
+def testAmendOrdersReturnsTheErrors():
+    engine = RiskEngine(maxNotional=1.0)
+    engine.updatePrice('XBTUSD', 9000.0)
+    bitmex = middleware(engine)
+
+    results = bitmex.amendOrders([{'orderId': 'a1', 'quantity': 8000},
+                                  {'orderId': 'a2', 'quantity': 20000}])
+
+    assert results[0]['orderQty'] == 8000
+    assert isinstance(results[1], RiskException)
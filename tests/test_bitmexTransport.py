@@ -0,0 +1,70 @@
+# coding=utf-8
+
+import pytest
+
+pytest.importorskip('requests')
+
+from evox.connectors.accountManager import _credentials
+from evox.connectors.bitmexTransport import BitmexBucket, BitmexTransport
+from evox.connectors.errors import InsufficientFunds
+
+
+class Response(object):
+    status_code = 200
+    headers = {}
+    content = b'[]'
+
+
+class Rejected(Response):
+    status_code = 400
+    content = (b'{"error": {"message": "Account has insufficient Available Balance, '
+               b'0.01 XBT required", "name": "ValidationError"}}')
+    text = content.decode()
+
+
+class Session(object):
+
+    def __init__(self, response=Response):
+        self.headers = {}
+        self.sent = []
+        self.response = response
+
+    def request(self, verb, url, data=None, headers=None, timeout=None):
+        self.sent.append(headers)
+        return self.response()
+
+
+def testTransportKeyComesBeforeTheAccountKey():
+    own = BitmexTransport(key='own', secret='s', session=Session())
+    shared = BitmexTransport(session=Session())
+
+    # Call of an AccountManager account
+    token = _credentials.set(('account', 'secret'))
+    try:
+        own.orders()
+        shared.orders()
+    finally:
+        _credentials.reset(token)
+
+    assert own.session.sent[0]['api-key'] == 'own'
+    assert shared.session.sent[0]['api-key'] == 'account'
+
+
+def testRejectionsAreClassifiedByMessage():
+    transport = BitmexTransport(key='own', secret='s', session=Session(Rejected))
+
+    with pytest.raises(InsufficientFunds) as error:
+        transport.orders()
+    assert error.value.status == 400
+
+
+def testTypedBucketsAreDecodedFromTheRawBody():
+    class Buckets(Response):
+        content = (b'[{"timestamp":"2020-06-01T12:00:00.000Z","symbol":"XBTUSD","open":9475.5,'
+                   b'"high":9480,"low":9470,"close":9478.5,"trades":12,"volume":15000}]')
+
+    transport = BitmexTransport(session=Session(Buckets))
+    bucket, = transport.bucketedTrades('XBTUSD', '1m', count=1, typed=True)
+
+    assert isinstance(bucket, BitmexBucket)
+    assert bucket.close == 9478.5 and bucket.turnover is None
@@ -0,0 +1,110 @@
+# coding=utf-8
+
+import pytest
+
+from evox.connectors.consolidatedOrderBook import (ASK, BID, ConsolidatedOrderBook,
+                                                   OrderBookException, parseBinanceBook,
+                                                   parseBitfinexBook, parseBitmexBook)
+
+
+# Snapshots and level updates as recorded from the REST and stream feeds
+BINANCE_SNAPSHOT = {'bids': [['9474.10', '1.5'], ['9474.00', '3.0']],
+                    'asks': [['9474.20', '0.8'], ['9475.00', '2.0']]}
+BITMEX_SNAPSHOT = [{'side': 'Sell', 'size': 9475, 'price': 9475.0},
+                   {'side': 'Buy', 'size': 18949, 'price': 9474.5}]
+BITFINEX_SNAPSHOT = [[9474.3, 2, 0.5], [9474.4, 1, -0.25]]
+FEED = [('binance', BID, '9474.10', '0'),
+        ('binance', BID, '9474.05', '0.7'),
+        ('bitfinex', ASK, 9474.4, 0),
+        ('bitmex', ASK, 9475.0, 4737.5)]
+
+
+def loadedBook(fees=None):
+    book = ConsolidatedOrderBook(fees, symbols={'bitmex': 'XBTUSD'})
+    book.loadSnapshot('binance', *parseBinanceBook(BINANCE_SNAPSHOT))
+    book.loadSnapshot('bitmex', *parseBitmexBook(BITMEX_SNAPSHOT))
+    book.loadSnapshot('bitfinex', *parseBitfinexBook(BITFINEX_SNAPSHOT))
+    return book
+
+
+def testSnapshotsMergeWithVenueAttribution():
+    book = loadedBook()
+
+    assert book.bestBid() == (9474.5, {'bitmex': (9474.5, pytest.approx(2.0))})
+    assert book.bestAsk() == (9474.2, {'binance': (9474.2, 0.8)})
+    assert book.spread() == pytest.approx(-0.3)
+
+
+def testBitmexContractsAreBaseQuantities():
+    book = loadedBook()
+
+    assert book.depthAt(ASK, 9475.0, venue='bitmex') == pytest.approx(1.0)
+    # Level total of Binance BTC and Bitmex contracts, in BTC
+    assert book.depthAt(ASK, 9475.0) == pytest.approx(3.0)
+    assert book.toVenue('bitmex', 9475.0, 1.0) == pytest.approx(9475.0)
+
+
+def testFeedUpdates():
+    book = loadedBook()
+    for venue, side, price, quantity in FEED:
+        book.update(venue, side, price, quantity)
+
+    assert book.depthAt(BID, 9474.1, venue='binance') == 0.0
+    assert book.depthAt(BID, 9474.05, venue='binance') == 0.7
+    assert book.depthAt(ASK, 9474.4, venue='bitfinex') == 0.0
+    assert book.depthAt(ASK, 9475.0, venue='bitmex') == pytest.approx(0.5)
+
+
+def testDepthAtUnknownVenueHasNoSideEffect():
+    book = loadedBook()
+
+    assert book.depthAt(BID, 9474.1, venue='kraken') == 0.0
+    assert 'kraken' not in book.venues
+
+
+def testFeesRankLevels():
+    book = loadedBook(fees={'binance': 0.001})
+
+    adjusted, level = book.bestAsk()
+    assert 'bitfinex' in level
+    book.setFee('bitfinex', 0.002)
+    assert book.depthAt(ASK, 9474.4, venue='bitfinex') == 0.25
+    assert 'bitfinex' not in book.bestAsk()[1]
+
+
+def testClearVenue():
+    book = loadedBook()
+    book.clear('bitmex')
+
+    assert 'bitmex' not in book.venues
+    assert book.bestBid() == (9474.3, {'bitfinex': (9474.3, 0.5)})
+
+
+def testInvalidSide():
+    with pytest.raises(OrderBookException):
+        ConsolidatedOrderBook().update('binance', 'middle', 1.0, 1.0)
+
+
+def testContractsAreSpecifiedBySymbol():
+    # Linear contract of 0.01 base asset
+    book = ConsolidatedOrderBook(contracts={'bitmex': {'ETHUSD': (0.01, False)}},
+                                 symbols={'bitmex': 'ETHUSD'})
+    book.loadSnapshot('bitmex', [], [(250.0, 100)])
+
+    assert book.depthAt(ASK, 250.0, venue='bitmex') == pytest.approx(1.0)
+    assert book.contracts == {'bitmex': (0.01, False)}
+
+
+def testContractVenueWithoutSpecificationIsRejected():
+    with pytest.raises(OrderBookException):
+        ConsolidatedOrderBook().update('bitmex', ASK, 250.0, 100)
+    with pytest.raises(OrderBookException):
+        ConsolidatedOrderBook(symbols={'bitmex': 'ETHUSD'}).update('bitmex', ASK, 250.0, 100)
+
+
+def testRawBitfinexBookIsSummedByPrice():
+    bids, asks = parseBitfinexBook([[101, 9474.3, 0.2], [102, 9474.3, 0.3],
+                                    [103, 9474.4, -0.25]], precision='R0')
+
+    assert bids == [(9474.3, 0.5)]
+    assert asks == [(9474.4, 0.25)]
@@ -0,0 +1,70 @@
+# coding=utf-8
+
+from evox.connectors.errors import (ClockDrift, EvoxError, InsufficientFunds, InvalidOrder, Transient,
+                                    exchangeErrors, isRetryable, wrap)
+
+
+class BinanceError(Exception):
+    # python-binance BinanceAPIException shape
+
+    def __init__(self, code, message, status_code=400):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+        self.status_code = status_code
+
+
+class VenueException(EvoxError):
+    pass
+
+
+ERRORS = exchangeErrors(VenueException)
+
+
+def testNewOrderRejectedIsInvalidOrder():
+    for message in ('Order would immediately match and take.',
+                    'Market is closed.',
+                    'Order cancelled due to self-trade prevention.'):
+        error = wrap(BinanceError(-2010, message), 'binance', ERRORS)
+        assert type(error) is ERRORS[InvalidOrder]
+
+
+def testNewOrderRejectedForBalanceIsInsufficientFunds():
+    error = wrap(BinanceError(-2010, 'Account has insufficient balance for requested action.'),
+                 'binance', ERRORS)
+    assert isinstance(error, InsufficientFunds)
+    assert error.code == -2010
+
+
+def testInvalidTimestampIsNotRetryable():
+    error = wrap(BinanceError(-1021, 'Timestamp for this request was 1000ms ahead of the server\'s time.'),
+                 'binance', ERRORS)
+    assert isinstance(error, ClockDrift)
+    assert not isRetryable(error)
+
+
+class HTTPError(Exception):
+    # bravado HTTPError shape: the status and the response body in the message
+
+    def __init__(self, status_code, message):
+        super().__init__(f'{status_code} Bad Request: {message}')
+        self.status_code = status_code
+
+
+def testBitmexBalanceRejectionIsInsufficientFunds():
+    error = wrap(HTTPError(400, "{'error': {'message': 'Account has insufficient Available Balance, "
+                                "0.01 XBT required', 'name': 'ValidationError'}}"),
+                 'bitmex', ERRORS)
+    assert isinstance(error, InsufficientFunds)
+    assert error.status == 400
+
+
+def testBitmexInvalidPriceAndQuantityAreInvalidOrders():
+    for message in ('Invalid price tickSize', 'Invalid orderQty'):
+        error = wrap(HTTPError(400, message), 'bitmex', ERRORS)
+        assert type(error) is ERRORS[InvalidOrder]
+
+
+def testBitmexOtherRejectionsKeepTheStatusKind():
+    assert type(wrap(HTTPError(400, 'Something else'), 'bitmex', ERRORS)) is VenueException
+    assert type(wrap(HTTPError(503, 'Invalid price'), 'bitmex', ERRORS)) is ERRORS[Transient]
@@ -0,0 +1,44 @@
+# coding=utf-8
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from evox.connectors.indicators import ATR, CLOSE, EMA, RSI, atr, ema, rsi
+
+
+def candles(scale, count=10000, seed=7):
+    # Random walk OHLCV array, columns TIME, OPEN, HIGH, LOW, CLOSE, VOLUME.
+    # Longer than a recursion block, so the block boundaries are crossed.
+    random = np.random.default_rng(seed)
+    close = scale * np.exp(np.cumsum(random.normal(0.0, 0.01, count)))
+    spread = close * random.uniform(0.001, 0.01, count)
+    times = np.arange(count) * 60000.0
+    return np.column_stack((times, close, close + spread, close - spread, close,
+                            random.uniform(1.0, 10.0, count)))
+
+
+def streamed(indicator, array):
+    return np.array([np.nan if value is None else value
+                     for value in (indicator.update(candle) for candle in array)])
+
+
+@pytest.mark.parametrize('scale', [9475.0, 1.4e9, 1e12])
+def testVectorizedMatchesStreaming(scale):
+    array = candles(scale)
+    high, low, close = array[:, 2], array[:, 3], array[:, CLOSE]
+
+    for vectorized, indicator in ((ema(close, 20), EMA(20)),
+                                  (ema(close, 200), EMA(200)),
+                                  (rsi(close, 14), RSI(14)),
+                                  (atr(high, low, close, 14), ATR(14))):
+        assert np.isfinite(vectorized[-1])
+        np.testing.assert_allclose(vectorized, streamed(indicator, array), rtol=1e-9, equal_nan=True)
+
+
+def testLoadThenUpdate():
+    array = candles(1.4e9)
+    indicator = EMA(20)
+    indicator.load(array[:-1])
+
+    assert indicator.update(array[-1]) == pytest.approx(ema(array[:, CLOSE], 20)[-1], rel=1e-12)
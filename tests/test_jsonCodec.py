@@ -0,0 +1,63 @@
+# coding=utf-8
+
+from typing import NamedTuple, Optional
+
+import pytest
+
+from evox.connectors import jsonCodec
+from evox.connectors.jsonCodec import BinanceKline, BitfinexCandle, decodeList, dumps, loads
+
+
+class Bucket(NamedTuple):
+    # Some of the BitmexBucket fields
+    timestamp: str
+    symbol: str
+    open: Optional[float]
+    close: Optional[float]
+    trades: int
+    volume: int
+
+
+KLINES = (b'[[1499040000000,"0.01634790","0.80000000","0.01575800","0.01577100",'
+          b'"148976.11427815",1499644799999,"2434.19055334",308,"1756.87402397",'
+          b'"28.46694368","0"]]')
+BUCKETS = (b'[{"timestamp":"2020-06-01T12:00:00.000Z","symbol":"XBTUSD","open":9475.5,'
+           b'"high":9480,"low":9470,"close":9478.5,"trades":12,"volume":15000,"vwap":9476.1,'
+           b'"lastSize":100,"turnover":158295000,"homeNotional":1.58,"foreignNotional":15000,'
+           b'"new":1}]')
+
+
+@pytest.fixture(params=['installed', 'json'])
+def backend(request, monkeypatch):
+    # Every backend installed, then the standard library fallback
+    if request.param == 'json':
+        monkeypatch.setattr(jsonCodec, 'msgspec', None)
+        monkeypatch.setattr(jsonCodec, 'loads', jsonCodec.json.loads)
+    return request.param
+
+
+def testArraysDecodeIntoRows(backend):
+    kline, = decodeList(KLINES, BinanceKline)
+    assert kline == BinanceKline(1499040000000, '0.01634790', '0.80000000', '0.01575800',
+                                 '0.01577100', '148976.11427815', 1499644799999,
+                                 '2434.19055334', 308, '1756.87402397', '28.46694368', '0')
+
+    candle, = decodeList(b'[[1499040000000,8744.9,8756.1,8761,8730.5,123.45]]', BitfinexCandle)
+    assert candle.close == 8756.1 and candle.high == 8761
+
+
+def testObjectsDecodeByField(backend):
+    bucket, = decodeList(BUCKETS, Bucket, objects=True)
+    assert isinstance(bucket, Bucket)
+    assert bucket.close == 9478.5 and bucket.trades == 12
+    # Unknown keys are dropped, missing ones are None
+    bucket, = decodeList(b'[{"timestamp":"2020-06-01T12:00:00.000Z","symbol":"XBTUSD"}]',
+                         Bucket, objects=True)
+    assert bucket.open is None and bucket.volume is None
+
+
+def testDumpsIsCompactAndRoundTrips():
+    payload = {'symbol': 'BTCUSDT', 'price': 9475.5, 'ids': [1, 2]}
+
+    assert ' ' not in dumps(payload)
+    assert loads(dumps(payload)) == payload
@@ -0,0 +1,81 @@
+# coding=utf-8
+
+import time
+
+from evox.connectors.orderStore import OrderStore, StatefulMiddleware
+from evox.connectors.paperExchange import PaperExchange
+
+
+def restOrder(orderId, status='NEW', executedQty='0'):
+    return {'symbol': 'BTCUSDT', 'orderId': orderId, 'side': 'BUY', 'price': '9475.00',
+            'origQty': '1.0', 'executedQty': executedQty, 'status': status}
+
+
+def testReconcileAppliesTheDifferences():
+    store = OrderStore()
+    store.applyOrder(restOrder(1))
+    store.applyOrder(restOrder(2))
+
+    diff = store.reconcile([restOrder(2, 'PARTIALLY_FILLED', '0.5'), restOrder(3)])
+
+    assert diff == {'added': ['3'], 'changed': ['2'], 'removed': ['1'], 'balances': []}
+    assert sorted(order['orderId'] for order in store.openOrders('BTCUSDT')) == [2, 3]
+
+
+def testReconcileKeepsOrdersTrackedAfterTheFetch():
+    store = OrderStore()
+    store.applyOrder(restOrder(1))
+    since = time.monotonic()
+    # Accepted while the open orders were requested
+    store.trackNew(2, 'BTCUSDT', 'buy', 1.0, 9475.0)
+    store.applyOrder(restOrder(1, 'PARTIALLY_FILLED', '0.5'))
+
+    diff = store.reconcile([restOrder(1)], since=since)
+
+    assert diff == {'added': [], 'changed': [], 'removed': [], 'balances': []}
+    assert {order['orderId']: order['status'] for order in store.openOrders()} == \
+        {1: 'PARTIALLY_FILLED', 2: 'PENDING_NEW'}
+
+
+def testStatefulReconcileRacingAnOrder():
+    class Middleware(object):
+
+        def __init__(self):
+            self.stateful = None
+
+        def fetchOpenOrders(self, symbol=None):
+            # Snapshot taken before the order below reaches the exchange
+            self.stateful.createLimitOrder('BTCUSDT', 'buy', 1.0, 9470.0)
+            return []
+
+        def createLimitOrder(self, symbol, side, quantity, price=None):
+            return 7
+
+        def fetchBalance(self):
+            return []
+
+    middleware = Middleware()
+    stateful = middleware.stateful = StatefulMiddleware(middleware)
+
+    stateful.reconcile()
+    assert [order['orderId'] for order in stateful.fetchOpenOrders()] == [7]
+
+
+def testMarketOrdersAreNotTrackedAsOpen():
+    exchange = PaperExchange()
+    exchange.addMarket('BTCUSDT', 'BTC', 'USDT')
+    maker = exchange.createAccount({'BTC': 1})
+    stateful = StatefulMiddleware(exchange.createAccount({'USDT': 100000}))
+    maker.createLimitOrder('BTCUSDT', 'sell', 0.5, 9475.0)
+
+    stateful.createMarketOrder('BTCUSDT', 'buy', 0.2)
+    stateful.createLimitOrder('BTCUSDT', 'buy', 0.2)
+
+    assert stateful.fetchOpenOrders() == []
+
+
+def testBalancesAreSeededOnConstruction():
+    exchange = PaperExchange()
+    stateful = StatefulMiddleware(exchange.createAccount({'USDT': 100000}))
+
+    assert stateful.fetchBalance() == [{'asset': 'USDT', 'free': '100000.0', 'locked': '0.0'}]
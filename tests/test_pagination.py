@@ -0,0 +1,110 @@
+# coding=utf-8
+
+import asyncio
+
+import pytest
+
+from evox.connectors.pagination import (EndCursor, apaginate, idCursor, offsetCursor,
+                                        paginate, windowPage)
+
+
+DAY = 24 * 60 * 60 * 1000
+
+
+def trades(first, last):
+    return [{'id': index, 'time': index * 1000} for index in range(first, last)]
+
+
+class IdHistory(object):
+    '''
+        Binance-like history: fromId pages and startTime pages covering 24 hours
+    '''
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.requests = []
+
+    def fetchPage(self, cursor, limit=3):
+        self.requests.append(dict(cursor))
+        if 'startTime' in cursor:
+            rows = [row for row in self.rows
+                    if cursor['startTime'] <= row['time'] < cursor['startTime'] + DAY]
+        else:
+            rows = [row for row in self.rows if row['id'] >= cursor['fromId']]
+        return rows[:limit]
+
+
+@pytest.mark.parametrize('prefetch', [False, True])
+def testPaginateFollowsIdCursor(prefetch):
+    history = IdHistory(trades(0, 8))
+    pages = list(paginate(history.fetchPage, {'fromId': 0}, idCursor('id', 'fromId', 3),
+                          prefetch=prefetch))
+
+    assert [[row['id'] for row in page] for page in pages] == [[0, 1, 2], [3, 4, 5], [6, 7]]
+
+
+@pytest.mark.parametrize('prefetch', [False, True])
+def testApaginateMatchesPaginate(prefetch):
+    history = IdHistory(trades(0, 7))
+
+    async def collect():
+        return [page async for page in apaginate(history.fetchPage, {'fromId': 0},
+                                                 idCursor('id', 'fromId', 3), prefetch=prefetch)]
+
+    pages = asyncio.run(collect())
+    assert [row['id'] for page in pages for row in page] == list(range(7))
+
+
+def testEmptyWindowsAreSkipped():
+    # Nothing on days 0 to 2, then trades on days 3 and 4
+    rows = [{'id': 10, 'time': 3 * DAY + 5}, {'id': 11, 'time': 3 * DAY + 9}, {'id': 12, 'time': 4 * DAY}]
+    history = IdHistory(rows)
+    now = 10 * DAY / 1000.0
+
+    def fetchPage(cursor):
+        return windowPage(history.fetchPage, cursor, DAY, clock=lambda: now)
+
+    pages = list(paginate(fetchPage, {'startTime': 0}, idCursor('id', 'fromId', 3)))
+    assert [row['id'] for page in pages for row in page] == [10, 11, 12]
+    assert history.requests[:5] == [{'startTime': 0}, {'startTime': DAY}, {'startTime': 2 * DAY},
+                                    {'startTime': 3 * DAY}, {'fromId': 12}]
+
+
+def testEmptyWindowsEndAtNow():
+    history = IdHistory([])
+    page = windowPage(history.fetchPage, {'startTime': 0}, DAY, clock=lambda: 2.5 * DAY / 1000.0)
+
+    assert page == []
+    assert history.requests == [{'startTime': 0}, {'startTime': DAY}, {'startTime': 2 * DAY}]
+
+
+def testOffsetCursor():
+    rows = list(range(7))
+    pages = list(paginate(lambda start: rows[start:start + 3], 0, offsetCursor(3)))
+
+    assert pages == [[0, 1, 2], [3, 4, 5], [6]]
+
+
+def testEndCursorKeepsRowsOfTheSameMillisecond():
+    # Newest first; rows 6 to 4 share a millisecond cut by the page limit
+    rows = [(7, 700), (6, 500), (5, 500), (4, 500), (2, 200), (1, 100)]
+    cursor = EndCursor(3, lambda row: row[1], lambda row: row[0])
+    ends = []
+
+    def fetchPage(end):
+        ends.append(end)
+        return cursor.fresh([row for row in rows if row[1] <= end][:3])
+
+    pages = list(paginate(fetchPage, 1000, cursor))
+    assert [row[0] for page in pages for row in page] == [7, 6, 5, 4, 2, 1]
+    assert ends == [1000, 500, 499]
+
+
+def testEndCursorLeavesAFullMillisecond():
+    # More rows in one millisecond than a page: the history goes on before it
+    rows = [(index, 500) for index in range(6, 1, -1)] + [(1, 100)]
+    cursor = EndCursor(3, lambda row: row[1], lambda row: row[0])
+    pages = list(paginate(lambda end: cursor.fresh([row for row in rows if row[1] <= end][:3]),
+                          1000, cursor))
+
+    assert [row[0] for page in pages for row in page] == [6, 5, 4, 1]
@@ -0,0 +1,105 @@
+# coding=utf-8
+
+import threading
+
+import pytest
+
+from evox.connectors.errors import InsufficientFunds, InvalidOrder
+from evox.connectors.paperExchange import PaperExchange
+
+
+def balances(middleware):
+    return {balance['asset']: (float(balance['free']), float(balance['locked']))
+            for balance in middleware.fetchBalance()}
+
+
+def paperExchange(fee=0.0):
+    exchange = PaperExchange(fee=fee)
+    exchange.addMarket('BTCUSDT', 'BTC', 'USDT')
+    return exchange
+
+
+def testAccountsMatchWithPriceTimePriority():
+    exchange = paperExchange()
+    first = exchange.createAccount({'BTC': 1})
+    second = exchange.createAccount({'BTC': 1})
+    taker = exchange.createAccount({'USDT': 100000})
+
+    first.createLimitOrder('BTCUSDT', 'sell', 0.5, 9475.0)
+    second.createLimitOrder('BTCUSDT', 'sell', 0.5, 9475.0)
+    taker.createMarketOrder('BTCUSDT', 'buy', 0.6)
+
+    assert first.fetchOpenOrders() == []
+    assert float(second.fetchOpenOrders()[0]['executedQty']) == pytest.approx(0.1)
+    assert balances(taker)['BTC'] == (pytest.approx(0.6), 0.0)
+    assert balances(taker)['USDT'][0] == pytest.approx(100000 - 0.6 * 9475.0)
+
+
+def testFullFillLeavesNoLockedDust():
+    exchange = paperExchange()
+    maker = exchange.createAccount({'USDT': 10000})
+    taker = exchange.createAccount({'BTC': 1})
+
+    maker.createLimitOrder('BTCUSDT', 'buy', 0.7, 9475.1)
+    maker.createLimitOrder('BTCUSDT', 'buy', 0.3, 9475.3)
+    for _ in range(10):
+        taker.createMarketOrder('BTCUSDT', 'sell', 0.1)
+
+    assert maker.fetchOpenOrders() == []
+    assert balances(maker)['USDT'][1] == 0.0
+    assert balances(maker)['BTC'] == (pytest.approx(1.0), 0.0)
+
+
+def testMarketOrderRemainderExpires():
+    exchange = paperExchange()
+    taker = exchange.createAccount({'USDT': 100000})
+    exchange.onQuote('BTCUSDT', bid=9474.0, ask=9476.0, askSize=0.2)
+
+    orderId = taker.createMarketOrder('BTCUSDT', 'buy', 0.5)
+
+    order = taker.fetchOrder('BTCUSDT', orderId)
+    assert order['status'] == 'EXPIRED'
+    assert float(order['executedQty']) == pytest.approx(0.2)
+    assert taker.fetchOpenOrders() == []
+
+
+def testCancelTakesTheOrderIdFirst():
+    exchange = paperExchange()
+    maker = exchange.createAccount({'BTC': 1})
+    orderId = maker.createLimitOrder('BTCUSDT', 'sell', 0.5, 9475.0)
+
+    assert maker.cancelOrder(orderId)['status'] == 'CANCELED'
+    assert balances(maker)['BTC'] == (1.0, 0.0)
+    with pytest.raises(InvalidOrder):
+        maker.cancelOrder(orderId, 'BTCUSDT')
+
+
+def testInsufficientBalanceIsRejected():
+    exchange = paperExchange()
+    maker = exchange.createAccount({'USDT': 100})
+
+    with pytest.raises(InsufficientFunds):
+        maker.createLimitOrder('BTCUSDT', 'buy', 1.0, 9475.0)
+    assert balances(maker)['USDT'] == (100.0, 0.0)
+
+
+def testReadsDoNotRaceTheFills():
+    exchange = paperExchange()
+    maker = exchange.createAccount({'USDT': 10 ** 9})
+    errors = []
+
+    def read():
+        try:
+            for _ in range(2000):
+                maker.fetchOpenOrders()
+                maker.fetchBalance()
+        except RuntimeError as error:
+            errors.append(error)
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    for index in range(2000):
+        maker.createLimitOrder('BTCUSDT', 'buy', 0.01, 1000.0 + index)
+    reader.join()
+
+    assert errors == []
@@ -0,0 +1,76 @@
+# coding=utf-8
+
+from evox.connectors.pollingScheduler import PollingScheduler, fields
+
+
+class FakeMiddleware(object):
+    '''
+        Binance-like ticker whose closeTime and count change on every poll
+    '''
+
+    def __init__(self):
+        self.polls = 0
+        self.lastPrice = '9475.00'
+
+    def fetchTicker(self, symbol):
+        self.polls += 1
+        return {'symbol': symbol, 'lastPrice': self.lastPrice,
+                'closeTime': 1591000000000 + self.polls, 'count': 81234 + self.polls}
+
+    def fetchOrders(self):
+        # Vendor objects without __eq__
+        return [Order(1, self.lastPrice)]
+
+
+class Order(object):
+
+    def __init__(self, id, price):
+        self.id = id
+        self.price = price
+
+
+def poll(scheduler, subscription, number):
+    for _ in range(number):
+        scheduler._poll(subscription)
+
+
+def testWholeResultNeverBacksOff():
+    middleware = FakeMiddleware()
+    scheduler = PollingScheduler({'binance': middleware}, clock=lambda: 0.0)
+    subscription = scheduler.subscribe('binance', 'fetchTicker', 'BTCUSDT', freshness=1.0)
+
+    poll(scheduler, subscription, 4)
+    assert subscription.changes == 4
+    assert subscription.interval == 1.0
+    scheduler.stop()
+
+
+def testComparedFieldsBackOff():
+    middleware = FakeMiddleware()
+    changes = []
+    scheduler = PollingScheduler({'binance': middleware}, clock=lambda: 0.0)
+    subscription = scheduler.subscribe('binance', 'fetchTicker', 'BTCUSDT', freshness=1.0,
+                                       compare=fields('lastPrice'),
+                                       callback=lambda subscription, result: changes.append(result))
+
+    poll(scheduler, subscription, 4)
+    assert subscription.changes == 1
+    assert subscription.interval == 1.5 ** 3
+
+    middleware.lastPrice = '9480.00'
+    poll(scheduler, subscription, 1)
+    assert subscription.interval == 1.0
+    assert [change['lastPrice'] for change in changes] == ['9475.00', '9480.00']
+    scheduler.stop()
+
+
+def testObjectsComparedByAttributes():
+    middleware = FakeMiddleware()
+    scheduler = PollingScheduler({'bitfinex': middleware}, clock=lambda: 0.0)
+    subscription = scheduler.subscribe('bitfinex', 'fetchOrders', freshness=1.0,
+                                       compare=fields('id', 'price'))
+
+    poll(scheduler, subscription, 3)
+    assert subscription.changes == 1
+    assert subscription.compared == [(1, '9475.00')]
+    scheduler.stop()
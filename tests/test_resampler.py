@@ -0,0 +1,133 @@
+# coding=utf-8
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from evox.connectors.indicators import ohlcvArray
+from evox.connectors.resampler import Resampler, ResamplerException, deriveOHLCV
+
+
+START = datetime(2020, 6, 1, tzinfo=timezone.utc)
+
+
+class BitmexVenue(object):
+    '''
+        Hourly buckets as served by Bitmex: stamped at the end of the hour, newest first
+    '''
+
+    def __init__(self, hours=48):
+        self.candles = [{'timestamp': (START + timedelta(hours=hour + 1)).isoformat().replace('+00:00', '.000Z'),
+                         'symbol': 'XBTUSD', 'open': 9000.0 + hour, 'high': 9010.0 + hour,
+                         'low': 8990.0 + hour, 'close': 9001.0 + hour, 'volume': 100}
+                        for hour in range(hours)][::-1]
+
+    def fetchOHLCV(self, market, interval='1d', limit=100, reverse=True):
+        assert interval == '1h'
+        return self.candles[:limit]
+
+
+INTERVALS = ['1m', '5m', '1h', '1d']
+
+
+def testDerivedBitmexCandlesKeepTheNativeShape():
+    candles = deriveOHLCV(BitmexVenue(), 'bitmex', 'XBTUSD', '4h', 3, INTERVALS, reverse=True)
+
+    assert [candle['timestamp'] for candle in candles] == ['2020-06-03T00:00:00.000Z',
+                                                           '2020-06-02T20:00:00.000Z',
+                                                           '2020-06-02T16:00:00.000Z']
+    # Hours 44 to 47
+    assert candles[0] == {'timestamp': '2020-06-03T00:00:00.000Z', 'symbol': 'XBTUSD',
+                          'open': 9044.0, 'high': 9057.0, 'low': 9034.0, 'close': 9048.0,
+                          'volume': 400.0}
+    # Parsed like the native candles, stamped at the end of the bucket
+    assert ohlcvArray(candles, 'bitmex')[-1, 0] == (START + timedelta(hours=48)).timestamp() * 1000
+
+
+def testDerivedBitmexCandlesOldestFirst():
+    candles = deriveOHLCV(BitmexVenue(), 'bitmex', 'XBTUSD', '4h', 3, INTERVALS, reverse=False)
+
+    assert [candle['timestamp'] for candle in candles][-1] == '2020-06-03T00:00:00.000Z'
+
+
+def testTooManyBaseCandlesRaise():
+    with pytest.raises(ResamplerException):
+        deriveOHLCV(BitmexVenue(), 'bitmex', 'XBTUSD', '1M', 100, INTERVALS)
+
+
+MINUTE = 60 * 1000
+
+
+class BinanceVenue(object):
+    '''
+        Klines as served by Binance: 12 string fields, oldest first
+    '''
+
+    def __init__(self, minutes=600, start=START):
+        self.start = int(start.timestamp() * 1000)
+        self.minutes = minutes
+        self.requests = []
+
+    def kline(self, minute):
+        openTime = self.start + minute * MINUTE
+        return [openTime, f'{9000.0 + minute:.8f}', f'{9010.0 + minute:.8f}',
+                f'{8990.0 + minute:.8f}', f'{9001.0 + minute:.8f}', '1.00000000',
+                openTime + MINUTE - 1, '9000.00000000', 10, '0.50000000', '4500.00000000', '0']
+
+    def fetchOHLCV(self, market, interval='1d', limit=500):
+        assert interval == '30m'
+        self.requests.append(limit)
+        last = self.minutes // 30
+        return [self.kline(index * 30) for index in range(max(0, last - limit), last)]
+
+
+def testDerivedBinanceCandlesKeepTheNativeLayout():
+    venue = BinanceVenue()
+    candles = deriveOHLCV(venue, 'binance', 'BTCUSDT', '2h', 2, ['1m', '30m'])
+
+    # Hours 6 to 8 and 8 to 10, of four 30 minutes klines
+    assert [candle[0] for candle in candles] == [venue.start + 360 * MINUTE,
+                                                 venue.start + 480 * MINUTE]
+    assert candles[-1] == [venue.start + 480 * MINUTE, '9480.00000000', '9580.00000000',
+                           '9470.00000000', '9571.00000000', '4.00000000',
+                           venue.start + 600 * MINUTE - 1, '36000.00000000', 40,
+                           '2.00000000', '18000.00000000', '0']
+
+
+def testDerivedCandlesReuseTheCachedBaseCandles():
+    # The last kline after the second call is the one forming now
+    now = datetime.now(timezone.utc)
+    venue = BinanceVenue(start=now.replace(minute=0, second=0, microsecond=0) - timedelta(hours=11))
+    deriveOHLCV(venue, 'binance', 'BTCUSDT', '2h', 2, ['1m', '30m'])
+    venue.minutes += 60
+    candles = deriveOHLCV(venue, 'binance', 'BTCUSDT', '2h', 2, ['1m', '30m'])
+
+    # Only the klines since the previous call are fetched again
+    assert venue.requests[0] == 12
+    assert venue.requests[1] < 12
+    # The last bucket closes with the new kline
+    assert candles[-1][0] <= venue.start + 630 * MINUTE < candles[-1][6]
+    assert candles[-1][4] == '9631.00000000'
+
+
+def testCandlesRefreshIncrementally():
+    venue = BinanceVenue()
+    now = [venue.start / 1000.0 + 600 * 60]
+    resampler = Resampler(venue, 'binance', '30m', history=8, ttl=60, clock=lambda: now[0])
+
+    first = resampler.candles('BTCUSDT')
+    assert len(first) == 8 and venue.requests == [8]
+    # Cached within the ttl
+    assert resampler.candles('BTCUSDT') is first
+
+    venue.minutes += 30
+    now[0] += 30 * 60
+    array = resampler.candles('BTCUSDT')
+
+    # Since the last known kline, fetched again
+    assert venue.requests == [8, 4]
+    assert len(array) == 8
+    assert array[-1, 0] == venue.start + 600 * MINUTE
+    assert list(np.diff(array[:, 0])) == [30 * MINUTE] * 7
@@ -0,0 +1,133 @@
+# coding=utf-8
+
+import pytest
+
+from evox.connectors.orderStore import StatefulMiddleware, binanceExecutionReport
+from evox.connectors.riskEngine import RiskEngine, RiskException
+from evox.connectors.tickerEngine import TickerEngine
+
+
+def executionReport(orderId, status):
+    return {'e': 'executionReport', 'E': 1499405658658, 's': 'BTCUSDT', 'c': 'mm-1',
+            'S': 'BUY', 'o': 'LIMIT', 'f': 'GTC', 'q': '1.0', 'p': '9475.0',
+            'X': status, 'i': orderId, 'z': '1.0' if status == 'FILLED' else '0'}
+
+
+def testFillsAndCancelsFreeOpenOrders():
+    engine = RiskEngine(maxOpenOrders=2)
+    engine.onOrderAccepted('BTCUSDT', 1)
+    engine.onOrderAccepted('BTCUSDT', 2)
+    with pytest.raises(RiskException):
+        engine.check('BTCUSDT', 'buy', 1.0, 9475.0)
+
+    engine.applyOrder(binanceExecutionReport(executionReport(1, 'FILLED')))
+    engine.check('BTCUSDT', 'buy', 1.0, 9475.0)
+    engine.onOrderClosed('BTCUSDT', 2)
+    # A second close of the same order is ignored
+    engine.applyOrder(binanceExecutionReport(executionReport(2, 'CANCELED')))
+    assert engine._symbol('BTCUSDT').openOrders == 0
+
+
+def testReconcileResyncsOpenOrders():
+    class Middleware(object):
+
+        def fetchOpenOrders(self, symbol=None):
+            return [{'symbol': 'BTCUSDT', 'orderId': 3, 'status': 'NEW'}]
+
+        def fetchBalance(self):
+            return []
+
+    engine = RiskEngine(maxOpenOrders=1)
+    engine.onOrderAccepted('BTCUSDT', 1)
+    engine.onOrderAccepted('ETHUSDT', 2)
+    StatefulMiddleware(Middleware(), riskEngine=engine).reconcile()
+
+    assert engine._symbol('BTCUSDT').orders == {'3'}
+    assert engine._symbol('ETHUSDT').openOrders == 0
+
+
+def testTickerTradesFeedTheReferencePrice():
+    tickers = TickerEngine()
+    engine = RiskEngine(maxNotional=20000, priceBand=0.05)
+    engine.follow(tickers)
+    assert engine.needsPrice('BTCUSDT')
+    with pytest.raises(RiskException, match='No reference price'):
+        engine.check('BTCUSDT', 'buy', 1.0)
+
+    tickers.onTrade('BTCUSDT', 9475.0, 0.1)
+    engine.check('BTCUSDT', 'buy', 2.0)
+    with pytest.raises(RiskException, match='Price out of band'):
+        engine.check('BTCUSDT', 'buy', 1.0, 10000.0)
+    with pytest.raises(RiskException, match='Max notional'):
+        engine.check('BTCUSDT', 'buy', 3.0)
+
+
+def testInverseContractsAreValuedInXBT():
+    engine = RiskEngine(maxNotional=1.0)
+    engine.updatePrice('XBTUSD', 10000.0)
+
+    engine.check('XBTUSD', 'buy', 10000)
+    with pytest.raises(RiskException, match='Max notional'):
+        engine.check('XBTUSD', 'buy', 10001)
+
+
+def testStatefulAmendMovesTheOpenOrderToTheNewId():
+    class Middleware(object):
+
+        def __init__(self):
+            self.amended = []
+
+        def createLimitOrder(self, symbol, side, quantity, price=None):
+            return 28
+
+        def amendOrder(self, orderId, price=None, quantity=None, symbol=None, side=None):
+            # Binance cancel-replace
+            self.amended.append((orderId, price, symbol, side))
+            return {'symbol': symbol, 'orderId': 29, 'side': 'BUY', 'price': price,
+                    'origQty': '1.0', 'executedQty': '0', 'status': 'NEW'}
+
+    engine = RiskEngine(maxOpenOrders=1)
+    middleware = Middleware()
+    stateful = StatefulMiddleware(middleware, riskEngine=engine)
+    stateful.createLimitOrder('BTCUSDT', 'buy', 1.0, '9475.0')
+    engine.onOrderAccepted('BTCUSDT', 28)
+
+    stateful.amendOrder(28, '9480.0')
+
+    assert middleware.amended == [(28, '9480.0', 'BTCUSDT', 'BUY')]
+    assert [order['orderId'] for order in stateful.fetchOpenOrders()] == [29]
+    assert engine._symbol('BTCUSDT').orders == {'29'}
+
+
+def testParallelChecksReserveTheOpenOrderSlots():
+    engine = RiskEngine(maxOpenOrders=2)
+    engine.onOrderAccepted('BTCUSDT', 1)
+    first = engine.check('BTCUSDT', 'buy', 1.0, 9475.0)
+    # The free slot is held until the first order is accepted or released
+    with pytest.raises(RiskException, match='Max open orders'):
+        engine.check('BTCUSDT', 'buy', 1.0, 9475.0)
+
+    engine.release('BTCUSDT', first)
+    second = engine.check('BTCUSDT', 'buy', 1.0, 9475.0)
+    engine.onOrderAccepted('BTCUSDT', 2, second)
+    assert engine._symbol('BTCUSDT').orders == {'1', '2'}
+    assert engine._symbol('BTCUSDT').reserved == {}
+
+
+def testOpenNotionalCountsReservationsAndOpenOrders():
+    engine = RiskEngine(maxOpenNotional=25000.0)
+    engine.setOpenOrders('BTCUSDT', [{'orderId': 1, 'price': '10000.0', 'origQty': '1.5',
+                                      'executedQty': '0.5', 'status': 'PARTIALLY_FILLED'}])
+    reservation = engine.check('BTCUSDT', 'buy', 1.0, 10000.0)
+    with pytest.raises(RiskException, match='Max open notional'):
+        engine.check('BTCUSDT', 'buy', 1.0, 10000.0)
+
+    engine.release('BTCUSDT', reservation)
+    engine.check('BTCUSDT', 'buy', 1.0, 10000.0)
+
+
+def testInverseSymbolsComeFromTheContracts():
+    from evox.connectors.riskEngine import INVERSE_SYMBOLS
+
+    assert 'XBTUSD' in INVERSE_SYMBOLS
+    assert 'BTCUSDT' not in INVERSE_SYMBOLS
@@ -0,0 +1,165 @@
+# coding=utf-8
+
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from evox.connectors.dispatch import EventLoopThread
+from evox.connectors.smartOrderRouter import RouterException, SmartOrderRouter
+
+
+class FakeVenue(object):
+    '''
+        Middleware double keeping the orders it receives
+    '''
+
+    def __init__(self, book, depthKeyword):
+        self.book = book
+        self.depthKeyword = depthKeyword
+        self.sent = []
+        self.open = {}
+        self.closed = {}
+
+    def fetchOrderBook(self, symbol, **kwargs):
+        assert list(kwargs) == [self.depthKeyword]
+        return self.book
+
+    def createLimitOrder(self, symbol, side, quantity, price):
+        orderId = len(self.sent) + 1
+        self.sent.append((symbol, side, quantity, price))
+        return orderId
+
+    def fetchOpenOrders(self, symbol):
+        return list(self.open.values())
+
+    def fetchOrder(self, symbol, orderId):
+        return self.closed[orderId]
+
+
+class FakeBitfinexVenue(FakeVenue):
+
+    async def fetchOrderBook(self, market, precision='P0', length=25):
+        assert precision == 'P0'
+        return self.book
+
+    async def fetchOpenOrders(self, market=None):
+        return list(self.open.values())
+
+
+def venues():
+    return {
+        'binance': FakeVenue({'bids': [['9474.0', '1.0']],
+                              'asks': [['9475.0', '0.4'], ['9476.0', '1.0']]}, 'limit'),
+        'bitmex': FakeVenue([{'side': 'Sell', 'size': 9475, 'price': 9475.0},
+                             {'side': 'Buy', 'size': 9000, 'price': 9474.0}], 'depth'),
+        'bitfinex': FakeBitfinexVenue([[9475.5, 1, -0.3]], 'length'),
+    }
+
+
+SYMBOLS = {'binance': 'BTCUSDT', 'bitmex': 'XBTUSD', 'bitfinex': 'BTCUSD'}
+
+
+def testBitmexChildIsSentInContracts():
+    middlewares = venues()
+    router = SmartOrderRouter(middlewares)
+    parent = router.execute(SYMBOLS, 'buy', 1.2)
+
+    children = {child['venue']: child for child in parent['children']}
+    # Binance quotes the level first, Bitmex fills the rest in contracts
+    assert children['bitmex']['quantity'] == pytest.approx(0.8)
+    assert middlewares['bitmex'].sent == [('XBTUSD', 'buy', 7580, 9475.0)]
+    assert middlewares['binance'].sent == [('BTCUSDT', 'buy', 0.4, 9475.0)]
+    assert parent['averagePrice'] == pytest.approx(9475.0)
+    router.close()
+
+
+def testChildRoundingToZeroContractsIsDropped():
+    middlewares = venues()
+    middlewares['bitmex'].book = [{'side': 'Sell', 'size': 9470, 'price': 9470.0}]
+    router = SmartOrderRouter(middlewares)
+    # 0.47 contract
+    plan = router.plan(router.fetchBook(SYMBOLS), 'buy', 0.00005)
+
+    assert plan['children'] == {}
+    assert plan['planned'] == 0.0
+    assert plan['averagePrice'] is None
+    router.close()
+
+
+def testMissingSymbolSendsNothing():
+    middlewares = venues()
+    router = SmartOrderRouter(middlewares)
+    book = router.fetchBook(SYMBOLS)
+
+    with pytest.raises(RouterException):
+        router.execute({'binance': 'BTCUSDT'}, 'buy', 1.2, book=book)
+    assert all(not venue.sent for venue in middlewares.values())
+    router.close()
+
+
+def testParentStatusReadsClosedChildren():
+    middlewares = venues()
+    router = SmartOrderRouter(middlewares)
+    parent = router.execute(SYMBOLS, 'buy', 1.5)
+
+    middlewares['bitmex'].closed[1] = {'orderID': 1, 'ordStatus': 'Filled', 'cumQty': 9475}
+    middlewares['binance'].closed[1] = {'orderId': 1, 'status': 'CANCELED', 'executedQty': '0.1'}
+    middlewares['bitfinex'].open[1] = SimpleNamespace(id=1, symbol='tBTCUSD', amount=0.2,
+                                                      amount_orig=0.3, status='PARTIALLY FILLED @ 9475.5(0.1)',
+                                                      price=9475.5)
+    router.fetchParentStatus(parent)
+
+    children = {child['venue']: child for child in parent['children']}
+    assert children['bitmex']['status'] == 'filled'
+    assert children['bitmex']['filled'] == pytest.approx(1.0)
+    assert children['binance']['status'] == 'canceled'
+    assert children['binance']['filled'] == pytest.approx(0.1)
+    assert children['bitfinex']['status'] == 'open'
+    assert children['bitfinex']['filled'] == pytest.approx(0.1)
+    assert parent['status'] == 'partially_filled'
+    router.close()
+
+
+def testBitmexFillsConvertedAtAveragePrice():
+    middlewares = venues()
+    router = SmartOrderRouter(middlewares)
+    parent = router.execute(SYMBOLS, 'buy', 1.2)
+
+    # 7580 contracts filled at 9000 (better than the 9475 limit)
+    middlewares['bitmex'].closed[1] = {'orderID': 1, 'ordStatus': 'Filled', 'cumQty': 7580,
+                                       'avgPx': 9000.0}
+    router.fetchParentStatus(parent)
+
+    children = {child['venue']: child for child in parent['children']}
+    assert children['bitmex']['filled'] == pytest.approx(7580 / 9000.0)
+    router.close()
+
+
+class LoopBitfinexVenue(FakeBitfinexVenue):
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self._loopThread = EventLoopThread()
+        self.loops = set()
+
+    @property
+    def loop(self):
+        return self._loopThread.loop
+
+    async def fetchOrderBook(self, market, precision='P0', length=25):
+        self.loops.add((asyncio.get_running_loop(), threading.current_thread().name))
+        return self.book
+
+
+def testCoroutinesRunOnTheMiddlewareLoop():
+    middlewares = venues()
+    middlewares['bitfinex'] = LoopBitfinexVenue([[9475.5, 1, -0.3]], 'length')
+    router = SmartOrderRouter(middlewares)
+    for _ in range(3):
+        router.fetchBook(SYMBOLS)
+
+    assert middlewares['bitfinex'].loops == {(middlewares['bitfinex'].loop, 'evox-loop')}
+    router.close()
+    middlewares['bitfinex']._loopThread.close()
@@ -0,0 +1,59 @@
+# coding=utf-8
+
+import pytest
+
+from evox.connectors.tickerEngine import TickerEngine, binanceBars
+
+
+DAY = 86400.0
+NOW = 1591012800.0 + DAY
+
+
+def klines(start, count=1440, high=lambda index: 95.0, low=lambda index: 85.0):
+    # [open time, open, high, low, close, volume, close time, quote volume, trades]
+    return [[int((start + 60.0 * index) * 1000), '90.0', str(high(index)), str(low(index)), '92.0',
+             '2.0', 0, '180.0', 3] for index in range(count)]
+
+
+def engineWithTrades():
+    clock = [NOW]
+    engine = TickerEngine(clock=lambda: clock[0])
+    engine.onTrade('BTCUSDT', 100.0, 1.0)
+    engine.onTrade('BTCUSDT', 101.0, 1.0)
+    return engine, clock
+
+
+def testDayWindowStartsWithTheStream():
+    engine, _ = engineWithTrades()
+
+    assert not engine.coversDay('BTCUSDT')
+    assert engine.ticker('BTCUSDT')['volume'] == 2.0
+
+
+def testSeededDayWindow():
+    engine, clock = engineWithTrades()
+    start = NOW - DAY
+    engine.seedDay('BTCUSDT', binanceBars(klines(start, high=lambda index: 115.0 if index == 5 else 95.0,
+                                                 low=lambda index: 75.0 if index == 7 else 85.0)),
+                   since=start)
+
+    ticker = engine.ticker('BTCUSDT')
+    assert engine.coversDay('BTCUSDT')
+    # The first kline is a whole day old
+    assert ticker['volume'] == pytest.approx(1439 * 2.0 + 2.0)
+    assert ticker['count'] == 1439 * 3 + 2
+    assert (ticker['openPrice'], ticker['highPrice'], ticker['lowPrice']) == (90.0, 115.0, 75.0)
+    assert ticker['priceChange'] == pytest.approx(11.0)
+
+    clock[0] += 3600.0
+    ticker = engine.ticker('BTCUSDT')
+    assert ticker['volume'] == pytest.approx(1379 * 2.0 + 2.0)
+    assert (ticker['highPrice'], ticker['lowPrice']) == (101.0, 85.0)
+
+
+def testSeedSkipsBarsOfTheStream():
+    engine, _ = engineWithTrades()
+    # Candles of the last minute overlap the streamed trades
+    engine.seedDay('BTCUSDT', binanceBars(klines(NOW - 120.0, count=3)))
+
+    assert engine.ticker('BTCUSDT')['volume'] == pytest.approx(2.0 * 2 + 2.0)
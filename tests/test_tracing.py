@@ -0,0 +1,57 @@
+# coding=utf-8
+
+import pytest
+
+pytest.importorskip('requests')
+
+from evox.connectors.tracing import Tracer, TracingMiddleware, span
+
+
+class FakeMiddleware(object):
+
+    def fetchTicker(self, symbol):
+        with span('sign'):
+            pass
+        with span('decode'):
+            rows = [symbol]
+        return {'symbol': rows[0]}
+
+    def fetchCandles(self, symbol):
+        with span('decode'):
+            rows = [symbol]
+        with span('normalize'):
+            return [{'symbol': row} for row in rows]
+
+    def createOrder(self, symbol):
+        with span('decode'):
+            pass
+        raise ValueError(symbol)
+
+
+def phases(tracer):
+    return [name for name, category, *_ in tracer.spans() if category == 'phase']
+
+
+def testNormalizeFollowsDecode():
+    tracer = Tracer()
+    middleware = TracingMiddleware(FakeMiddleware(), tracer)
+
+    assert middleware.fetchTicker('BTCUSDT') == {'symbol': 'BTCUSDT'}
+    assert phases(tracer) == ['sign', 'decode', 'normalize']
+
+
+def testOwnNormalizeSpanIsKept():
+    tracer = Tracer()
+    middleware = TracingMiddleware(FakeMiddleware(), tracer)
+
+    middleware.fetchCandles('XBTUSD')
+    assert phases(tracer) == ['decode', 'normalize']
+
+
+def testFailedCallHasNoNormalize():
+    tracer = Tracer()
+    middleware = TracingMiddleware(FakeMiddleware(), tracer)
+
+    with pytest.raises(ValueError):
+        middleware.createOrder('XBTUSD')
+    assert phases(tracer) == ['decode']
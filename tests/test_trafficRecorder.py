@@ -0,0 +1,125 @@
+# coding=utf-8
+
+import asyncio
+
+import pytest
+
+from evox.connectors.errors import RateLimited
+from evox.connectors.trafficRecorder import (REST_RESPONSE, WS_MESSAGE, RecordedObject,
+                                             ReplayException, TrafficRecorder,
+                                             TrafficReplayer, rawPayload)
+
+
+class Order(object):
+    # Stand-in of a bfxapi Order
+
+    def __init__(self, id, mts_update, amount):
+        self.id = id
+        self.mts_update = mts_update
+        self.amount = amount
+
+
+class Middleware(object):
+
+    def fetchTicker(self, symbol):
+        return {'symbol': symbol, 'lastPrice': '9475.00'}
+
+    def fetchBalance(self):
+        raise ValueError('Invalid API key')
+
+    def fetchAllOrders(self, symbol):
+        yield [{'orderId': 1}, {'orderId': 2}]
+        yield [{'orderId': 3}]
+
+    def fetchOrder(self, symbol, orderId):
+        raise RateLimited('Rate limit exceeded', code=-1003, exchange='binance', status=429)
+
+    def fetchMyTrades(self, symbol):
+        for page in range(3):
+            yield [{'tradeId': page}]
+
+    async def fetchOpenOrders(self, market):
+        return [Order(1, 1574698260000, 0.2), Order(2, 1574698261000, -0.1)]
+
+
+@pytest.fixture
+def log(tmp_path):
+    path = str(tmp_path / 'traffic.log')
+    with TrafficRecorder(path, compress=True) as recorder:
+        middleware = recorder.wrap(Middleware())
+        recorder.record(WS_MESSAGE, 'bitmex', '{"a":1}')
+        middleware.fetchTicker('X')
+        recorder.record(WS_MESSAGE, 'bitmex', '{"a":2}')
+        middleware.fetchTicker('X')
+        with pytest.raises(ValueError):
+            middleware.fetchBalance()
+        recorder.record(WS_MESSAGE, 'binance', '{"a":3}')
+        list(middleware.fetchAllOrders('BTCUSDT'))
+        asyncio.run(middleware.fetchOpenOrders('BTCUSD'))
+        with pytest.raises(RateLimited):
+            middleware.fetchOrder('BTCUSDT', 1)
+        for page in middleware.fetchMyTrades('BTCUSDT'):
+            break
+        list(middleware.fetchMyTrades('BTCUSDT'))
+    return path
+
+
+def testReplayMixedLog(log):
+    replayer = TrafficReplayer(log)
+    middleware = replayer.middleware()
+
+    assert middleware.fetchTicker('X') == {'symbol': 'X', 'lastPrice': '9475.00'}
+    assert middleware.fetchTicker('X') == {'symbol': 'X', 'lastPrice': '9475.00'}
+    with pytest.raises(ReplayException):
+        middleware.fetchTicker('X')
+    with pytest.raises(ReplayException, match='Invalid API key'):
+        middleware.fetchBalance()
+    assert list(middleware.fetchAllOrders('BTCUSDT')) == [[{'orderId': 1}, {'orderId': 2}],
+                                                         [{'orderId': 3}]]
+    replayer.close()
+
+
+def testReplayVendorObjects(log):
+    replayer = TrafficReplayer(log)
+    orders = asyncio.run(replayer.middleware().fetchOpenOrders('BTCUSD'))
+
+    assert all(isinstance(order, RecordedObject) for order in orders)
+    assert [order.id for order in orders] == [1, 2]
+    assert min(getattr(order, 'mts_update') for order in orders) == 1574698260000
+    replayer.close()
+
+
+def testPlayFrames(log):
+    replayer = TrafficReplayer(log)
+
+    assert [rawPayload(record) for record in replayer.play()] == [b'{"a":1}', b'{"a":2}', b'{"a":3}']
+    assert len([record for record in replayer.play(kind=REST_RESPONSE)]) == 14
+    replayer.close()
+
+
+def testReplayTypedErrors(log):
+    replayer = TrafficReplayer(log)
+    middleware = replayer.middleware()
+
+    with pytest.raises(RateLimited) as error:
+        middleware.fetchOrder('BTCUSDT', 1)
+    assert isinstance(error.value, ReplayException)
+    assert error.value.retryable
+    assert (error.value.code, error.value.status, error.value.exchange) == (-1003, 429, 'binance')
+    assert error.value.type == 'RateLimited'
+    with pytest.raises(ReplayException) as error:
+        middleware.fetchBalance()
+    assert not error.value.retryable and error.value.type == 'ValueError'
+    replayer.close()
+
+
+def testReplayPartiallyConsumedPages(log):
+    replayer = TrafficReplayer(log)
+    middleware = replayer.middleware()
+
+    for page in middleware.fetchMyTrades('BTCUSDT'):
+        break
+    assert page == [{'tradeId': 0}]
+    assert list(middleware.fetchMyTrades('BTCUSDT')) == [[{'tradeId': 0}], [{'tradeId': 1}],
+                                                         [{'tradeId': 2}]]
+    replayer.close()
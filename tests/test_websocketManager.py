@@ -0,0 +1,148 @@
+# coding=utf-8
+
+import asyncio
+import json
+
+import pytest
+
+pytest.importorskip('websockets')
+
+from evox.connectors import websocketManager
+from evox.connectors.websocketManager import (BitfinexStream, BitmexStream, WebSocketManager,
+                                              WebSocketSession, WebsocketException)
+
+
+class FakeSocket(object):
+    '''
+        Socket double: frames sent are kept, frames received come from a queue
+    '''
+
+    def __init__(self):
+        self.sent = []
+        self.received = asyncio.Queue()
+
+    async def send(self, message):
+        self.sent.append((asyncio.get_running_loop().time(), message))
+
+    async def recv(self):
+        frame = await self.received.get()
+        if isinstance(frame, Exception):
+            raise frame
+        return frame
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+@pytest.fixture
+def sockets(monkeypatch):
+    opened = []
+
+    def connect(url):
+        opened.append(FakeSocket())
+        return opened[-1]
+
+    monkeypatch.setattr(websocketManager.websockets, 'connect', connect)
+    return opened
+
+
+async def settle():
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+
+def testBitmexRowsAreRoutedBySymbol():
+    message = {'table': 'trade', 'action': 'insert',
+               'data': [{'symbol': 'XBTUSD', 'price': 9475.5},
+                        {'symbol': 'ETHUSD', 'price': 240.1},
+                        {'symbol': 'XBTUSD', 'price': 9476.0}]}
+    routed = dict(BitmexStream().route(message))
+
+    assert [row['price'] for row in routed['trade:XBTUSD']['data']] == [9475.5, 9476.0]
+    assert [row['price'] for row in routed['trade:ETHUSD']['data']] == [240.1]
+
+
+def testBitfinexChannelsAreRoutedByChanId():
+    stream = BitfinexStream()
+    stream.route({'event': 'subscribed', 'channel': 'ticker', 'chanId': 17, 'symbol': 'tBTCUSD'})
+    stream.route({'event': 'subscribed', 'channel': 'candles', 'chanId': 18,
+                  'key': 'trade:1m:tBTCUSD'})
+
+    assert stream.route([17, 'hb']) == ()
+    assert stream.route([17, [9475.0, 1.2]]) == (('ticker:tBTCUSD', [9475.0, 1.2]),)
+    assert stream.route([18, [1591000000000, 9475.0]])[0][0] == 'candles:trade:1m:tBTCUSD'
+    assert list(stream.subscribeMessages(['ticker:tBTCUSD'], subscribe=False)) == \
+        [json.dumps({'event': 'unsubscribe', 'chanId': 17})]
+
+
+def testSubscriptionsAreBatchedAndPaced(sockets):
+    async def run():
+        manager = WebSocketManager()
+        await manager.subscribe('binance', 'trade', 'BTCUSDT')
+        await settle()
+        symbols = [f'SYM{index}USDT' for index in range(30)]
+        for symbol in symbols:
+            await manager.subscribe('binance', 'trade', symbol)
+        await manager.subscribe('binance', 'depth', 'ETHUSDT')
+        await settle()
+        await asyncio.sleep(0.3)
+        await manager.close()
+        return symbols
+
+    symbols = asyncio.run(run())
+    assert len(sockets) == 1
+    frames = [json.loads(message) for _, message in sockets[0].sent]
+    assert [frame['params'] for frame in frames] == \
+        [['btcusdt@trade'], [f'{symbol.lower()}@trade' for symbol in symbols] + ['ethusdt@depth']]
+    # 4 control frames per second at most
+    times = [sent for sent, _ in sockets[0].sent]
+    assert times[1] - times[0] >= 0.24
+
+
+def testDuplicateDoesNotOpenASocket(sockets):
+    async def run():
+        manager = WebSocketManager()
+        subscription = await manager.subscribe('bitfinex', 'ticker', 'tBTCUSD')
+        # The only session is full: a duplicate must not start a new one
+        manager._sessions['bitfinex'][0].profile.maxSubscriptions = 1
+        with pytest.raises(WebsocketException):
+            await manager.subscribe('bitfinex', 'ticker', 'tBTCUSD')
+        stats = manager.stats()
+        await manager.unsubscribe(subscription)
+        await manager.close()
+        return stats
+
+    stats = asyncio.run(run())
+    assert stats['bitfinex']['sockets'] == 1
+    assert len(sockets) <= 1
+
+
+def testReconnectResubscribesAndResyncs(sockets):
+    async def run():
+        session = WebSocketSession('bitmex', reconnectDelay=0.01)
+        received = []
+        resyncs = []
+        subscription = websocketManager.Subscription('bitmex', 'quote:XBTUSD',
+                                                     callback=received.append,
+                                                     onResync=resyncs.append)
+        await session.add(subscription)
+        session.start()
+        await settle()
+        sockets[0].received.put_nowait(ConnectionError('reset'))
+        await asyncio.sleep(0.05)
+        sockets[1].received.put_nowait(json.dumps({'table': 'quote', 'action': 'insert',
+                                                   'data': [{'symbol': 'XBTUSD', 'bidPrice': 9475.0}]}))
+        await settle()
+        reconnects = session.reconnects
+        await session.close()
+        return received, resyncs, reconnects
+
+    received, resyncs, reconnects = asyncio.run(run())
+    assert reconnects == 1
+    assert len(resyncs) == 2
+    assert received[0]['data'][0]['bidPrice'] == 9475.0
+    for socket in sockets[:2]:
+        assert json.loads(socket.sent[0][1]) == {'op': 'subscribe', 'args': ['quote:XBTUSD']}